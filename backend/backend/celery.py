@@ -5,7 +5,8 @@ from django.conf import settings
 # Set the default Django settings module
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-app = Celery('backend')
+# TimedTask records worker-side stage timings for the send_message traces
+app = Celery('backend', task_cls='operation.instrumentation:TimedTask')
 
 # Load task modules from all registered Django apps
 app.config_from_object('django.conf:settings', namespace='CELERY')
@@ -1,4 +1,5 @@
 import os
+import shutil
 from pathlib import Path
 import dj_database_url
 
@@ -103,6 +104,10 @@ LOGGING = {
             'handlers': ['console'],
             'level': 'INFO',
         },
+        'operation.trace': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
     },
 }
 
@@ -132,9 +137,25 @@ MIDDLEWARE = [
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+    },
+    # Shared between web and worker processes
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+        'KEY_PREFIX': 'operation',
+    },
 }
 
+# LLM Backend ('gemini', or 'stub' for the in-process stand-in used in development and load tests)
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'gemini')
+LLM_MODEL = os.environ.get('LLM_MODEL', 'gemini-2.0-flash-lite')
+LLM_STUB_LATENCY = os.environ.get('LLM_STUB_LATENCY', 'lognormal:300,0.5')  # fixed:ms, uniform:lo,hi or lognormal:median,sigma
+LLM_STUB_CHUNK_DELAY = os.environ.get('LLM_STUB_CHUNK_DELAY', 'fixed:50')
+
+# Request Tracing
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.1'))  # Fraction of requests logged as full traces
+TRACE_RESULT_TTL = 600  # Seconds worker-side timings are kept for the web process to collect
+
 ROOT_URLCONF = 'backend.urls'
 
 TEMPLATES = [
@@ -182,22 +203,121 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
-# Media Files
+# Media Files (with a bucket, MEDIA_ROOT is only this node's local copy of what is in it)
 if os.environ.get('AWS_STORAGE_BUCKET_NAME'):
     DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
     AWS_STORAGE_BUCKET_NAME = os.environ.get('AWS_STORAGE_BUCKET_NAME')
     AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
-    AWS_S3_REGION_NAME = 'us-east-1'  # Update to your region
+    AWS_S3_REGION_NAME = os.environ.get('AWS_S3_REGION_NAME', 'us-east-1')
+    AWS_S3_ENDPOINT_URL = os.environ.get('AWS_S3_ENDPOINT_URL')  # Any S3-compatible service, e.g. MinIO
     AWS_S3_FILE_OVERWRITE = False
     MEDIA_URL = f'https://{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/'
 else:
     MEDIA_URL = '/media/'
-    MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
-    TEMP_DIR = os.path.join(MEDIA_ROOT, 'temp')
-    PROCESSED_DIR = os.path.join(MEDIA_ROOT, 'processed')
-    os.makedirs(TEMP_DIR, exist_ok=True)
-    os.makedirs(PROCESSED_DIR, exist_ok=True)
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+TEMP_DIR = os.path.join(MEDIA_ROOT, 'temp')
+PROCESSED_DIR = os.path.join(MEDIA_ROOT, 'processed')
+os.makedirs(TEMP_DIR, exist_ok=True)
+os.makedirs(PROCESSED_DIR, exist_ok=True)
+
+# Storage (where uploads and results live, named by their path under MEDIA_ROOT: 'local'
+# is MEDIA_ROOT itself, so web and workers share a disk; 's3' is AWS_STORAGE_BUCKET_NAME,
+# written in STORAGE_MULTIPART_CHUNK_SIZE parts; 'memory' is in-process, for tests)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 's3' if os.environ.get('AWS_STORAGE_BUCKET_NAME') else 'local')
+STORAGE_PREFIX = os.environ.get('STORAGE_PREFIX', 'media/')  # Key prefix in the bucket
+STORAGE_MULTIPART_CHUNK_SIZE = int(os.environ.get('STORAGE_MULTIPART_CHUNK_SIZE', str(8 * 1024 * 1024)))  # S3 parts are 5 MiB at least
+
+# Scratch Workspaces (per-task intermediates; jobs under the budget go to tmpfs)
+SCRATCH_DIR = os.environ.get('SCRATCH_DIR', os.path.join(BASE_DIR, 'scratch'))
+SCRATCH_TMPFS_DIR = os.environ.get('SCRATCH_TMPFS_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else '')
+SCRATCH_TMPFS_BUDGET = int(os.environ.get('SCRATCH_TMPFS_BUDGET', str(256 * 1024 * 1024)))
+SCRATCH_FOOTPRINT_FACTOR = 3  # Expected scratch usage as a multiple of input size
+
+# External Converters
+WKHTMLTOPDF_PATH = os.environ.get('WKHTMLTOPDF_PATH', shutil.which('wkhtmltopdf') or r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe')
+
+# Office Conversion Pool (headless LibreOffice used by word/ppt/excel_to_pdf)
+SOFFICE_BINARY = os.environ.get('SOFFICE_BINARY', 'soffice')
+OFFICE_POOL_SIZE = int(os.environ.get('OFFICE_POOL_SIZE', '2'))
+OFFICE_POOL_MAX_JOBS = int(os.environ.get('OFFICE_POOL_MAX_JOBS', '50'))  # Recycle an instance after this many jobs
+OFFICE_CONVERT_TIMEOUT = int(os.environ.get('OFFICE_CONVERT_TIMEOUT', '120'))  # Seconds before a job counts as hung
+OFFICE_POOL_STARTUP_TIMEOUT = int(os.environ.get('OFFICE_POOL_STARTUP_TIMEOUT', '30'))
+OFFICE_POOL_ACQUIRE_TIMEOUT = int(os.environ.get('OFFICE_POOL_ACQUIRE_TIMEOUT', '300'))
+OFFICE_POOL_PREWARM = os.environ.get('OFFICE_POOL_PREWARM', 'true') == 'true'
+# 'office' renders DOCX through the LibreOffice pool, 'native' through the in-process PyMuPDF renderer
+WORD_TO_PDF_ENGINE = os.environ.get('WORD_TO_PDF_ENGINE', 'office')
+
+# Task Deadlines and Cancellation (tasks expire this long after enqueue; running
+# tasks poll the shared cache for a cancel flag at most once per interval)
+TASK_DEADLINE_SECONDS = int(os.environ.get('TASK_DEADLINE_SECONDS', '300'))
+CANCEL_POLL_INTERVAL = float(os.environ.get('CANCEL_POLL_INTERVAL', '0.5'))
+
+# Task Progress (published as Celery PROGRESS state, at most once per interval)
+PROGRESS_MIN_INTERVAL = float(os.environ.get('PROGRESS_MIN_INTERVAL', '0.25'))
+
+# Operation Pipelines (chained operations run inside one worker task)
+PIPELINE_MAX_STEPS = int(os.environ.get('PIPELINE_MAX_STEPS', '8'))
+PIPELINE_MAX_WORKERS = int(os.environ.get('PIPELINE_MAX_WORKERS', str(os.cpu_count() or 2)))
+
+# Image Batches (multi-image conversions and resizes run on up to IMAGE_BATCH_WORKERS threads,
+# starting an image only while the decoded images in flight fit IMAGE_BATCH_MEMORY_BUDGET bytes)
+IMAGE_BATCH_WORKERS = int(os.environ.get('IMAGE_BATCH_WORKERS', str(os.cpu_count() or 2)))
+IMAGE_BATCH_MEMORY_BUDGET = int(os.environ.get('IMAGE_BATCH_MEMORY_BUDGET', str(512 * 1024 * 1024)))
+
+# Admission Control (per-client token buckets in the shared cache, sized in job
+# cost: one token per request plus one per ADMISSION_BYTES_PER_TOKEN uploaded;
+# new work is refused while the task queue is deeper than ADMISSION_MAX_QUEUE_DEPTH)
+ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true') == 'true'
+ADMISSION_BUCKET_CAPACITY = float(os.environ.get('ADMISSION_BUCKET_CAPACITY', '200'))
+ADMISSION_REFILL_RATE = float(os.environ.get('ADMISSION_REFILL_RATE', '1'))  # Tokens per second
+ADMISSION_BYTES_PER_TOKEN = int(os.environ.get('ADMISSION_BYTES_PER_TOKEN', str(1024 * 1024)))
+ADMISSION_MAX_QUEUE_DEPTH = int(os.environ.get('ADMISSION_MAX_QUEUE_DEPTH', '100'))
+ADMISSION_QUEUE_PROBE_INTERVAL = 2  # Seconds a queue depth reading is reused
+ADMISSION_TASK_SECONDS = float(os.environ.get('ADMISSION_TASK_SECONDS', '10'))  # Typical task run time, for wait estimates
+ADMISSION_WORKER_SLOTS = int(os.environ.get('ADMISSION_WORKER_SLOTS', str(os.cpu_count() or 2)))
+ADMISSION_TRUST_FORWARDED_FOR = os.environ.get('ADMISSION_TRUST_FORWARDED_FOR', 'false') == 'true'  # Behind a proxy that sets it
+
+# Compression Sessions (original and measured quality/size points kept for
+# "now 300kb" follow-ups; a variant within the tolerance of a target is reused.
+# Under MEDIA_ROOT, so sessions are kept in storage like uploads and results)
+COMPRESSION_SESSION_DIR = os.path.join(MEDIA_ROOT, 'compression_sessions')
+COMPRESSION_SESSION_TTL = int(os.environ.get('COMPRESSION_SESSION_TTL', '3600'))
+COMPRESSION_SESSION_TOLERANCE = float(os.environ.get('COMPRESSION_SESSION_TOLERANCE', '0.15'))
+COMPRESSION_SESSION_MIN_STEP = 0.02  # Smallest quality factor change worth another Ghostscript pass
+
+# PDF Compression ('ghostscript' rewrites every page through Ghostscript; 'images'
+# re-encodes only the embedded images with PyMuPDF and Pillow, on PDF_RECOMPRESS_WORKERS
+# threads; 'race' runs both plus a lossless rewrite at once and keeps the first result
+# under the target). Jobs may ask for any of them with an "engine" param.
+PDF_COMPRESSION_ENGINE = os.environ.get('PDF_COMPRESSION_ENGINE', 'ghostscript')
+PDF_RECOMPRESS_WORKERS = int(os.environ.get('PDF_RECOMPRESS_WORKERS', str(os.cpu_count() or 2)))
+COMPRESSION_RACE_CPU_BUDGET = int(os.environ.get('COMPRESSION_RACE_CPU_BUDGET', '2'))  # Backends running at once per job
+# A backend that has raced COMPRESSION_RACE_MIN_RUNS times on a document class and won under
+# COMPRESSION_RACE_MIN_WIN_RATE of them sits out, bar a COMPRESSION_RACE_EXPLORE share of races
+COMPRESSION_RACE_MIN_RUNS = int(os.environ.get('COMPRESSION_RACE_MIN_RUNS', '20'))
+COMPRESSION_RACE_MIN_WIN_RATE = float(os.environ.get('COMPRESSION_RACE_MIN_WIN_RATE', '0.05'))
+COMPRESSION_RACE_EXPLORE = float(os.environ.get('COMPRESSION_RACE_EXPLORE', '0.1'))
+
+# Perceptual Quality (a job's "quality_floor" param: true for PERCEPTUAL_MIN_SSIM, or an SSIM
+# of its own; outputs are compared on luma planes downsampled to PERCEPTUAL_MAX_SIDE pixels,
+# PDFs on up to PERCEPTUAL_PDF_PAGES rendered pages)
+PERCEPTUAL_MIN_SSIM = float(os.environ.get('PERCEPTUAL_MIN_SSIM', '0.97'))
+PERCEPTUAL_MIN_PSNR = float(os.environ.get('PERCEPTUAL_MIN_PSNR', '30'))  # dB
+PERCEPTUAL_MAX_SIDE = int(os.environ.get('PERCEPTUAL_MAX_SIDE', '256'))
+PERCEPTUAL_PDF_PAGES = int(os.environ.get('PERCEPTUAL_PDF_PAGES', '3'))
+
+# Job Cost Estimates (pre-flight cost model fitted with `manage.py fit_cost_model`;
+# with COST_HEAVY_QUEUE set, jobs predicted above COST_HEAVY_CPU_SECONDS go to
+# that queue, which needs its own workers, e.g. for COST_HEAVY_QUEUE=heavy
+# `celery -A backend worker -Q heavy --concurrency 2`. Unset, every job stays
+# on the default queue)
+COST_MODEL_PATH = os.environ.get('COST_MODEL_PATH', os.path.join(BASE_DIR, 'operation', 'data', 'cost_model.json'))
+COST_PDF_SAMPLE_PAGES = 20  # Pages inspected for embedded images; the rest is extrapolated
+COST_HEAVY_CPU_SECONDS = float(os.environ.get('COST_HEAVY_CPU_SECONDS', '30'))
+COST_HEAVY_QUEUE = os.environ.get('COST_HEAVY_QUEUE') or None
+COST_MAX_CPU_SECONDS = float(os.environ.get('COST_MAX_CPU_SECONDS', str(TASK_DEADLINE_SECONDS * 0.8)))
+COST_MAX_MEMORY_BYTES = int(os.environ.get('COST_MAX_MEMORY_BYTES', str(2 * 1024 ** 3)))
 
 DATA_UPLOAD_MAX_NUMBER_FILES = 1000
 APPEND_SLASH = True
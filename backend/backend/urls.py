@@ -27,6 +27,7 @@ urlpatterns = [
     path('', lambda request: HttpResponseRedirect('/api/')),
     path('accounts/', include('allauth.urls')),
     path('api/download/<str:file_path>/', views.download_file, name='download_file'),
+    path('metrics', views.metrics, name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -4,7 +4,7 @@ set -o errexit
 
 # Install system dependencies
 apt-get update
-apt-get install -y wkhtmltopdf ghostscript poppler-utils
+apt-get install -y wkhtmltopdf ghostscript poppler-utils libreoffice-core libreoffice-writer libreoffice-calc libreoffice-impress python3-uno
 
 # Install Python dependencies
 pip install -r requirements.txt
@@ -0,0 +1,164 @@
+import functools
+import logging
+import math
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+
+logger = logging.getLogger(__name__)
+
+# Refill and take from a bucket in one round trip so concurrent web processes
+# can't both spend the same tokens. Returns {admitted, tokens left, wait seconds}.
+_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(state[1]) or capacity
+local at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - at) * rate)
+local admitted = 0
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    admitted = 1
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {admitted, tostring(tokens), tostring(wait)}
+"""
+
+
+class TokenBucket:
+    """
+    Per-client token bucket kept in the shared cache. Buckets hold up to
+    `capacity` tokens and refill at `rate` tokens per second; a request takes
+    as many tokens as its estimated cost. On the Redis cache the refill and
+    take are a single Lua call; other cache backends (locmem in tests) fall
+    back to a get/set, which is only safe within one process.
+    """
+
+    def __init__(self, capacity, rate, alias="shared"):
+        self.capacity = capacity
+        self.rate = rate
+        self.cache = caches[alias]
+
+    def take(self, key, cost):
+        """Returns (admitted, seconds until `cost` tokens would be available)."""
+        key = f"admission_{key}"
+        now = time.time()
+        client = self._redis_client()
+        if client is not None:
+            admitted, _, wait = client.eval(
+                _TAKE_SCRIPT, 1, self.cache.make_and_validate_key(key), self.capacity, self.rate, cost, now,
+            )
+            return bool(admitted), float(wait)
+
+        tokens, at = self.cache.get(key) or (self.capacity, now)
+        tokens = min(self.capacity, tokens + max(0.0, now - at) * self.rate)
+        admitted = tokens >= cost
+        if admitted:
+            tokens -= cost
+        self.cache.set(key, (tokens, now), timeout=math.ceil(self.capacity / self.rate) + 1)
+        return admitted, 0.0 if admitted else (cost - tokens) / self.rate
+
+    def _redis_client(self):
+        redis_cache = getattr(self.cache, "_cache", None)
+        if redis_cache is None or not hasattr(redis_cache, "get_client"):
+            return None
+        return redis_cache.get_client(write=True)
+
+
+def client_key(request):
+    """Buckets are per user when logged in, otherwise per client address."""
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return f"user_{user.pk}"
+    address = request.META.get("REMOTE_ADDR", "")
+    if settings.ADMISSION_TRUST_FORWARDED_FOR:
+        forwarded = request.META.get("HTTP_X_FORWARDED_FOR", "")
+        address = forwarded.split(",")[0].strip() or address
+    return f"ip_{address}"
+
+
+def estimate_cost(request):
+    """
+    Job cost in tokens, from the request line and headers only: one token per
+    request plus one per ADMISSION_BYTES_PER_TOKEN of body. Reading the body
+    would spool the uploads, which is what admission is meant to prevent.
+    """
+    try:
+        content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        content_length = 0
+    return 1 + content_length / settings.ADMISSION_BYTES_PER_TOKEN
+
+
+def estimated_wait(depth):
+    """Seconds until a newly queued job would start, given `depth` jobs ahead of it."""
+    return depth * settings.ADMISSION_TASK_SECONDS / max(1, settings.ADMISSION_WORKER_SLOTS)
+
+
+def _cached_queue_depth():
+    # Each web process probes the broker at most once per interval
+    cache = caches["default"]
+    depth = cache.get("admission_queue_depth")
+    if depth is None:
+        from .task_registry import queue_depth
+        try:
+            depth = queue_depth()
+        except Exception as e:
+            logger.warning(f"Could not read queue depth: {str(e)}")
+            depth = 0
+        cache.set("admission_queue_depth", depth, timeout=settings.ADMISSION_QUEUE_PROBE_INTERVAL)
+    return depth
+
+
+def _reject(message, retry_after, **extra):
+    retry_after = max(1, math.ceil(retry_after))
+    response = JsonResponse({"error": message, "retry_after": retry_after, **extra}, status=429)
+    response["Retry-After"] = str(retry_after)
+    return response
+
+
+def admission_controlled(view):
+    """
+    Admits a POST to `view` only if the backlog is below ADMISSION_MAX_QUEUE_DEPTH
+    and the client's token bucket covers the job's estimated cost; otherwise
+    answers 429 with Retry-After. It has to sit outside anything that touches
+    request.POST/FILES, since the check must run before uploads are read.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != "POST" or not settings.ADMISSION_ENABLED:
+            return view(request, *args, **kwargs)
+
+        cost = estimate_cost(request)
+        if cost > settings.ADMISSION_BUCKET_CAPACITY:
+            return JsonResponse({"error": "Upload is larger than a single request may be."}, status=413)
+
+        depth = _cached_queue_depth()
+        if depth >= settings.ADMISSION_MAX_QUEUE_DEPTH:
+            wait = estimated_wait(depth)
+            logger.warning(f"Rejecting request: {depth} jobs queued, estimated wait {wait:.0f}s")
+            return _reject("The service is busy, please try again shortly.", wait,
+                           queue_depth=depth, estimated_wait_seconds=round(wait))
+
+        key = client_key(request)
+        bucket = TokenBucket(settings.ADMISSION_BUCKET_CAPACITY, settings.ADMISSION_REFILL_RATE)
+        try:
+            admitted, wait = bucket.take(key, cost)
+        except Exception as e:
+            # Fail open: an unreachable cache shouldn't take the service down with it
+            logger.warning(f"Rate limiter unavailable, admitting request: {str(e)}")
+            admitted, wait = True, 0.0
+        if not admitted:
+            logger.info(f"Rate limited {key} (cost {cost:.1f}, retry in {wait:.1f}s)")
+            return _reject("Too many requests, please slow down.", wait,
+                           estimated_wait_seconds=round(estimated_wait(depth)))
+        return view(request, *args, **kwargs)
+    return wrapper
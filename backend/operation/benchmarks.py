@@ -0,0 +1,398 @@
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import threading
+import time
+from datetime import datetime, timezone
+import fitz
+import openpyxl
+import psutil
+from docx import Document
+from docx.shared import Inches
+from PIL import Image, ImageDraw, ImageFilter
+from pptx import Presentation
+from pptx.util import Inches as PptxInches
+from . import cost_model
+
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore".split()
+
+PROFILES = {
+    "quick": {"megapixels": [1, 4], "pages": [1, 10], "scanned_pages": [1, 10]},
+    "full": {"megapixels": [1, 4, 12], "pages": [1, 10, 100, 1000], "scanned_pages": [1, 10, 100, 1000]},
+}
+
+
+# Fixtures
+
+def build_photo(path, megapixels, seed=0):
+    """Deterministic photo-like JPEG: smooth gradients, shapes, blur and sensor noise."""
+    rng = random.Random(seed)
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    base = Image.merge("RGB", [
+        Image.linear_gradient("L").resize((width, height)),
+        Image.linear_gradient("L").rotate(90).resize((width, height)),
+        Image.radial_gradient("L").resize((width, height)),
+    ])
+    draw = ImageDraw.Draw(base)
+    for _ in range(40):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randrange(width // 40, width // 6)
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=colour)
+    base = base.filter(ImageFilter.GaussianBlur(radius=max(1, width // 400)))
+    noise = Image.frombytes("L", (width, height), rng.randbytes(width * height)).convert("RGB")
+    Image.blend(base, noise, 0.12).save(path, "JPEG", quality=92)
+    return path
+
+
+def _page_text(rng, lines=45):
+    return "\n".join(" ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 12))) for _ in range(lines))
+
+
+def build_text_pdf(path, pages, seed=0):
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(page.rect + (54, 54, -54, -54), _page_text(rng), fontsize=10)
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+    return path
+
+
+def build_scanned_pdf(path, pages, seed=0, dpi=150):
+    """Image-only pages, like a scanner produces: each page is a rendered JPEG."""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        with fitz.open() as scratch:
+            page = scratch.new_page()
+            page.insert_textbox(page.rect + (54, 54, -54, -54), _page_text(rng), fontsize=10)
+            pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+            width, height = page.rect.width, page.rect.height
+        target = doc.new_page(width=width, height=height)
+        target.insert_image(target.rect, stream=pixmap.tobytes("jpeg", jpg_quality=85))
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+    return path
+
+
+def build_sample_docx(path, paragraphs, seed=0):
+    rng = random.Random(seed)
+    image = Image.new("RGB", (640, 360), (90, 140, 200))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+
+    doc = Document()
+    doc.add_heading("Benchmark document", level=1)
+    for i in range(paragraphs):
+        if i % 50 == 0:
+            doc.add_heading(f"Section {i // 50 + 1}", level=2)
+        paragraph = doc.add_paragraph()
+        for _ in range(rng.randint(3, 8)):
+            run = paragraph.add_run(" ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))) + " ")
+            run.bold = rng.random() < 0.1
+            run.italic = rng.random() < 0.1
+        if i % 100 == 99:
+            table = doc.add_table(rows=4, cols=3)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = rng.choice(WORDS)
+        if i % 200 == 199:
+            buffer.seek(0)
+            doc.add_picture(buffer, width=Inches(4))
+    doc.save(path)
+    return path
+
+
+def build_sample_xlsx(path, rows, seed=0):
+    rng = random.Random(seed)
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["id", "name", "quantity", "price", "total"])
+    for i in range(rows):
+        quantity, price = rng.randint(1, 100), round(rng.uniform(1, 500), 2)
+        sheet.append([i, rng.choice(WORDS), quantity, price, f"=C{i + 2}*D{i + 2}"])
+    workbook.save(path)
+    return path
+
+
+def build_sample_pptx(path, slides, seed=0):
+    rng = random.Random(seed)
+    prs = Presentation()
+    for i in range(slides):
+        slide = prs.slides.add_slide(prs.slide_layouts[1])
+        slide.shapes.title.text = f"Slide {i + 1}"
+        body = slide.placeholders[1].text_frame
+        body.text = " ".join(rng.choice(WORDS) for _ in range(8))
+        for _ in range(4):
+            body.add_paragraph().text = " ".join(rng.choice(WORDS) for _ in range(8))
+        slide.shapes.add_textbox(PptxInches(1), PptxInches(6), PptxInches(8), PptxInches(1)).text_frame.text = "footer"
+    prs.save(path)
+    return path
+
+
+def build_fixtures(fixture_dir, profile="quick"):
+    """Creates (or reuses) the deterministic input files for a profile."""
+    os.makedirs(fixture_dir, exist_ok=True)
+    settings = PROFILES[profile]
+    fixtures = {"photos": {}, "text_pdfs": {}, "scanned_pdfs": {}}
+
+    def cached(name, builder, *args):
+        path = os.path.join(fixture_dir, name)
+        if not os.path.exists(path):
+            builder(path, *args)
+        return path
+
+    for mp in settings["megapixels"]:
+        fixtures["photos"][mp] = cached(f"photo_{mp}mp.jpg", build_photo, mp, mp)
+    for pages in settings["pages"]:
+        fixtures["text_pdfs"][pages] = cached(f"text_{pages}p.pdf", build_text_pdf, pages, pages)
+    for pages in settings["scanned_pages"]:
+        fixtures["scanned_pdfs"][pages] = cached(f"scanned_{pages}p.pdf", build_scanned_pdf, pages, pages)
+    fixtures["docx"] = cached("sample.docx", build_sample_docx, 500)
+    fixtures["xlsx"] = cached("sample.xlsx", build_sample_xlsx, 2000)
+    fixtures["pptx"] = cached("sample.pptx", build_sample_pptx, 30)
+    return fixtures
+
+
+# Cases
+
+def build_cases(fixtures):
+    """
+    Returns a list of (name, task, make_args) where make_args(run_dir) copies
+    the inputs into run_dir (tasks delete their inputs) and returns
+    (args, output_paths).
+    """
+    from . import tasks
+
+    def staged(run_dir, *sources):
+        copies = []
+        for source in sources:
+            target = os.path.join(run_dir, "in_" + os.path.basename(source))
+            shutil.copyfile(source, target)
+            copies.append(target)
+        return copies
+
+    def out(run_dir, name):
+        return os.path.join(run_dir, name)
+
+    cases = []
+    photos = fixtures["photos"]
+    for mp, photo in photos.items():
+        cases.append((f"resize_image/size/{mp}mp", tasks.resize_image_task, lambda d, p=photo: (
+            (staged(d, p)[0], out(d, "resized.jpg"), {"size": "200kb"}), [out(d, "resized.jpg")])))
+        cases.append((f"resize_image/resolution/{mp}mp", tasks.resize_image_task, lambda d, p=photo: (
+            (staged(d, p)[0], out(d, "resized.jpg"), {"width": 800, "height": 600}), [out(d, "resized.jpg")])))
+        cases.append((f"convert_image_format/png/{mp}mp", tasks.convert_image_format, lambda d, p=photo: (
+            (staged(d, p)[0], out(d, "converted.png"), "PNG"), [out(d, "converted.png")])))
+
+    all_photos = list(photos.values())
+    cases.append(("images_to_pdf", tasks.images_to_pdf, lambda d: (
+        (staged(d, *all_photos), out(d, "images.pdf")), [out(d, "images.pdf")])))
+    cases.append(("convert_and_compress_images_to_pdf/1mb", tasks.convert_and_compress_images_to_pdf, lambda d: (
+        (staged(d, *all_photos), out(d, "converted.pdf"), out(d, "compressed.pdf"), "1MB"),
+        [out(d, "converted.pdf"), out(d, "compressed.pdf")])))
+
+    for kind in ("text_pdfs", "scanned_pdfs"):
+        label = kind.split("_")[0]
+        for pages, pdf in fixtures[kind].items():
+            # Ghostscript keeps the unsuffixed names so older baselines still compare
+            for engine, suffix in (("ghostscript", ""), ("images", "/images")):
+                cases.append((f"compress_pdf/{label}/{pages}p{suffix}", tasks.compress_pdf, lambda d, p=pdf, e=engine: (
+                    (staged(d, p)[0], out(d, "compressed.pdf"), "500kb", None, e), [out(d, "compressed.pdf")])))
+    for pages, pdf in fixtures["text_pdfs"].items():
+        cases.append((f"pdf_to_word/{pages}p", tasks.pdf_to_word, lambda d, p=pdf: (
+            (staged(d, p)[0], out(d, "out.docx")), [out(d, "out.docx")])))
+        cases.append((f"pdf_to_excel/{pages}p", tasks.pdf_to_excel, lambda d, p=pdf: (
+            (staged(d, p)[0], out(d, "out.xlsx")), [out(d, "out.xlsx")])))
+        cases.append((f"pdf_to_ppt/{pages}p", tasks.pdf_to_ppt, lambda d, p=pdf: (
+            (staged(d, p)[0], out(d, "out.pptx")), [out(d, "out.pptx")])))
+
+    cases.append(("word_to_pdf", tasks.word_to_pdf, lambda d: (
+        (staged(d, fixtures["docx"])[0], out(d, "out.pdf")), [out(d, "out.pdf")])))
+    cases.append(("excel_to_pdf", tasks.excel_to_pdf, lambda d: (
+        (staged(d, fixtures["xlsx"])[0], out(d, "out.pdf")), [out(d, "out.pdf")])))
+    cases.append(("ppt_to_pdf", tasks.ppt_to_pdf, lambda d: (
+        (staged(d, fixtures["pptx"])[0], out(d, "out.pdf")), [out(d, "out.pdf")])))
+    first_photo = all_photos[0]
+    cases.append(("convert_parallel_operations", tasks.convert_parallel_operations, lambda d: (
+        (*staged(d, fixtures["docx"], first_photo), out(d, "first.pdf"), out(d, "second.jpg"),
+         "convert_to_pdf", "resize", {"width": 800, "height": 600}),
+        [out(d, "first.pdf"), out(d, "second.jpg")])))
+    return cases
+
+
+# Measurement
+
+class PeakRSSSampler:
+    """Samples RSS of this process plus its children (Ghostscript, soffice) in the background."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        total = self._process.memory_info().rss
+        for child in self._process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        self.peak = max(self.peak, total)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample()
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def _children_cpu():
+    times = psutil.Process().cpu_times()
+    return times.children_user + times.children_system
+
+
+def _input_files(args):
+    paths = []
+    for arg in args:
+        for value in arg if isinstance(arg, list) else [arg]:
+            if isinstance(value, str) and os.path.isfile(value):
+                paths.append(value)
+    return paths
+
+
+def measure(task, make_args, run_dir, operation=None):
+    """
+    Runs one task body eagerly and returns its wall/CPU time, peak RSS and
+    output size, plus the cost model's work units for its inputs so reports
+    can be used to fit the model.
+    """
+    os.makedirs(run_dir, exist_ok=True)
+    args, output_paths = make_args(run_dir)
+    work_units = None
+    if operation in cost_model.DRIVERS:
+        features = cost_model.combine(cost_model.inspect_file(path) for path in _input_files(args))
+        work_units = cost_model.work_units(operation, features)
+    with PeakRSSSampler() as sampler:
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time() + _children_cpu()
+        result = task.apply(args=args, throw=True)
+        cpu = time.process_time() + _children_cpu() - cpu_start
+        wall = time.perf_counter() - wall_start
+    result.get()
+    return {
+        "wall_s": wall,
+        "cpu_s": cpu,
+        "peak_rss_bytes": sampler.peak,
+        "output_bytes": sum(os.path.getsize(p) for p in output_paths if os.path.exists(p)),
+        "work_units": work_units,
+    }
+
+
+def run_suite(work_dir, profile="quick", repeat=3, only=None, log=print):
+    fixtures = build_fixtures(os.path.join(work_dir, "fixtures"), profile)
+    results = {}
+    for name, task, make_args in build_cases(fixtures):
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        samples = []
+        error = None
+        for attempt in range(repeat):
+            run_dir = os.path.join(work_dir, "runs", f"{len(results)}_{attempt}")
+            try:
+                samples.append(measure(task, make_args, run_dir, operation=name.split("/")[0]))
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                break
+            finally:
+                shutil.rmtree(run_dir, ignore_errors=True)
+        if error:
+            results[name] = {"error": error}
+            log(f"{name:45} error: {error}")
+            continue
+        results[name] = {
+            key: statistics.median(sample[key] for sample in samples)
+            for key in ("wall_s", "cpu_s", "peak_rss_bytes", "output_bytes")
+        }
+        results[name]["repeat"] = len(samples)
+        results[name]["work_units"] = samples[0]["work_units"]
+        log(f"{name:45} {results[name]['wall_s'] * 1000:10.1f} ms wall  {results[name]['cpu_s'] * 1000:10.1f} ms cpu  "
+            f"{results[name]['peak_rss_bytes'] / 2**20:8.1f} MiB  {results[name]['output_bytes']} bytes")
+    return {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "profile": profile,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+
+def save_report(report, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def load_report(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare_engines(report):
+    """
+    Rows of (case, Ghostscript wall, image engine wall, speedup, Ghostscript
+    bytes, image engine bytes) for each compress_pdf case run with both engines.
+    """
+    rows = []
+    results = report["results"]
+    for name, images in sorted(results.items()):
+        if not (name.startswith("compress_pdf/") and name.endswith("/images")):
+            continue
+        ghostscript = results.get(name[:-len("/images")])
+        if ghostscript is None or "error" in ghostscript or "error" in images:
+            continue
+        speedup = ghostscript["wall_s"] / images["wall_s"] if images["wall_s"] else 0.0
+        rows.append((name[:-len("/images")], ghostscript["wall_s"], images["wall_s"], speedup,
+                     ghostscript["output_bytes"], images["output_bytes"]))
+    return rows
+
+
+def compare_reports(baseline, current, threshold=0.10):
+    """
+    Returns rows of (name, metric, baseline, current, relative change, regressed)
+    for every case present in both reports. A baseline case that is missing
+    from the current report or failed in it gives a single regressed row with
+    metric "error", the error text as current value and no change.
+    """
+    rows = []
+    for name, base in sorted(baseline["results"].items()):
+        now = current["results"].get(name)
+        if now is None or "error" in now:
+            error = "missing from current report" if now is None else now["error"]
+            rows.append((name, "error", base.get("error"), error, None, True))
+            continue
+        if "error" in base:
+            continue
+        for metric in ("wall_s", "cpu_s", "peak_rss_bytes", "output_bytes"):
+            before, after = base[metric], now[metric]
+            change = (after - before) / before if before else 0.0
+            rows.append((name, metric, before, after, change, change > threshold))
+    return rows
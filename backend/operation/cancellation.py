@@ -0,0 +1,116 @@
+import contextvars
+import logging
+import subprocess
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+class TaskCancelled(Exception):
+    """The client cancelled the task; it must stop and not be retried."""
+
+
+class DeadlineExceeded(TaskCancelled):
+    """The task ran past the deadline its caller was willing to wait for."""
+
+
+def _cancel_key(task_id):
+    return f"task_cancel_{task_id}"
+
+
+def parse_deadline(expires):
+    """Epoch seconds for a Celery `expires` value (ISO string or datetime), or None."""
+    if not expires:
+        return None
+    if isinstance(expires, str):
+        expires = datetime.fromisoformat(expires)
+    return expires.timestamp()
+
+
+class CancellationToken:
+    """
+    Cooperative cancellation for one task run. Long loops call check() between
+    units of work; it raises once the task's deadline has passed or a cancel
+    flag for the task id shows up in the shared cache. The flag is polled at
+    most every CANCEL_POLL_INTERVAL seconds to keep checks cheap.
+    """
+
+    def __init__(self, task_id=None, deadline=None):
+        self.task_id = task_id
+        self.deadline = deadline
+        self._cancelled = False
+        self._polled_at = 0.0
+
+    def remaining(self):
+        return None if self.deadline is None else self.deadline - time.time()
+
+    def cancelled(self):
+        if not self._cancelled and self.task_id:
+            now = time.monotonic()
+            if now - self._polled_at >= settings.CANCEL_POLL_INTERVAL:
+                self._polled_at = now
+                try:
+                    self._cancelled = bool(caches["shared"].get(_cancel_key(self.task_id)))
+                except Exception as e:
+                    logger.warning(f"Could not read cancel flag for task {self.task_id}: {str(e)}")
+        return self._cancelled
+
+    def check(self):
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise DeadlineExceeded(f"Task {self.task_id} passed its deadline")
+        if self.cancelled():
+            raise TaskCancelled(f"Task {self.task_id} was cancelled")
+
+
+_current_token = contextvars.ContextVar("cancellation_token", default=None)
+
+
+def current_token():
+    return _current_token.get()
+
+
+@contextmanager
+def cancellation_scope(token):
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+def check_cancelled():
+    """Raises TaskCancelled if the current task has been cancelled or is past its deadline."""
+    token = _current_token.get()
+    if token is not None:
+        token.check()
+
+
+def flag_cancelled(task_id):
+    caches["shared"].set(_cancel_key(task_id), True, timeout=settings.TASK_DEADLINE_SECONDS * 2)
+
+
+def run_subprocess(command, poll_interval=0.2):
+    """
+    subprocess.run(command, check=True, capture_output=True) that kills the
+    child as soon as the current task is cancelled or runs out of time.
+    """
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=poll_interval)
+            break
+        except subprocess.TimeoutExpired:
+            try:
+                check_cancelled()
+            except TaskCancelled:
+                logger.info(f"Killing {command[0]} (pid {process.pid}) for a cancelled task")
+                process.kill()
+                process.communicate()
+                raise
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
@@ -0,0 +1,183 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Ghostscript downsampling targets the planner chooses between, highest first
+RESOLUTION_LEVELS = (150, 110, 72, 50)
+MIN_QUALITY = 0.1
+MAX_QUALITY = 0.9
+
+# Engines a lossy plan can be carried out with (see tasks.COMPRESSION_PASSES),
+# and the hedged mode that races them (see compression_race)
+ENGINES = ("ghostscript", "images")
+RACE_ENGINE = "race"
+
+# Documents whose image streams are under this share of the file are treated
+# as text: quality and resolution can't shrink them, a lossless rewrite can
+TEXT_ONLY_IMAGE_SHARE = 0.1
+
+# Deflate typically leaves this much of an uncompressed content stream
+DEFLATE_RATIO = 0.3
+
+# Slack on the predicted minimum before a target is declared impossible
+IMPOSSIBLE_MARGIN = 0.9
+
+# Pages inspected for image placement; totals are extrapolated from them
+SAMPLE_PAGES = 50
+
+
+class CompressionImpossible(ValueError):
+    """The requested size is below what the document can be compressed to."""
+
+
+def bytes_per_pixel(quality, components=3):
+    # Rough JPEG cost of a downsampled colour pixel at a Ghostscript quality factor
+    return (0.05 + 0.45 * quality * quality) * components / 3
+
+
+def _stream_length(doc, xref):
+    kind, value = doc.xref_get_key(xref, "Length")
+    if kind == "int":
+        return int(value)
+    return len(doc.xref_stream_raw(xref))
+
+
+def analyse_pdf(path):
+    """
+    What's in a PDF, read from its object table and page image placements:
+    every image XObject with its pixel count, effective DPI on the page,
+    colour components and stored bytes, plus font program bytes and the
+    bytes of streams stored without any compression filter.
+    """
+    import fitz
+    file_size = os.path.getsize(path)
+    with fitz.open(path) as doc:
+        pages = doc.page_count
+        step = max(1, pages // SAMPLE_PAGES)
+        sampled = range(0, pages, step)
+        images = {}
+        for number in sampled:
+            for info in doc[number].get_image_info(xrefs=True):
+                xref = info.get("xref")
+                if not xref:
+                    continue  # Inline images are part of the content stream
+                placed_width = fitz.Rect(info["bbox"]).width / 72
+                dpi = info["width"] / placed_width if placed_width > 0 else 0
+                image = images.setdefault(xref, {
+                    "pixels": info["width"] * info["height"],
+                    "components": info.get("colorspace") or 3,
+                    "bytes": _stream_length(doc, xref),
+                    "dpi": 0,
+                })
+                image["dpi"] = max(image["dpi"], dpi)
+
+        font_bytes = 0
+        uncompressed_bytes = 0
+        for xref in range(1, doc.xref_length()):
+            if doc.xref_get_key(xref, "Type")[1] == "/FontDescriptor":
+                for key in ("FontFile", "FontFile2", "FontFile3"):
+                    kind, value = doc.xref_get_key(xref, key)
+                    if kind == "xref":
+                        font_bytes += _stream_length(doc, int(value.split()[0]))
+            elif doc.xref_is_stream(xref) and doc.xref_get_key(xref, "Filter")[0] == "null":
+                uncompressed_bytes += _stream_length(doc, xref)
+
+    scale = pages / len(sampled) if pages else 1
+    image_bytes = sum(image["bytes"] for image in images.values()) * scale
+    return {
+        "file_size": file_size,
+        "pages": pages,
+        "image_count": round(len(images) * scale),
+        "image_pixels": sum(image["pixels"] for image in images.values()) * scale,
+        "image_bytes": image_bytes,
+        "max_image_dpi": max((image["dpi"] for image in images.values()), default=0),
+        "font_bytes": font_bytes,
+        "uncompressed_bytes": uncompressed_bytes,
+        "images": list(images.values()),
+        "scale": scale,
+    }
+
+
+def fixed_bytes(analysis):
+    """Bytes no image setting can remove: fonts, text and vector content, after deflate."""
+    other = max(0, analysis["file_size"] - analysis["image_bytes"] - analysis["font_bytes"] - analysis["uncompressed_bytes"])
+    return analysis["font_bytes"] + other + analysis["uncompressed_bytes"] * DEFLATE_RATIO
+
+
+def predict_size(analysis, quality, resolution):
+    """Expected output size of a Ghostscript pass at this quality and downsampling resolution."""
+    image_bytes = 0
+    for image in analysis["images"]:
+        pixels = image["pixels"]
+        if image["dpi"] > resolution:
+            pixels *= (resolution / image["dpi"]) ** 2
+        # Re-encoding never makes a stream bigger than Ghostscript would leave it
+        image_bytes += min(image["bytes"], pixels * bytes_per_pixel(quality, image["components"]))
+    return fixed_bytes(analysis) + image_bytes * analysis["scale"]
+
+
+def _quality_for(analysis, resolution, target_size_bytes):
+    """Highest quality whose predicted size at `resolution` fits the target."""
+    quality = MAX_QUALITY
+    while quality > MIN_QUALITY and predict_size(analysis, quality, resolution) > target_size_bytes:
+        quality = round(quality - 0.05, 2)
+    return max(MIN_QUALITY, quality)
+
+
+def plan_compression(input_path, target_size_bytes, analysis=None, engine="ghostscript"):
+    """
+    Chooses how to compress input_path to target_size_bytes:
+
+    - "copy" when it already fits;
+    - "lossless" (a single rewrite that drops unused objects and deflates
+      streams) for text documents, where image settings change nothing;
+    - `engine` (one of ENGINES, or RACE_ENGINE) otherwise, starting at the
+      highest resolution level and quality the size model predicts will fit.
+
+    Raises CompressionImpossible when the target is below the predicted
+    minimum size, before any compression pass is spent on it.
+    """
+    analysis = analysis or analyse_pdf(input_path)
+    plan = {
+        "engine": engine,
+        "quality": MAX_QUALITY,
+        "resolution": RESOLUTION_LEVELS[0],
+        "min_size": int(predict_size(analysis, MIN_QUALITY, RESOLUTION_LEVELS[-1])),
+    }
+    if analysis["file_size"] <= target_size_bytes:
+        plan["engine"] = "copy"
+        return plan
+
+    text_only = analysis["image_bytes"] < analysis["file_size"] * TEXT_ONLY_IMAGE_SHARE
+    if text_only:
+        plan["min_size"] = int(fixed_bytes(analysis) + analysis["image_bytes"])
+
+    if target_size_bytes < plan["min_size"] * IMPOSSIBLE_MARGIN:
+        detail = f"fonts take about {analysis['font_bytes'] // 1024} KB" if analysis["font_bytes"] else \
+            f"it has {analysis['pages']} pages of content"
+        raise CompressionImpossible(
+            f"This PDF can't be compressed below about {plan['min_size'] // 1024} KB ({detail}); "
+            f"the requested {target_size_bytes // 1024} KB isn't reachable."
+        )
+
+    if text_only:
+        plan["engine"] = "lossless"
+        return plan
+
+    # Never "downsample" to more than the images already have
+    levels = [level for level in RESOLUTION_LEVELS if level < analysis["max_image_dpi"]] or [RESOLUTION_LEVELS[-1]]
+    for resolution in levels:
+        if predict_size(analysis, 0.3, resolution) <= target_size_bytes:
+            break
+    plan["resolution"] = resolution
+    plan["quality"] = _quality_for(analysis, resolution, target_size_bytes)
+    logger.info(f"Compression plan for {input_path}: {plan} "
+                f"({analysis['image_count']} images, {analysis['image_pixels'] / 1e6:.1f} MP, max {analysis['max_image_dpi']:.0f} dpi)")
+    return plan
+
+
+def lower_resolution(resolution):
+    """Next resolution level below `resolution`, or None at the bottom."""
+    lower = [level for level in RESOLUTION_LEVELS if level < resolution]
+    return lower[0] if lower else None
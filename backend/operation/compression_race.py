@@ -0,0 +1,182 @@
+import concurrent.futures
+import contextvars
+import logging
+import os
+import random
+import threading
+from django.conf import settings
+from django.core.cache import caches
+from .cancellation import CancellationToken, TaskCancelled, cancellation_scope, check_cancelled, current_token
+from .compression_planner import TEXT_ONLY_IMAGE_SHARE
+
+logger = logging.getLogger(__name__)
+
+# Share of the file in images above which a document counts as a scan
+SCANNED_IMAGE_SHARE = 0.8
+
+
+def document_class(analysis):
+    """"text", "scanned" or "mixed", from an analyse_pdf result; win rates are kept per class."""
+    share = analysis["image_bytes"] / analysis["file_size"] if analysis["file_size"] else 0
+    if share < TEXT_ONLY_IMAGE_SHARE:
+        return "text"
+    if share >= SCANNED_IMAGE_SHARE and analysis["image_count"] >= analysis["pages"]:
+        return "scanned"
+    return "mixed"
+
+
+# Win rates
+
+def _stat_key(doc_class, backend, field):
+    return f"compression_race_{doc_class}_{backend}_{field}"
+
+
+def _increment(key):
+    cache = caches["shared"]
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)  # Evicted between add and incr
+
+
+def record_outcome(doc_class, entrants, winner):
+    """Counts a race for every backend that ran, and a win for the one that met the target first."""
+    try:
+        for backend in entrants:
+            _increment(_stat_key(doc_class, backend, "runs"))
+        if winner is not None:
+            _increment(_stat_key(doc_class, winner, "wins"))
+    except Exception as e:
+        logger.warning(f"Could not record compression race outcome: {str(e)}")
+
+
+def win_rates(doc_class, backends):
+    """{backend: (wins, runs)} for one document class."""
+    try:
+        stats = caches["shared"].get_many(
+            [_stat_key(doc_class, backend, field) for backend in backends for field in ("wins", "runs")]
+        )
+    except Exception as e:
+        logger.warning(f"Could not read compression race win rates: {str(e)}")
+        stats = {}
+    return {
+        backend: (stats.get(_stat_key(doc_class, backend, "wins"), 0), stats.get(_stat_key(doc_class, backend, "runs"), 0))
+        for backend in backends
+    }
+
+
+def rank_backends(doc_class, backends):
+    """
+    Backends in the order they should start, most likely winner first.
+    Once a backend has raced COMPRESSION_RACE_MIN_RUNS times on a class and
+    wins under COMPRESSION_RACE_MIN_WIN_RATE of them it sits out, except for
+    a COMPRESSION_RACE_EXPLORE share of races that keep its rate current.
+    """
+    rates = win_rates(doc_class, backends)
+    # Laplace-smoothed, so untried backends rank in the middle rather than last
+    ranked = sorted(backends, key=lambda backend: -(rates[backend][0] + 1) / (rates[backend][1] + 2))
+    kept = [
+        backend for backend in ranked
+        if rates[backend][1] < settings.COMPRESSION_RACE_MIN_RUNS
+        or rates[backend][0] / rates[backend][1] >= settings.COMPRESSION_RACE_MIN_WIN_RATE
+        or random.random() < settings.COMPRESSION_RACE_EXPLORE
+    ]
+    return kept or ranked[:1]
+
+
+def preferred_backend(doc_class, backends):
+    return rank_backends(doc_class, backends)[0]
+
+
+# Racing
+
+class RacerToken(CancellationToken):
+    """The task's own token, plus a flag the race sets once this racer's result is no longer wanted."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent.task_id if parent else None, parent.deadline if parent else None)
+        self.parent = parent
+        self.stopped = threading.Event()
+        self.started = False
+
+    def cancelled(self):
+        return self.stopped.is_set() or (self.parent is not None and self.parent.cancelled())
+
+
+def _run_racer(compress, output_pdf_path, token):
+    token.started = True
+    with cancellation_scope(token):
+        compress(output_pdf_path)
+    return os.path.getsize(output_pdf_path)
+
+
+def race(backends, output_pdf_path, target_size_bytes, doc_class, progress=None):
+    """
+    Runs the `backends` ({name: compress(output_path)}) concurrently, at
+    most COMPRESSION_RACE_CPU_BUDGET at a time in rank_backends order, each
+    into its own file beside output_pdf_path. The first to finish under
+    target_size_bytes wins (the largest, i.e. best quality, if several
+    finish together) and the rest are cancelled; if none gets under, the
+    smallest result is kept. Returns the winning backend's name.
+    """
+    entrants = rank_backends(doc_class, list(backends))
+    parent = current_token()
+    tokens = {name: RacerToken(parent) for name in entrants}
+    paths = {name: f"{output_pdf_path}.{name}" for name in entrants}
+    sizes = {}
+    errors = []
+    if progress is not None:
+        progress.start("compress", total=len(entrants))
+
+    slots = max(1, min(len(entrants), settings.COMPRESSION_RACE_CPU_BUDGET))
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=slots, thread_name_prefix="race")
+    try:
+        # Backends start only as slots free up and the race is still open, so
+        # those queued behind a winner never run, and never count as losing
+        queued = list(entrants)
+        futures = {}
+        winner = None
+        while (queued or futures) and winner is None:
+            while queued and len(futures) < slots:
+                name = queued.pop(0)
+                # Run in a copy of the task's context so racers keep its stage timer
+                futures[executor.submit(contextvars.copy_context().run, _run_racer, backends[name], paths[name], tokens[name])] = name
+            done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = futures.pop(future)
+                try:
+                    sizes[name] = future.result()
+                    logger.info(f"Compression race ({doc_class}): {name} finished at {sizes[name]} bytes, target {target_size_bytes}")
+                except TaskCancelled:
+                    check_cancelled()  # Re-raises if the task itself was cancelled
+                except Exception as e:
+                    logger.warning(f"Compression race ({doc_class}): {name} failed: {str(e)}")
+                    errors.append(e)
+                if progress is not None:
+                    progress.advance(name="compress")
+            fitting = [name for name in sizes if sizes[name] <= target_size_bytes]
+            if fitting:
+                winner = max(fitting, key=lambda name: sizes[name])
+    finally:
+        # Racers still running stop at their next cancellation check
+        for token in tokens.values():
+            token.stopped.set()
+        executor.shutdown(wait=True)
+        if progress is not None:
+            progress.finish("compress")
+
+    # Backends that never started neither won nor lost
+    record_outcome(doc_class, [name for name in entrants if tokens[name].started], winner)
+    chosen = winner or min(sizes, key=lambda name: sizes[name], default=None)
+    try:
+        if chosen is None:
+            raise errors[0] if errors else ValueError("No compression backend produced a result")
+        os.replace(paths[chosen], output_pdf_path)
+    finally:
+        for path in paths.values():
+            if os.path.exists(path):
+                os.remove(path)
+    logger.info(f"Compression race ({doc_class}) won by {chosen}" if winner else
+                f"Compression race ({doc_class}): nothing met the target, keeping {chosen}'s {sizes[chosen]} bytes")
+    return chosen
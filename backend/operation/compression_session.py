@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from contextlib import closing
+from django.conf import settings
+from .compression_planner import ENGINES, MAX_QUALITY, MIN_QUALITY
+from .storage import get_storage, localize, publish, storage_name, stored_exists
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "session.json"
+ORIGINAL_FILE = "original.pdf"
+DEFAULT_ENGINE = ENGINES[0]
+
+
+
+class CompressionSession:
+    """
+    Everything learnt while compressing one document for one user: the
+    original PDF, and every compression pass made from it as a
+    (quality, resolution, engine, size, variant file) point. Follow-up targets
+    ("now 300kb") are served from an existing variant when one is close
+    enough, or reached by interpolating on the measured size/quality curve
+    for the planned resolution and engine and compressing the original again, never
+    an already-compressed copy.
+
+    The original, the variants and the manifest are kept in storage, named
+    after their paths under COMPRESSION_SESSION_DIR (inside MEDIA_ROOT), so a
+    follow-up can run on any worker: files are fetched to this node as they
+    are needed. Only workers open sessions. They are removed
+    COMPRESSION_SESSION_TTL seconds after their last use.
+    """
+
+    def __init__(self, session_id, manifest):
+        self.id = session_id
+        self.path = self._path(session_id)
+        self.original_size = manifest["original_size"]
+        self.points = manifest["points"]
+
+    @property
+    def original(self):
+        return localize(os.path.join(self.path, ORIGINAL_FILE))
+
+    @staticmethod
+    def _path(session_id):
+        return os.path.join(settings.COMPRESSION_SESSION_DIR, f"session_{os.path.basename(str(session_id))}")
+
+    @classmethod
+    def new_id(cls):
+        return uuid.uuid4().hex
+
+    @classmethod
+    def open(cls, session_id):
+        """The session, or None if it never existed, expired or lost its original."""
+        if not session_id:
+            return None
+        path = cls._path(session_id)
+        manifest = _read_manifest(os.path.join(path, MANIFEST_FILE))
+        if manifest is None or not stored_exists(os.path.join(path, ORIGINAL_FILE)):
+            return None
+        session = cls(session_id, manifest)
+        # Keep a session in use from expiring
+        session._save()
+        return session
+
+    @classmethod
+    def open_or_create(cls, session_id, original_path):
+        """Opens `session_id`, or starts it with a copy of `original_path` as the original."""
+        session = cls.open(session_id)
+        if session is not None:
+            return session
+        prune_expired()
+        path = cls._path(session_id)
+        os.makedirs(path, exist_ok=True)
+        original = os.path.join(path, ORIGINAL_FILE)
+        shutil.copyfile(original_path, original)
+        publish(original, original)
+        session = cls(session_id, {"original_size": os.path.getsize(original_path), "points": []})
+        session._save()
+        return session
+
+    def _save(self):
+        manifest = os.path.join(self.path, MANIFEST_FILE)
+        data = json.dumps({"original_size": self.original_size, "points": self.points}).encode("utf-8")
+        name = storage_name(manifest)
+        if name is not None:
+            with get_storage().writer(name) as f:
+                f.write(data)
+            return
+        with open(f"{manifest}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{manifest}.tmp", manifest)
+
+    def variant_path(self, quality, resolution, engine=DEFAULT_ENGINE):
+        return os.path.join(self.path, f"variant_{engine}_{resolution}dpi_{quality:.3f}.pdf")
+
+    def _stored_variant(self, point):
+        return self.variant_path(point["quality"], point["resolution"], point.get("engine", DEFAULT_ENGINE))
+
+    def point_path(self, point):
+        """Local path of a measured variant, fetched from storage if this node doesn't have it."""
+        return localize(self._stored_variant(point))
+
+    def record(self, quality, resolution, size, engine=DEFAULT_ENGINE):
+        """Adds the pass just written to variant_path(quality, resolution, engine), storing the variant."""
+        variant = self.variant_path(quality, resolution, engine)
+        publish(variant, variant)
+        key = (quality, resolution, engine)
+        self.points = [point for point in self.points
+                       if (point["quality"], point["resolution"], point.get("engine", DEFAULT_ENGINE)) != key]
+        self.points.append({"quality": quality, "resolution": resolution, "engine": engine, "size": size})
+        self.points.sort(key=lambda point: (point.get("engine", DEFAULT_ENGINE), point["resolution"], point["quality"]))
+        self._save()
+
+    def _measured(self, resolution=None, engine=None):
+        # Each engine and resolution has its own size curve; any measured variant can be served
+        return [point for point in self.points
+                if (resolution is None or point["resolution"] == resolution)
+                and (engine is None or point.get("engine", DEFAULT_ENGINE) == engine)
+                and stored_exists(self._stored_variant(point))]
+
+    def best_variant(self, target_size_bytes):
+        """Largest existing variant that fits the target, as a point, or None."""
+        fitting = [point for point in self._measured() if point["size"] <= target_size_bytes]
+        return max(fitting, key=lambda point: point["size"], default=None)
+
+    def smallest_variant(self):
+        return min(self._measured(), key=lambda point: point["size"], default=None)
+
+    def next_quality(self, target_size_bytes, resolution, start_quality=MAX_QUALITY, engine=DEFAULT_ENGINE):
+        """
+        Quality factor to try next with `engine` at `resolution` for the
+        target, interpolated between the nearest measured points on either
+        side of it (or start_quality before any are measured), or None when
+        the curve is already known closely enough that another pass can't
+        do better.
+        """
+        points = self._measured(resolution, engine)
+        below = max((p for p in points if p["size"] <= target_size_bytes), key=lambda p: p["quality"], default=None)
+        above = min((p for p in points if p["size"] > target_size_bytes), key=lambda p: p["quality"], default=None)
+
+        if below is None and above is None:
+            return start_quality
+        if below is None:
+            # Everything measured so far is too big: extrapolate down the curve
+            higher = [p for p in points if p["quality"] > above["quality"]]
+            if above["quality"] <= MIN_QUALITY:
+                return None
+            if higher:
+                quality = _interpolate(above, min(higher, key=lambda p: p["quality"]), target_size_bytes)
+            else:
+                quality = above["quality"] - 0.2
+            return round(max(MIN_QUALITY, min(quality, above["quality"] - settings.COMPRESSION_SESSION_MIN_STEP)), 3)
+        if above is None:
+            # Everything fits: the original itself bounds the curve from above
+            above = {"quality": 1.0, "size": self.original_size}
+            if above["size"] <= target_size_bytes:
+                return None
+        if above["quality"] - below["quality"] < 2 * settings.COMPRESSION_SESSION_MIN_STEP:
+            return None
+        quality = _interpolate(below, above, target_size_bytes)
+        low = below["quality"] + settings.COMPRESSION_SESSION_MIN_STEP
+        high = min(MAX_QUALITY, above["quality"] - settings.COMPRESSION_SESSION_MIN_STEP)
+        if low > high:
+            return None
+        return round(max(low, min(quality, high)), 3)
+
+    def close_enough(self, point, target_size_bytes):
+        return point is not None and point["size"] >= target_size_bytes * (1 - settings.COMPRESSION_SESSION_TOLERANCE)
+
+
+def _interpolate(a, b, target_size_bytes):
+    """Quality where the straight line through points a and b reaches the target size."""
+    if b["size"] == a["size"]:
+        return (a["quality"] + b["quality"]) / 2
+    fraction = (target_size_bytes - a["size"]) / (b["size"] - a["size"])
+    return a["quality"] + fraction * (b["quality"] - a["quality"])
+
+
+def _read_manifest(path):
+    name = storage_name(path)
+    try:
+        if name is None:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        storage = get_storage()
+        if not storage.exists(name):
+            return None
+        with closing(storage.open(name)) as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def prune_expired():
+    """
+    Removes sessions not used for COMPRESSION_SESSION_TTL seconds from
+    storage, and this node's copies of any session that isn't live any more.
+    """
+    root = settings.COMPRESSION_SESSION_DIR
+    cutoff = time.time() - settings.COMPRESSION_SESSION_TTL
+    live = None
+    prefix = storage_name(root)
+    if prefix is not None:
+        storage = get_storage()
+        sessions = {}
+        for name, modified in storage.list(f"{prefix}/"):
+            session, _, file = name[len(prefix) + 1:].partition("/")
+            sessions.setdefault(session, {})[file] = modified
+        live = set()
+        for session, files in sessions.items():
+            # A session being created has no manifest yet: go by its newest file
+            if files.get(MANIFEST_FILE, max(files.values())) >= cutoff:
+                live.add(session)
+                continue
+            logger.debug(f"Removing expired compression session {session}")
+            for file in files:
+                storage.delete(f"{prefix}/{session}/{file}")
+    if not os.path.isdir(root):
+        return
+    for name in os.listdir(root):
+        if live is not None and name in live:
+            continue
+        path = os.path.join(root, name)
+        manifest = os.path.join(path, MANIFEST_FILE)
+        try:
+            last_used = os.path.getmtime(manifest if os.path.exists(manifest) else path)
+        except OSError:
+            continue
+        if last_used < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
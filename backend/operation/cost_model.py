@@ -0,0 +1,214 @@
+import functools
+import json
+import logging
+import os
+import zipfile
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+OFFICE_EXTENSIONS = (".docx", ".xlsx", ".pptx")
+
+# The input feature each operation's cost grows with. Costs are modelled as
+# intercept + slope * driver, fitted per operation from benchmark reports.
+DRIVERS = {
+    "resize_image": lambda f: f["megapixels"],
+    "convert_image_format": lambda f: f["megapixels"],
+    "images_to_pdf": lambda f: f["megapixels"],
+    "convert_and_compress_images_to_pdf": lambda f: f["megapixels"],
+    "compress_pdf": lambda f: f["pages"] + f["image_megapixels"],
+    "pdf_to_word": lambda f: f["pages"],
+    "pdf_to_excel": lambda f: f["pages"],
+    "pdf_to_ppt": lambda f: f["pages"],
+    "word_to_pdf": lambda f: f["package_mb"],
+    "ppt_to_pdf": lambda f: f["package_mb"],
+    "excel_to_pdf": lambda f: f["package_mb"],
+    "convert_parallel_operations": lambda f: f["bytes"] / 2**20,
+}
+
+# Rough priors, used until a fitted model is written to COST_MODEL_PATH by
+# `manage.py fit_cost_model`. Each entry is {metric: [intercept, slope]}.
+DEFAULT_MODEL = {
+    "resize_image": {"cpu_s": [0.05, 0.08], "rss_bytes": [60e6, 25e6]},
+    "convert_image_format": {"cpu_s": [0.05, 0.06], "rss_bytes": [60e6, 20e6]},
+    "images_to_pdf": {"cpu_s": [1.0, 0.3], "rss_bytes": [150e6, 30e6]},
+    "convert_and_compress_images_to_pdf": {"cpu_s": [2.0, 0.8], "rss_bytes": [200e6, 40e6]},
+    "compress_pdf": {"cpu_s": [0.5, 0.05], "rss_bytes": [80e6, 2e6]},
+    "pdf_to_word": {"cpu_s": [0.5, 0.25], "rss_bytes": [100e6, 1e6]},
+    "pdf_to_excel": {"cpu_s": [0.2, 0.01], "rss_bytes": [60e6, 0.2e6]},
+    "pdf_to_ppt": {"cpu_s": [0.3, 0.02], "rss_bytes": [60e6, 0.3e6]},
+    "word_to_pdf": {"cpu_s": [1.5, 2.0], "rss_bytes": [200e6, 20e6]},
+    "ppt_to_pdf": {"cpu_s": [2.0, 2.0], "rss_bytes": [250e6, 20e6]},
+    "excel_to_pdf": {"cpu_s": [2.0, 3.0], "rss_bytes": [250e6, 30e6]},
+    "convert_parallel_operations": {"cpu_s": [2.0, 0.5], "rss_bytes": [250e6, 20e6]},
+}
+
+EMPTY_FEATURES = {"bytes": 0, "megapixels": 0.0, "pages": 0, "image_megapixels": 0.0, "package_mb": 0.0}
+
+
+# Inspection
+
+def inspect_file(path):
+    """
+    Cheap input features read from headers and metadata only: image size from
+    the header Pillow parses on open, PDF page count and embedded image sizes
+    from the xref table, and Office part sizes from the zip central directory.
+    Nothing is decoded or rendered.
+    """
+    features = dict(EMPTY_FEATURES, bytes=os.path.getsize(path))
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        if extension in IMAGE_EXTENSIONS:
+            features["megapixels"] = _image_megapixels(path)
+        elif extension == ".pdf":
+            features["pages"], features["image_megapixels"] = _pdf_stats(path)
+        elif extension in OFFICE_EXTENSIONS:
+            features["package_mb"] = _package_bytes(path) / 2**20
+    except Exception as e:
+        # A file we can't inspect is costed by size alone; the task reports the real error
+        logger.warning(f"Could not inspect {path}: {str(e)}")
+    return features
+
+
+def _image_megapixels(path):
+    from PIL import Image
+    with Image.open(path) as image:
+        width, height = image.size
+        frames = getattr(image, "n_frames", 1)
+    return width * height * frames / 1e6
+
+
+def _pdf_stats(path):
+    """Page count and total embedded image megapixels, extrapolated from a sample of pages."""
+    import fitz
+    with fitz.open(path) as doc:
+        pages = doc.page_count
+        if not pages:
+            return 0, 0.0
+        step = max(1, pages // settings.COST_PDF_SAMPLE_PAGES)
+        sampled = range(0, pages, step)
+        seen = set()
+        pixels = 0
+        for number in sampled:
+            for image in doc.get_page_images(number, full=True):
+                xref, width, height = image[0], image[2], image[3]
+                if xref not in seen:
+                    seen.add(xref)
+                    pixels += width * height
+    return pages, pixels / 1e6 * pages / len(sampled)
+
+
+def _package_bytes(path):
+    # Uncompressed size of the XML parts and embedded media, as listed in the zip directory
+    with zipfile.ZipFile(path) as package:
+        return sum(info.file_size for info in package.infolist())
+
+
+def combine(features_list):
+    total = dict(EMPTY_FEATURES)
+    for features in features_list:
+        for key in total:
+            total[key] += features[key]
+    return total
+
+
+def work_units(operation, features):
+    return DRIVERS[operation](features)
+
+
+# Prediction
+
+@functools.lru_cache(maxsize=None)
+def load_model(path=None):
+    path = path or settings.COST_MODEL_PATH
+    model = {operation: dict(coefficients) for operation, coefficients in DEFAULT_MODEL.items()}
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for operation, coefficients in json.load(f)["operations"].items():
+                model.setdefault(operation, {}).update(coefficients)
+    return model
+
+
+def _predict(operation, features, model):
+    units = work_units(operation, features)
+    cpu_intercept, cpu_slope = model[operation]["cpu_s"]
+    rss_intercept, rss_slope = model[operation]["rss_bytes"]
+    return cpu_intercept + cpu_slope * units, rss_intercept + rss_slope * units
+
+
+def estimate_job(operation, file_paths, params=None):
+    """
+    Predicted cost of running `operation` on `file_paths`:
+    {"cpu_seconds", "memory_bytes", "eta_seconds", "queue"}. Pipelines are
+    costed as the sum of their steps (memory as the largest step), each
+    step priced on the uploaded inputs.
+    """
+    model = load_model()
+    features = combine(inspect_file(path) for path in file_paths if os.path.exists(path))
+    if operation == "pipeline":
+        costs = [_predict(step["operation"], features, model) for step in (params or {}).get("steps") or []
+                 if step.get("operation") in DRIVERS]
+        cpu_seconds = sum(cpu for cpu, _ in costs)
+        memory_bytes = max((rss for _, rss in costs), default=0)
+    elif operation in DRIVERS:
+        cpu_seconds, memory_bytes = _predict(operation, features, model)
+    else:
+        cpu_seconds, memory_bytes = 0.0, 0
+    heavy = settings.COST_HEAVY_QUEUE and cpu_seconds >= settings.COST_HEAVY_CPU_SECONDS
+    return {
+        "cpu_seconds": round(cpu_seconds, 2),
+        "memory_bytes": int(memory_bytes),
+        # CPU time is a fair proxy for wall time; the converters are single-threaded per item
+        "eta_seconds": round(cpu_seconds, 1),
+        "queue": settings.COST_HEAVY_QUEUE if heavy else None,
+    }
+
+
+def rejection_reason(estimate):
+    """Why a job is too big to accept, or None."""
+    if estimate["cpu_seconds"] > settings.COST_MAX_CPU_SECONDS:
+        return (f"This job would take about {estimate['cpu_seconds']:.0f}s of processing, "
+                f"over the {settings.COST_MAX_CPU_SECONDS:.0f}s limit. Please split it into smaller files.")
+    if estimate["memory_bytes"] > settings.COST_MAX_MEMORY_BYTES:
+        return (f"This job would need about {estimate['memory_bytes'] / 2**20:.0f} MiB of memory, "
+                f"over the {settings.COST_MAX_MEMORY_BYTES / 2**20:.0f} MiB limit. Please split it into smaller files.")
+    return None
+
+
+# Fitting
+
+def _fit_line(points):
+    """Least-squares intercept and slope, both kept non-negative."""
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if not variance:
+        # All samples at one size: attribute the cost to the work itself
+        return [0.0, mean_y / mean_x] if mean_x else [mean_y, 0.0]
+    slope = max(0.0, sum((x - mean_x) * (y - mean_y) for x, y in points) / variance)
+    intercept = max(0.0, mean_y - slope * mean_x)
+    return [intercept, slope]
+
+
+def fit_model(reports):
+    """
+    Fits {operation: {"cpu_s": [intercept, slope], "rss_bytes": [...]}} from
+    benchmark reports whose results carry `work_units` (see benchmarks.measure).
+    """
+    samples = {}
+    for report in reports:
+        for name, result in report["results"].items():
+            operation = name.split("/")[0]
+            if "error" in result or result.get("work_units") is None or operation not in DRIVERS:
+                continue
+            samples.setdefault(operation, []).append(result)
+    fitted = {}
+    for operation, results in sorted(samples.items()):
+        fitted[operation] = {
+            "cpu_s": _fit_line([(r["work_units"], r["cpu_s"]) for r in results]),
+            "rss_bytes": _fit_line([(r["work_units"], r["peak_rss_bytes"]) for r in results]),
+            "samples": len(results),
+        }
+    return fitted
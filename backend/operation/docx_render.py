@@ -0,0 +1,210 @@
+import html
+import logging
+import fitz
+from docx import Document
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+from .cancellation import check_cancelled
+
+logger = logging.getLogger(__name__)
+
+EMU_PER_POINT = 12700
+# Flush buffered blocks to the page once this much HTML is pending, so memory
+# stays around one page of content regardless of document length
+CHUNK_HTML_CHARS = 16000
+CHUNK_IMAGE_BYTES = 4 * 1024 * 1024
+
+CSS = """
+body { font-family: sans-serif; font-size: 11pt; }
+p { margin: 0 0 6pt 0; }
+h1 { font-size: 20pt; } h2 { font-size: 16pt; } h3 { font-size: 14pt; }
+h4, h5, h6 { font-size: 12pt; }
+table { border-collapse: collapse; width: 100%; margin: 0 0 6pt 0; }
+td { border: 0.5pt solid #808080; padding: 2pt 4pt; vertical-align: top; }
+"""
+
+ALIGNMENTS = {
+    WD_ALIGN_PARAGRAPH.CENTER: "center",
+    WD_ALIGN_PARAGRAPH.RIGHT: "right",
+    WD_ALIGN_PARAGRAPH.JUSTIFY: "justify",
+}
+
+BLIP_TAG = '{http://schemas.openxmlformats.org/drawingml/2006/main}blip'
+EMBED_ATTR = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed'
+EXTENT_TAG = '{http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing}extent'
+
+
+class DocxPdfRenderer:
+    """
+    Renders a DOCX straight into PDF pages with PyMuPDF's Story API.
+    Body blocks are converted to HTML fragments and placed in chunks, so only
+    the pending chunk (and its images) is held in memory at any time.
+    """
+
+    def __init__(self, docx_path, output_path):
+        self.doc = Document(docx_path)
+        self.output_path = output_path
+        section = self.doc.sections[0] if self.doc.sections else None
+        width = section.page_width.pt if section and section.page_width else fitz.paper_rect("a4").width
+        height = section.page_height.pt if section and section.page_height else fitz.paper_rect("a4").height
+        self.mediabox = fitz.Rect(0, 0, width, height)
+        margins = [
+            getattr(section, name).pt if section and getattr(section, name) is not None else 72
+            for name in ("left_margin", "top_margin", "right_margin", "bottom_margin")
+        ]
+        self.content = fitz.Rect(margins[0], margins[1], width - margins[2], height - margins[3])
+        self.writer = None
+        self.device = None
+        self.y = self.content.y0
+        self.pages = 0
+        self._pending = []
+        self._pending_chars = 0
+        self._archive = fitz.Archive()
+        self._archive_bytes = 0
+        self._image_count = 0
+
+    def render(self):
+        self.writer = fitz.DocumentWriter(self.output_path)
+        try:
+            for block in self.doc.iter_inner_content():
+                if isinstance(block, Paragraph):
+                    self._append(self._paragraph_html(block))
+                elif isinstance(block, Table):
+                    self._append(self._table_html(block))
+            self._flush()
+            if self.pages == 0:
+                self._begin_page()
+            self._end_page()
+        finally:
+            self.writer.close()
+        logger.info(f"Rendered DOCX to {self.pages} PDF pages at {self.output_path}")
+        return self.output_path
+
+    def _append(self, fragment):
+        if not fragment:
+            return
+        self._pending.append(fragment)
+        self._pending_chars += len(fragment)
+        if self._pending_chars >= CHUNK_HTML_CHARS or self._archive_bytes >= CHUNK_IMAGE_BYTES:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        check_cancelled()
+        story = fitz.Story(html="".join(self._pending), user_css=CSS, archive=self._archive)
+        more = True
+        while more:
+            if self.device is None:
+                self._begin_page()
+            where = fitz.Rect(self.content.x0, self.y, self.content.x1, self.content.y1)
+            more, filled = story.place(where)
+            filled = fitz.Rect(filled)
+            story.draw(self.device)
+            if more:
+                if self.y == self.content.y0 and filled.is_empty:
+                    raise ValueError("DOCX block is too large to fit on a single page")
+                self._end_page()
+            else:
+                self.y = filled.y1
+        self._pending = []
+        self._pending_chars = 0
+        self._archive = fitz.Archive()
+        self._archive_bytes = 0
+
+    def _begin_page(self):
+        self.device = self.writer.begin_page(self.mediabox)
+        self.y = self.content.y0
+        self.pages += 1
+
+    def _end_page(self):
+        if self.device is not None:
+            self.writer.end_page()
+            self.device = None
+
+    def _paragraph_html(self, paragraph):
+        runs = "".join(self._run_html(run) for run in paragraph.runs)
+        style_name = paragraph.style.name if paragraph.style is not None else ""
+        tag = "p"
+        if style_name == "Title":
+            tag = "h1"
+        elif style_name.startswith("Heading ") and style_name[8:].isdigit():
+            tag = f"h{min(6, int(style_name[8:]))}"
+        elif style_name.startswith("List"):
+            runs = "&#8226; " + runs
+        style = ""
+        alignment = ALIGNMENTS.get(paragraph.alignment)
+        if alignment:
+            style = f' style="text-align: {alignment}"'
+        # Empty paragraphs still take up a line in Word
+        return f"<{tag}{style}>{runs or '&#160;'}</{tag}>"
+
+    def _run_html(self, run):
+        parts = [html.escape(run.text).replace("\n", "<br/>")]
+        parts.extend(self._image_html(blip) for blip in run._element.iter(BLIP_TAG))
+        text = "".join(parts)
+        if not text:
+            return ""
+        styles = []
+        font = run.font
+        if font.size is not None:
+            styles.append(f"font-size: {font.size.pt}pt")
+        try:
+            if font.color is not None and font.color.rgb is not None:
+                styles.append(f"color: #{font.color.rgb}")
+        except (AttributeError, ValueError):
+            pass
+        if run.bold:
+            text = f"<b>{text}</b>"
+        if run.italic:
+            text = f"<i>{text}</i>"
+        if run.underline:
+            text = f"<u>{text}</u>"
+        if font.strike:
+            text = f"<s>{text}</s>"
+        if styles:
+            text = f'<span style="{"; ".join(styles)}">{text}</span>'
+        return text
+
+    def _image_html(self, blip):
+        rel_id = blip.get(EMBED_ATTR)
+        part = self.doc.part.related_parts.get(rel_id)
+        if part is None:
+            return ""
+        self._image_count += 1
+        name = f"img{self._image_count}"
+        blob = part.blob
+        self._archive.add(blob, name)
+        self._archive_bytes += len(blob)
+
+        size = ""
+        drawing = blip
+        while drawing is not None and drawing.find(EXTENT_TAG) is None:
+            drawing = drawing.getparent()
+        if drawing is not None:
+            extent = drawing.find(EXTENT_TAG)
+            width = int(extent.get("cx")) / EMU_PER_POINT
+            height = int(extent.get("cy")) / EMU_PER_POINT
+            scale = min(1.0, self.content.width / width, self.content.height / height) if width and height else 1.0
+            size = f' width="{width * scale:.1f}" height="{height * scale:.1f}"'
+        return f'<img src="{name}"{size}/>'
+
+    def _table_html(self, table):
+        rows = []
+        for row in table.rows:
+            cells = []
+            last_tc = None
+            for cell in row.cells:
+                # Merged cells are repeated by python-docx, render them once
+                if cell._tc is last_tc:
+                    continue
+                last_tc = cell._tc
+                content = "".join(self._paragraph_html(p) for p in cell.paragraphs)
+                cells.append(f"<td>{content}</td>")
+            rows.append(f"<tr>{''.join(cells)}</tr>")
+        return f"<table>{''.join(rows)}</table>"
+
+
+def render_docx_to_pdf(input_path, output_path):
+    return DocxPdfRenderer(input_path, output_path).render()
@@ -0,0 +1,76 @@
+import concurrent.futures
+import contextvars
+import logging
+from django.conf import settings
+from .cancellation import check_cancelled
+
+logger = logging.getLogger(__name__)
+
+# A decoded image is held roughly twice while it is processed: the decode and
+# the resized or converted copy made from it
+WORKING_COPIES = 2
+
+
+def decoded_bytes(path):
+    """Memory an image takes once decoded, read from its header; 0 if Pillow can't read it (the job will say why)."""
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            return image.width * image.height * len(image.getbands()) * WORKING_COPIES
+    except (OSError, ValueError):
+        return 0
+
+
+def map_images(fn, image_paths, *arg_lists, progress=None, name=None):
+    """
+    Yields fn(image_path, *args) for each image, in the order given (upload,
+    i.e. page, order) whatever order they finish in. Runs on at most
+    IMAGE_BATCH_WORKERS threads, and starts an image only while the decoded
+    size of those running stays within IMAGE_BATCH_MEMORY_BUDGET, so a
+    batch of large photos runs fewer at a time rather than all at once;
+    one image always runs, however large.
+
+    Pillow releases the GIL while decoding, resizing and encoding, so the
+    threads run on separate cores. Each runs in a copy of the task's context,
+    so workers see its cancellation token.
+    """
+    jobs = list(zip(image_paths, *arg_lists)) if arg_lists else [(path,) for path in image_paths]
+    weights = [decoded_bytes(path) for path in image_paths]
+    budget = settings.IMAGE_BATCH_MEMORY_BUDGET
+    workers = max(1, settings.IMAGE_BATCH_WORKERS)
+    if progress is not None:
+        progress.start(name, total=len(jobs))
+
+    running = {}
+    finished = {}
+    in_flight_bytes = 0
+    next_start = next_yield = 0
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="images")
+    try:
+        while next_yield < len(jobs):
+            while next_start < len(jobs) and len(running) < workers and (
+                    not running or in_flight_bytes + weights[next_start] <= budget):
+                check_cancelled()
+                future = executor.submit(contextvars.copy_context().run, fn, *jobs[next_start])
+                running[future] = next_start
+                in_flight_bytes += weights[next_start]
+                next_start += 1
+            while next_yield in finished:
+                yield finished.pop(next_yield)
+                next_yield += 1
+            if not running:
+                continue
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                in_flight_bytes -= weights[index]
+                finished[index] = future.result()
+                if progress is not None:
+                    progress.advance(name=name)
+    finally:
+        for future in running:
+            future.cancel()
+        executor.shutdown(wait=True)
+    if progress is not None:
+        progress.finish(name)
+    logger.debug(f"Processed {len(jobs)} images on {workers} threads within {budget} bytes")
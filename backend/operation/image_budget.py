@@ -0,0 +1,199 @@
+import io
+import logging
+import math
+from .cancellation import check_cancelled
+from .compression_planner import CompressionImpossible
+
+logger = logging.getLogger(__name__)
+
+# What the PDF itself costs on top of the image streams: catalog, xref and
+# trailer once, then a page object, content stream and image dictionary per page
+PDF_BASE_OVERHEAD = 4096
+PDF_PAGE_OVERHEAD = 1024
+
+# No image is given less than this, so every page stays legible
+MIN_IMAGE_BYTES = 8 * 1024
+
+MIN_QUALITY = 30
+MAX_QUALITY = 95
+# Quality at which images are priced against each other
+REFERENCE_QUALITY = 75
+
+# The probe is a mosaic of PROBE_GRID x PROBE_GRID tiles cut from the image at
+# full resolution, so it has the image's own detail density at a fraction of its pixels
+PROBE_GRID = 4
+PROBE_TILE = 64
+
+# Overshoot of an image's share that earns it one corrective encode
+SHARE_TOLERANCE = 0.05
+
+A4 = (595, 842)
+
+
+def load_image(path):
+    """The image upright, as 8-bit grey or RGB with any transparency flattened onto white."""
+    from PIL import Image, ImageOps
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("1", "L", "I", "I;16"):
+            return image.convert("L")
+        if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            return background
+        return image.convert("RGB")
+
+
+def _probe(image):
+    from PIL import Image
+    tile = PROBE_TILE
+    if image.width < tile * PROBE_GRID or image.height < tile * PROBE_GRID:
+        return image
+    mosaic = Image.new(image.mode, (tile * PROBE_GRID, tile * PROBE_GRID))
+    for row in range(PROBE_GRID):
+        for column in range(PROBE_GRID):
+            # Tiles aligned to the 8x8 JPEG block grid, spread evenly over the image
+            left = column * (image.width - tile) // (PROBE_GRID - 1) // 8 * 8
+            top = row * (image.height - tile) // (PROBE_GRID - 1) // 8 * 8
+            mosaic.paste(image.crop((left, top, left + tile, top + tile)), (column * tile, row * tile))
+    return mosaic
+
+
+def _encode(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+class SizeModel:
+    """Predicted JPEG size of an image at any quality, from encodes of its probe mosaic."""
+
+    def __init__(self, image):
+        from PIL import Image
+        self.pixels = image.width * image.height
+        self.probe = _probe(image)
+        self._headers = {}
+        self._blank = Image.new(image.mode, (8, 8))
+        self._bytes_per_pixel = {}
+
+    def predict(self, quality):
+        if quality not in self._bytes_per_pixel:
+            # Headers and tables are paid once per file, not per pixel
+            header = len(_encode(self._blank, quality))
+            self._headers[quality] = header
+            body = max(0, len(_encode(self.probe, quality)) - header)
+            self._bytes_per_pixel[quality] = body / (self.probe.width * self.probe.height)
+        return int(self._headers[quality] + self._bytes_per_pixel[quality] * self.pixels)
+
+    def quality_for(self, share):
+        """Highest quality predicted to fit `share` bytes, or None if not even MIN_QUALITY does."""
+        low, high = MIN_QUALITY, MAX_QUALITY
+        if self.predict(low) > share:
+            return None
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.predict(middle) <= share:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+
+def estimate_image(path):
+    """{"pixels", "reference_bytes", "max_bytes"}: what an image costs at REFERENCE_QUALITY and at MAX_QUALITY."""
+    check_cancelled()
+    model = SizeModel(load_image(path))
+    return {
+        "pixels": model.pixels,
+        "reference_bytes": model.predict(REFERENCE_QUALITY),
+        "max_bytes": model.predict(MAX_QUALITY),
+    }
+
+
+def allocate_budget(target_size_bytes, estimates):
+    """
+    Splits target_size_bytes, less the PDF's own overhead, across images in
+    proportion to their cost at REFERENCE_QUALITY, so every image lands at
+    about the same quality. An image whose share would exceed its cost at
+    MAX_QUALITY gets only that, and the rest is spread over the others.
+    """
+    available = target_size_bytes - PDF_BASE_OVERHEAD - PDF_PAGE_OVERHEAD * len(estimates)
+    if available < MIN_IMAGE_BYTES * len(estimates):
+        raise CompressionImpossible(
+            f"{len(estimates)} images can't fit in {target_size_bytes // 1024} KB; "
+            f"allow at least {(PDF_BASE_OVERHEAD + (PDF_PAGE_OVERHEAD + MIN_IMAGE_BYTES) * len(estimates)) // 1024} KB."
+        )
+    shares = [None] * len(estimates)
+    open_images = set(range(len(estimates)))
+    while open_images:
+        weight = sum(estimates[i]["reference_bytes"] for i in open_images) or len(open_images)
+        capped = {
+            i for i in open_images
+            if available * (estimates[i]["reference_bytes"] or 1) / weight >= estimates[i]["max_bytes"]
+        }
+        if not capped:
+            for i in open_images:
+                shares[i] = max(MIN_IMAGE_BYTES, int(available * (estimates[i]["reference_bytes"] or 1) / weight))
+            break
+        for i in capped:
+            shares[i] = estimates[i]["max_bytes"]
+            available -= shares[i]
+        open_images -= capped
+    return shares
+
+
+def encode_to_budget(input_path, output_path, share):
+    """
+    Encodes the image once as a JPEG of at most about `share` bytes: at the
+    highest quality the size model predicts will fit, downscaled first when
+    not even MIN_QUALITY would. A result more than SHARE_TOLERANCE over its
+    share is encoded once more at a correspondingly lower quality.
+    """
+    from PIL import Image
+    check_cancelled()
+    image = load_image(input_path)
+    model = SizeModel(image)
+    quality = model.quality_for(share)
+    while quality is None and min(image.size) > 16:
+        # Pixels shrink with the square of the scale; aim a little under the share
+        scale = math.sqrt(share / model.predict(MIN_QUALITY)) * 0.95
+        image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.Resampling.LANCZOS)
+        model = SizeModel(image)
+        quality = model.quality_for(share)
+    quality = quality or MIN_QUALITY
+
+    check_cancelled()
+    data = _encode(image, quality)
+    if len(data) > share * (1 + SHARE_TOLERANCE) and quality > MIN_QUALITY:
+        corrected = max(MIN_QUALITY, int(quality * share / len(data)))
+        logger.info(f"{input_path} came out at {len(data)} bytes for a {share} byte share; re-encoding at quality {corrected}")
+        data = _encode(image, corrected)
+        quality = corrected
+    with open(output_path, "wb") as f:
+        f.write(data)
+    logger.debug(f"Encoded {input_path} at {image.width}x{image.height}, quality {quality}: {len(data)} of {share} bytes")
+    return output_path
+
+
+def assemble_pdf(image_paths, output_path, progress=None):
+    """One A4 page per JPEG, turned to match the image; the JPEG streams are embedded as they are."""
+    import fitz
+    from PIL import Image
+    doc = fitz.open()
+    try:
+        for image_path in image_paths:
+            check_cancelled()
+            with open(image_path, "rb") as f:
+                data = f.read()
+            with Image.open(io.BytesIO(data)) as image:
+                width, height = image.size  # Read from the header; nothing is decoded
+            page_width, page_height = A4 if height >= width else A4[::-1]
+            page = doc.new_page(width=page_width, height=page_height)
+            page.insert_image(page.rect, stream=data)
+            if progress is not None:
+                progress.advance()
+        doc.save(output_path, garbage=3, deflate=True)
+    finally:
+        doc.close()
+    return output_path
@@ -0,0 +1,66 @@
+import json
+import os
+import subprocess
+import sys
+from django.conf import settings
+
+# Libraries only conversion workers should ever load
+HEAVY_MODULES = ("fitz", "pdf2docx", "openpyxl", "pptx", "pdfkit", "PIL", "numpy", "docx", "comtypes", "google.generativeai")
+
+_PROBE = """
+import django, importlib, json, resource, sys, time
+django.setup()
+before = set(sys.modules)
+start = time.perf_counter()
+importlib.import_module({module!r})
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "new_modules": sorted(set(sys.modules) - before),
+}}))
+"""
+
+
+def parse_importtime(stderr):
+    """Returns {package: cumulative microseconds} for top-level entries of -X importtime output."""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if not cumulative_us.isdigit():
+            continue
+        # Nested imports are indented; keep only top-level packages
+        if name == name.lstrip():
+            cumulative[name] = cumulative.get(name, 0) + int(cumulative_us)
+    return cumulative
+
+
+def profile_import(module):
+    """
+    Imports `module` in a fresh interpreter after django.setup() and reports
+    the time it took, the process's peak RSS, the top-level packages it pulled
+    in (from python -X importtime) and which HEAVY_MODULES got loaded.
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get("DJANGO_SETTINGS_MODULE", "backend.settings"))
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module)],
+        cwd=settings.BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    probe = json.loads(completed.stdout.strip().splitlines()[-1])
+    new_modules = set(probe["new_modules"])
+    return {
+        "module": module,
+        "seconds": probe["seconds"],
+        "max_rss_bytes": probe["max_rss_kb"] * 1024,
+        "heavy_modules": [m for m in HEAVY_MODULES if m in new_modules],
+        "top_imports": sorted(
+            ((name, us) for name, us in parse_importtime(completed.stderr).items() if name in new_modules),
+            key=lambda item: -item[1],
+        )[:15],
+    }
@@ -0,0 +1,179 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from celery import Task
+from celery.signals import before_task_publish
+from django.conf import settings
+from django.core.cache import caches
+from prometheus_client import CollectorRegistry, Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+from .cancellation import CancellationToken, DeadlineExceeded, TaskCancelled, cancellation_scope, current_token, parse_deadline
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("operation.trace")
+
+STAGE_SECONDS = Histogram(
+    "operation_stage_seconds",
+    "Time spent in each stage of a send_message request, web and worker side.",
+    ["stage", "operation"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+
+_current_timer = contextvars.ContextVar("stage_timer", default=None)
+
+
+class StageTimer:
+    """
+    Collects monotonic per-stage timings for one request or one task run.
+    Web-side timers propagate their trace id into any Celery task published
+    while they are current, and pick up the worker's stages afterwards.
+    """
+
+    def __init__(self, operation="none", trace_id=None, sampled=None, side="web"):
+        self.operation = operation
+        self.side = side
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.sampled = random.random() < settings.TRACE_SAMPLE_RATE if sampled is None else sampled
+        self.stages = []
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_timer.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        _current_timer.reset(self._token)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds, side=None):
+        self.stages.append({"name": name, "seconds": seconds, "side": side or self.side})
+
+    def merge_worker_stages(self, task_id):
+        stages = caches["shared"].get(f"task_timings_{task_id}") or []
+        for entry in stages:
+            self.record(entry["name"], entry["seconds"], side="worker")
+
+    def server_timing(self):
+        return ", ".join(f"{s['name']};dur={s['seconds'] * 1000:.1f}" for s in self.stages)
+
+    def finish(self, response=None, observe=True):
+        for entry in self.stages if observe else ():
+            STAGE_SECONDS.labels(stage=entry["name"], operation=self.operation or "none").observe(entry["seconds"])
+        if response is not None and self.stages:
+            response["Server-Timing"] = self.server_timing()
+        if self.sampled:
+            trace_logger.info(json.dumps({
+                "trace_id": self.trace_id,
+                "operation": self.operation,
+                "stages": self.stages,
+            }))
+        return response
+
+
+def current_timer():
+    return _current_timer.get()
+
+
+def instrumented(view):
+    """Times a view's stages and attaches them as a Server-Timing header."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with StageTimer() as timer:
+            response = view(request, *args, **kwargs)
+        return timer.finish(response)
+    return wrapper
+
+
+@contextmanager
+def timed_stage(name):
+    """Times a block against the current request or task timer, if there is one."""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+# Celery propagation
+
+@before_task_publish.connect
+def inject_trace_headers(headers=None, **kwargs):
+    timer = _current_timer.get()
+    if timer is not None and headers is not None:
+        headers["trace_id"] = timer.trace_id
+        headers["trace_sampled"] = timer.sampled
+        # Wall clock, since monotonic clocks aren't comparable across hosts
+        headers["trace_enqueued_at"] = time.time()
+
+
+class TimedTask(Task):
+    """
+    Default task class for the app. Times each run of the task body and stores
+    the worker-side stages (queue wait, execution and any timed_stage blocks)
+    before the result is stored, so a caller waiting on the result can merge them.
+    Each run also gets a CancellationToken bound to the task id and to the
+    `expires` deadline the caller enqueued it with, and retries are refused once
+    the task is cancelled or a retry could not finish before that deadline.
+    """
+
+    def __call__(self, *args, **kwargs):
+        request = self.request
+        timer = StageTimer(
+            operation=self.name.rsplit(".", 1)[-1],
+            trace_id=request.get("trace_id"),
+            sampled=bool(request.get("trace_sampled")),
+            side="worker",
+        )
+        enqueued_at = request.get("trace_enqueued_at")
+        if enqueued_at:
+            timer.record("queue_wait", max(0.0, time.time() - enqueued_at))
+        token = CancellationToken(request.id, parse_deadline(request.get("expires")))
+        started = time.perf_counter()
+        try:
+            with timer, cancellation_scope(token):
+                return super().__call__(*args, **kwargs)
+        finally:
+            timer.record("task_execution", time.perf_counter() - started)
+            if request.id:
+                try:
+                    caches["shared"].set(f"task_timings_{request.id}", timer.stages, timeout=settings.TRACE_RESULT_TTL)
+                except Exception as e:
+                    logger.warning(f"Failed to store timings for task {request.id}: {str(e)}")
+            # Histograms are observed by the web process once it merges these stages
+            timer.finish(observe=False)
+
+    def retry(self, args=None, kwargs=None, exc=None, throw=True, eta=None, countdown=None, max_retries=None, **options):
+        if isinstance(exc, TaskCancelled):
+            raise exc
+        token = current_token()
+        if token is not None:
+            if token.cancelled():
+                raise TaskCancelled(f"Task {self.request.id} was cancelled") from exc
+            remaining = token.remaining()
+            if remaining is not None and remaining <= (countdown or 0):
+                raise DeadlineExceeded(f"No time left to retry task {self.request.id}") from exc
+        return super().retry(args=args, kwargs=kwargs, exc=exc, throw=throw, eta=eta,
+                             countdown=countdown, max_retries=max_retries, **options)
+
+
+def render_metrics():
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
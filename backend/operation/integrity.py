@@ -0,0 +1,86 @@
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# Integrity levels, cheapest first
+FAST = "fast"
+FULL = "full"
+
+HEAD_BYTES = 1024
+TAIL_BYTES = 2048
+STARTXREF_PATTERN = re.compile(rb"startxref\s+(\d+)\s+%%EOF", re.DOTALL)
+XREF_TARGET_PATTERN = re.compile(rb"\s*(xref|\d+\s+\d+\s+obj)")
+
+
+def check_pdf_structure(pdf_path):
+    """
+    Fast structural check done with a few seeks: %PDF- header, %%EOF in the
+    tail, and a startxref offset that lands on an xref table or xref stream.
+    Raises ValueError describing the first problem found.
+    """
+    file_size = os.path.getsize(pdf_path)
+    if file_size == 0:
+        raise ValueError("file is empty")
+    with open(pdf_path, 'rb') as f:
+        header = f.read(HEAD_BYTES)
+        if b'%PDF-' not in header:
+            raise ValueError(f"invalid PDF header: {header[:10]!r}")
+
+        f.seek(max(0, file_size - TAIL_BYTES))
+        tail = f.read()
+        if b'%%EOF' not in tail:
+            raise ValueError("missing %%EOF marker")
+        matches = STARTXREF_PATTERN.findall(tail)
+        if not matches:
+            raise ValueError("missing startxref before %%EOF")
+        xref_offset = int(matches[-1])
+        if xref_offset >= file_size:
+            raise ValueError(f"startxref offset {xref_offset} is beyond end of file ({file_size} bytes)")
+
+        f.seek(xref_offset)
+        if not XREF_TARGET_PATTERN.match(f.read(64)):
+            raise ValueError(f"startxref offset {xref_offset} does not point at an xref section")
+
+
+def check_page_tree(document):
+    if not document.is_pdf:
+        raise ValueError("document is not a PDF")
+    if document.needs_pass:
+        raise ValueError("document is encrypted")
+    for page_number in range(document.page_count):
+        if document.page_xref(page_number) <= 0:
+            raise ValueError(f"page {page_number} has no object in the page tree")
+        if document[page_number].rect.is_empty:
+            raise ValueError(f"page {page_number} has an empty media box")
+    if document.is_repaired:
+        logger.warning(f"PDF {document.name} needed repair while opening")
+
+
+def verify_pdf_integrity(pdf_path=None, level=FAST, document=None):
+    """
+    Returns True when the PDF passes the checks for `level`. FAST only seeks
+    into the file, which suits the PDFs we write ourselves; FULL walks the
+    page tree instead. Pass an already open fitz `document` to reuse its
+    parse instead of opening the file again.
+
+    Whenever there is a parse, it decides: user PDFs with trailing garbage or
+    a stale startxref open fine in MuPDF (which repairs them, and we log it),
+    so the byte-level checks would only turn away good input.
+    """
+    pdf_path = pdf_path or (document.name if document is not None else None)
+    try:
+        if level == FULL or document is not None:
+            if document is not None:
+                check_page_tree(document)
+            else:
+                import fitz
+                with fitz.open(pdf_path) as opened:
+                    check_page_tree(opened)
+        elif pdf_path:
+            check_pdf_structure(pdf_path)
+        return True
+    except Exception as e:
+        logger.error(f"PDF verification ({level}) failed for {pdf_path}: {str(e)}")
+        return False
@@ -0,0 +1,166 @@
+import abc
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LLMResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class LLMClient(abc.ABC):
+    """
+    Interface the views and parse_intent talk to. It mirrors the small part of
+    google.generativeai's GenerativeModel API the project uses, so backends can
+    be swapped without touching call sites.
+    """
+
+    @abc.abstractmethod
+    def generate_content(self, prompt):
+        """A response whose .text is the model's reply to prompt."""
+
+    @abc.abstractmethod
+    def start_chat(self, history=None):
+        """A chat with send_message(content, generation_config=None, stream=False)."""
+
+
+class GeminiClient(LLMClient):
+    def __init__(self, model_name):
+        import google.generativeai as genai
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        self._model = genai.GenerativeModel(model_name)
+
+    def generate_content(self, prompt):
+        return self._model.generate_content(prompt)
+
+    def start_chat(self, history=None):
+        return self._model.start_chat(history=history or [])
+
+
+def parse_latency(spec):
+    """
+    Parses a latency distribution spec into a sampler returning seconds:
+    "fixed:200", "uniform:100,400" or "lognormal:300,0.5" (median ms, sigma).
+    """
+    kind, _, values = spec.partition(":")
+    numbers = [float(v) for v in values.split(",") if v]
+    if kind == "fixed":
+        return lambda: numbers[0] / 1000
+    if kind == "uniform":
+        return lambda: random.uniform(numbers[0], numbers[1]) / 1000
+    if kind == "lognormal":
+        median, sigma = numbers
+        return lambda: random.lognormvariate(0, sigma) * median / 1000
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+STUB_MESSAGE_PATTERN = re.compile(r'The user provided the following message: "(.*?)"\s*Uploaded files:', re.DOTALL)
+STUB_FILE_TYPE_PATTERN = re.compile(r"\(Type: ([^,]+),")
+STUB_SIZE_PATTERN = re.compile(r"(\d+\s?(kb|mb))", re.IGNORECASE)
+STUB_REPLY = (
+    "Sure! I can help with converting, compressing and resizing your documents and images. "
+    "Upload a file and tell me what you would like to do with it."
+)
+
+
+def stub_intent(prompt):
+    """Canned intent classification keyed off the message and file types in the prompt."""
+    match = STUB_MESSAGE_PATTERN.search(prompt)
+    message = match.group(1).lower() if match else ""
+    types = STUB_FILE_TYPE_PATTERN.findall(prompt)
+    size_match = STUB_SIZE_PATTERN.search(message)
+    size = size_match.group(1) if size_match else "1MB"
+
+    def operation(name, params, description):
+        return {"intent": "document_operation", "operation": name, "params": params, "description": description}
+
+    if types:
+        has_image = any(t.startswith("image/") for t in types)
+        has_pdf = any("pdf" in t for t in types)
+        if has_image and "pdf" in message and size_match:
+            return operation("convert_and_compress_images_to_pdf", {"size": size}, f"convert images to PDF and compress to {size}")
+        if has_image and "pdf" in message:
+            return operation("images_to_pdf", {}, "convert images to PDF")
+        if has_image and "resize" in message:
+            return operation("resize_image", {"size": size}, f"resize an image to {size}")
+        if has_image:
+            return operation("convert_image_format", {"format": "PNG"}, "convert an image to PNG format")
+        if has_pdf and "word" in message:
+            return operation("pdf_to_word", {}, "convert a PDF to Word document")
+        if has_pdf and "excel" in message:
+            return operation("pdf_to_excel", {}, "convert a PDF to Excel spreadsheet")
+        if has_pdf and "ppt" in message:
+            return operation("pdf_to_ppt", {}, "convert a PDF to PowerPoint presentation")
+        if has_pdf:
+            return operation("compress_pdf", {"size": size}, f"compress the PDF to {size}")
+        if any("wordprocessingml" in t for t in types):
+            return operation("word_to_pdf", {}, "convert a Word document to PDF")
+    return {"intent": "conversation", "operation": None, "params": {}, "description": "general conversation"}
+
+
+class StubChat:
+    def __init__(self, client):
+        self._client = client
+
+    def send_message(self, content, generation_config=None, stream=False):
+        if stream:
+            return self._client.stream_text(STUB_REPLY)
+        self._client.wait()
+        return LLMResponse(STUB_REPLY)
+
+
+class StubClient(LLMClient):
+    """
+    In-process stand-in for Gemini with configurable latency, used for local
+    development and load tests. Intent prompts get canned intent JSON, chat
+    messages get a canned reply, optionally streamed in chunks.
+    """
+
+    def __init__(self, latency_spec, chunk_delay_spec):
+        self._latency = parse_latency(latency_spec)
+        self._chunk_delay = parse_latency(chunk_delay_spec)
+
+    def wait(self):
+        time.sleep(self._latency())
+
+    def generate_content(self, prompt):
+        self.wait()
+        if STUB_MESSAGE_PATTERN.search(prompt):
+            return LLMResponse(json.dumps(stub_intent(prompt)))
+        return LLMResponse(STUB_REPLY)
+
+    def start_chat(self, history=None):
+        return StubChat(self)
+
+    def stream_text(self, text, words_per_chunk=5):
+        # Time to first chunk follows the main latency, later chunks the chunk delay
+        self.wait()
+        words = text.split(" ")
+        for i in range(0, len(words), words_per_chunk):
+            if i:
+                time.sleep(self._chunk_delay())
+            yield LLMResponse(" ".join(words[i:i + words_per_chunk]))
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            if settings.LLM_BACKEND == "stub":
+                logger.info(f"Using stub LLM client (latency {settings.LLM_STUB_LATENCY})")
+                _client = StubClient(settings.LLM_STUB_LATENCY, settings.LLM_STUB_CHUNK_DELAY)
+            else:
+                _client = GeminiClient(settings.LLM_MODEL)
+        return _client
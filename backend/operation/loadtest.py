@@ -0,0 +1,182 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+import requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIX = {"upload": 2, "chat": 5, "history": 3}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # Nearest rank: the smallest value with at least pct percent of samples at or below it
+    rank = max(0, math.ceil(pct * len(ordered) / 100) - 1)
+    return ordered[rank]
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, endpoint, seconds, ok=True):
+        with self._lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self, duration):
+        report = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            report[endpoint] = {
+                "requests": len(values),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput_rps": len(values) / duration if duration else 0.0,
+                "p50_ms": percentile(values, 50) * 1000,
+                "p90_ms": percentile(values, 90) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+                "max_ms": max(values) * 1000,
+            }
+        return report
+
+
+class VirtualUser:
+    """
+    One logged-in client with its own session cookie. Scenarios are not
+    serialized per user: arrivals picking a user that is still busy run
+    alongside its earlier ones, as several tabs of one client would, so the
+    arrival rate stays open-loop.
+    """
+
+    def __init__(self, base_url, run_id, index, upload_path, recorder, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.email = f"loadtest_{run_id}_{index}@example.com"
+        self.password = f"Lt-{run_id}-{index}-pw!"
+        self.upload_path = upload_path
+        self.recorder = recorder
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _call(self, endpoint, method, path, **kwargs):
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+            ok = response.status_code < 400
+            return response
+        except requests.RequestException as e:
+            logger.debug(f"{endpoint} failed: {str(e)}")
+            return None
+        finally:
+            self.recorder.record(endpoint, time.perf_counter() - start, ok)
+
+    def signup_and_login(self):
+        credentials = {"email": self.email, "password": self.password}
+        self._call("signup", "POST", "/api/signup/", json={**credentials, "confirm_password": self.password})
+        self._call("login", "POST", "/api/login/", json=credentials)
+
+    def upload(self):
+        with open(self.upload_path, "rb") as f:
+            self._call(
+                "send_message_upload", "POST", "/api/send-message/",
+                data={"text": "Convert this image to PNG"},
+                files={"files": (f"loadtest_{uuid.uuid4().hex}.jpg", f, "image/jpeg")},
+            )
+
+    def chat(self):
+        response = self._call("send_message_chat", "POST", "/api/send-message/", data={"text": "What is a PDF?"})
+        if response is None or response.status_code >= 400:
+            return
+        task_id = response.json().get("task_id")
+        if task_id:
+            self.stream(task_id)
+
+    def stream(self, task_id):
+        start = time.perf_counter()
+        ok = False
+        try:
+            with self.session.get(f"{self.base_url}/api/stream-response/{task_id}/", stream=True, timeout=self.timeout) as response:
+                for line in response.iter_lines():
+                    if not line.startswith(b"data: "):
+                        continue
+                    event = json.loads(line[6:])
+                    if event.get("error"):
+                        break
+                    if event.get("done"):
+                        ok = True
+                        break
+        except requests.RequestException as e:
+            logger.debug(f"stream_response failed: {str(e)}")
+        finally:
+            self.recorder.record("stream_response", time.perf_counter() - start, ok)
+
+    def history(self):
+        self._call("get_chat_history", "GET", "/api/chat-history/")
+
+
+async def _run(users, mix, rps, duration, concurrency, recorder):
+    loop = asyncio.get_running_loop()
+    actions = list(mix)
+    weights = [mix[a] for a in actions]
+    pending = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        started = loop.time()
+        arrival = 0
+        # Open-loop arrivals: each scenario is measured from its scheduled start,
+        # so a saturated server shows up as latency instead of a lower request rate
+        while True:
+            scheduled = started + arrival / rps
+            if scheduled - started >= duration:
+                break
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            user = random.choice(users)
+            action = random.choices(actions, weights)[0]
+            pending.append(loop.run_in_executor(executor, _timed_scenario, user, action, recorder, time.perf_counter()))
+            arrival += 1
+        await asyncio.gather(*pending)
+    return loop.time() - started
+
+
+def _timed_scenario(user, action, recorder, scheduled_at):
+    ok = True
+    try:
+        getattr(user, action)()
+    except Exception as e:
+        logger.debug(f"Scenario {action} raised: {str(e)}")
+        ok = False
+    recorder.record(f"scenario:{action}", time.perf_counter() - scheduled_at, ok)
+
+
+def run_load_test(base_url, upload_path, rps=10, duration=60, users=10, concurrency=64, mix=None, timeout=330):
+    """
+    Drives signup/login, send_message with uploads, stream_response and
+    get_chat_history against a running backend at a target request rate and
+    returns throughput and latency percentiles per endpoint. Run the server
+    with LLM_BACKEND=stub to keep Gemini out of the measurement.
+    """
+    recorder = LatencyRecorder()
+    run_id = uuid.uuid4().hex[:8]
+    virtual_users = [VirtualUser(base_url, run_id, i, upload_path, recorder, timeout) for i in range(users)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(users, concurrency)) as executor:
+        list(executor.map(lambda u: u.signup_and_login(), virtual_users))
+    elapsed = asyncio.run(_run(virtual_users, mix or DEFAULT_MIX, rps, duration, concurrency, recorder))
+    return {
+        "base_url": base_url,
+        "target_rps": rps,
+        "duration_s": elapsed,
+        "users": users,
+        "mix": mix or DEFAULT_MIX,
+        "endpoints": recorder.summary(elapsed),
+    }
@@ -0,0 +1,40 @@
+import os
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from operation.benchmarks import build_sample_docx
+from operation.tasks import convert_docx_to_pdf, convert_docx_to_pdf_wkhtmltopdf
+
+
+class Command(BaseCommand):
+    help = "Compare DOCX-to-PDF throughput of the native renderer against the HTML + wkhtmltopdf path."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--paragraphs", type=int, nargs="+", default=[100, 1000, 5000])
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        engines = {
+            "native": convert_docx_to_pdf,
+            "wkhtmltopdf": convert_docx_to_pdf_wkhtmltopdf,
+        }
+        with tempfile.TemporaryDirectory() as work_dir:
+            for paragraphs in options["paragraphs"]:
+                docx_path = os.path.join(work_dir, f"sample_{paragraphs}.docx")
+                build_sample_docx(docx_path, paragraphs)
+                for name, convert in engines.items():
+                    output_path = os.path.join(work_dir, f"{name}_{paragraphs}.pdf")
+                    timings = []
+                    try:
+                        for _ in range(options["repeat"]):
+                            start = time.perf_counter()
+                            convert(docx_path, output_path)
+                            timings.append(time.perf_counter() - start)
+                    except Exception as e:
+                        self.stdout.write(f"{name:12} {paragraphs:6} paragraphs  skipped: {str(e)}")
+                        continue
+                    best = min(timings)
+                    self.stdout.write(
+                        f"{name:12} {paragraphs:6} paragraphs  best {best * 1000:9.1f} ms  "
+                        f"{paragraphs / best:10.0f} paragraphs/s  output {os.path.getsize(output_path)} bytes"
+                    )
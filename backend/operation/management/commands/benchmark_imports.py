@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from operation.import_profile import profile_import
+
+
+class Command(BaseCommand):
+    help = "Report import time, peak RSS and heavy libraries loaded by the web and worker modules."
+
+    def add_arguments(self, parser):
+        parser.add_argument("modules", nargs="*", default=["operation.views", "operation.tasks"])
+
+    def handle(self, *args, **options):
+        for module in options["modules"]:
+            profile = profile_import(module)
+            self.stdout.write(
+                f"{module:24} {profile['seconds'] * 1000:8.1f} ms  peak RSS {profile['max_rss_bytes'] / 2**20:7.1f} MiB  "
+                f"heavy: {', '.join(profile['heavy_modules']) or 'none'}"
+            )
+            for name, microseconds in profile["top_imports"]:
+                self.stdout.write(f"    {name:40} {microseconds / 1000:8.1f} ms")
@@ -0,0 +1,30 @@
+import os
+import tempfile
+from django.core.management.base import BaseCommand
+from operation.benchmarks import PROFILES, compare_engines, run_suite, save_report
+
+
+class Command(BaseCommand):
+    help = "Time every task in operation/tasks.py on synthetic fixtures and write a JSON baseline."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", default="benchmark_baseline.json", help="Where to write the JSON report.")
+        parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--only", nargs="*", help="Only run cases whose name starts with one of these prefixes.")
+        parser.add_argument("--work-dir", help="Directory for fixtures and run outputs; fixtures are reused between runs.")
+
+    def handle(self, *args, **options):
+        work_dir = options["work_dir"] or os.path.join(tempfile.gettempdir(), "operation_benchmarks")
+        report = run_suite(
+            work_dir,
+            profile=options["profile"],
+            repeat=options["repeat"],
+            only=options["only"],
+            log=self.stdout.write,
+        )
+        for name, gs_wall, images_wall, speedup, gs_bytes, images_bytes in compare_engines(report):
+            self.stdout.write(f"{name:30} ghostscript {gs_wall * 1000:9.1f} ms {gs_bytes:>10} bytes  "
+                              f"images {images_wall * 1000:9.1f} ms {images_bytes:>10} bytes  ({speedup:.1f}x)")
+        save_report(report, options["output"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(report['results'])} results to {options['output']}"))
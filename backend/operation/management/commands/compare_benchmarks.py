@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from operation.benchmarks import compare_reports, load_report
+
+
+class Command(BaseCommand):
+    help = "Diff a benchmark report against a baseline and fail on regressions."
+
+    def add_arguments(self, parser):
+        parser.add_argument("baseline")
+        parser.add_argument("current")
+        parser.add_argument("--threshold", type=float, default=0.10, help="Relative increase counted as a regression.")
+        parser.add_argument("--metrics", nargs="*", default=["wall_s", "cpu_s", "peak_rss_bytes", "output_bytes"])
+
+    def handle(self, *args, **options):
+        rows = compare_reports(load_report(options["baseline"]), load_report(options["current"]), options["threshold"])
+        regressions = []
+        for name, metric, before, after, change, regressed in rows:
+            if metric == "error":
+                line = f"{name:45} {metric:15} {after}"
+            elif metric not in options["metrics"]:
+                continue
+            else:
+                line = f"{name:45} {metric:15} {before:14.4f} -> {after:14.4f}  {change:+7.1%}"
+            if regressed:
+                regressions.append(line)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(f"{len(regressions)} metrics regressed by more than {options['threshold']:.0%}")
+        self.stdout.write(self.style.SUCCESS("No regressions"))
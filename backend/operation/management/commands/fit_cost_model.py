@@ -0,0 +1,28 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from operation.benchmarks import load_report
+from operation.cost_model import fit_model
+
+
+class Command(BaseCommand):
+    help = "Fit the pre-flight job cost model from benchmark_tasks reports and write it to COST_MODEL_PATH."
+
+    def add_arguments(self, parser):
+        parser.add_argument("reports", nargs="+", help="Benchmark reports written by benchmark_tasks.")
+        parser.add_argument("--output", help="Where to write the model (defaults to COST_MODEL_PATH).")
+
+    def handle(self, *args, **options):
+        fitted = fit_model([load_report(path) for path in options["reports"]])
+        if not fitted:
+            raise CommandError("No results with work units found; re-run benchmark_tasks to record them.")
+        output = options["output"] or settings.COST_MODEL_PATH
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump({"operations": fitted}, f, indent=2, sort_keys=True)
+        for operation, model in fitted.items():
+            cpu_intercept, cpu_slope = model["cpu_s"]
+            rss_intercept, rss_slope = model["rss_bytes"]
+            self.stdout.write(f"{operation:40} cpu {cpu_intercept:8.3f} + {cpu_slope:8.4f}/unit  "
+                              f"rss {rss_intercept / 2**20:8.1f} + {rss_slope / 2**20:8.2f} MiB/unit  "
+                              f"({model['samples']} samples)")
+        self.stdout.write(self.style.SUCCESS(f"Wrote cost model for {len(fitted)} operations to {output}"))
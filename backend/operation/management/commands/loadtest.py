@@ -0,0 +1,54 @@
+import json
+import os
+import tempfile
+from django.core.management.base import BaseCommand, CommandError
+from operation.loadtest import DEFAULT_MIX, run_load_test
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in DEFAULT_MIX:
+            raise CommandError(f"Unknown scenario '{name}', expected one of {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Command(BaseCommand):
+    help = "Load-test a running backend (start it with LLM_BACKEND=stub) and report latency percentiles."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://localhost:8000")
+        parser.add_argument("--rps", type=float, default=10)
+        parser.add_argument("--duration", type=float, default=60, help="Seconds of scheduled arrivals.")
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument("--concurrency", type=int, default=64)
+        parser.add_argument("--mix", type=parse_mix, default=None, help="Scenario weights, e.g. upload=2,chat=5,history=3")
+        parser.add_argument("--upload", help="Image sent by the upload scenario; a synthetic photo is used if omitted.")
+        parser.add_argument("--output", help="Also write the report as JSON to this path.")
+
+    def handle(self, *args, **options):
+        upload_path = options["upload"]
+        if not upload_path:
+            from operation.benchmarks import build_photo
+            upload_path = build_photo(os.path.join(tempfile.gettempdir(), "loadtest_upload.jpg"), 1)
+
+        report = run_load_test(
+            options["base_url"],
+            upload_path,
+            rps=options["rps"],
+            duration=options["duration"],
+            users=options["users"],
+            concurrency=options["concurrency"],
+            mix=options["mix"],
+        )
+        self.stdout.write(f"{'endpoint':28} {'requests':>8} {'errors':>6} {'rps':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+        for endpoint, row in report["endpoints"].items():
+            self.stdout.write(
+                f"{endpoint:28} {row['requests']:8} {row['errors']:6} {row['throughput_rps']:8.2f} "
+                f"{row['p50_ms']:9.1f} {row['p90_ms']:9.1f} {row['p99_ms']:9.1f}"
+            )
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,73 @@
+import hashlib
+import logging
+import mimetypes
+import os
+from typing import Optional, TypedDict
+from .storage import storage_name
+
+logger = logging.getLogger(__name__)
+
+PREVIEWABLE_TYPES = ("application/pdf", "image/jpeg", "image/png")
+
+
+class OutputFile(TypedDict):
+    """
+    One output of a task, described once by the worker that wrote it and
+    returned in the task result as part of its "manifest", so the web tier
+    renders responses without touching the file.
+    """
+    name: str  # As served by /api/download/<name>
+    key: str  # Storage name
+    size: int
+    type: str  # MIME type
+    pages: Optional[int]  # None where counting needs a renderer (Office files)
+    sha256: str
+    previewable: bool
+
+
+def _page_count(path, content_type):
+    try:
+        if content_type == "application/pdf":
+            import fitz
+            with fitz.open(path) as doc:
+                return doc.page_count
+        if content_type.startswith("image/"):
+            from PIL import Image
+            with Image.open(path) as image:
+                return getattr(image, "n_frames", 1)
+    except Exception as e:
+        logger.warning(f"Could not count the pages of {path}: {str(e)}")
+    return None
+
+
+def describe_output(local_path, final_path):
+    """The OutputFile for an output published as final_path, read from its local copy at local_path."""
+    digest = hashlib.sha256()
+    with open(local_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    content_type = mimetypes.guess_type(final_path)[0] or "application/octet-stream"
+    return OutputFile(
+        name=os.path.basename(final_path),
+        key=storage_name(final_path) or os.path.basename(final_path),
+        size=os.path.getsize(local_path),
+        type=content_type,
+        pages=_page_count(local_path, content_type),
+        sha256=digest.hexdigest(),
+        previewable=content_type in PREVIEWABLE_TYPES,
+    )
+
+
+def response_files(manifest):
+    """The files of a chat reply or task status, from a task's output manifest."""
+    return [
+        {
+            "name": output["name"],
+            "url": f"/api/download/{output['name']}",
+            "size": output["size"],
+            "type": output["type"],
+            "pages": output["pages"],
+            "previewable": output["previewable"],
+        }
+        for output in manifest or []
+    ]
@@ -0,0 +1,283 @@
+import atexit
+import concurrent.futures
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+from celery.signals import worker_process_init, worker_process_shutdown
+from django.conf import settings
+from .instrumentation import timed_stage
+from .cancellation import TaskCancelled, check_cancelled
+
+logger = logging.getLogger(__name__)
+
+# LibreOffice export filter for each input extension
+PDF_EXPORT_FILTERS = {
+    '.doc': 'writer_pdf_Export',
+    '.docx': 'writer_pdf_Export',
+    '.odt': 'writer_pdf_Export',
+    '.rtf': 'writer_pdf_Export',
+    '.ppt': 'impress_pdf_Export',
+    '.pptx': 'impress_pdf_Export',
+    '.odp': 'impress_pdf_Export',
+    '.xls': 'calc_pdf_Export',
+    '.xlsx': 'calc_pdf_Export',
+    '.ods': 'calc_pdf_Export',
+}
+
+
+class OfficeConversionError(Exception):
+    pass
+
+
+def _properties(**values):
+    import uno
+    props = []
+    for name, value in values.items():
+        prop = uno.createUnoStruct("com.sun.star.beans.PropertyValue")
+        prop.Name = name
+        prop.Value = value
+        props.append(prop)
+    return tuple(props)
+
+
+class OfficeInstance:
+    """One long-running headless soffice process reached over a named UNO pipe."""
+
+    def __init__(self, index, pipe_name):
+        self.index = index
+        self.pipe_name = pipe_name
+        self.process = None
+        self.profile_dir = None
+        self.desktop = None
+        self.jobs = 0
+        self.needs_restart = False
+
+    def start(self):
+        self.profile_dir = tempfile.mkdtemp(prefix=f"lo_profile_{self.index}_")
+        command = [
+            settings.SOFFICE_BINARY,
+            "--headless",
+            "--invisible",
+            "--nologo",
+            "--nodefault",
+            "--norestore",
+            "--nolockcheck",
+            f"--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext",
+            f"-env:UserInstallation={Path(self.profile_dir).as_uri()}",
+        ]
+        logger.info(f"Starting office instance {self.index} on pipe {self.pipe_name}")
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.desktop = self._connect(settings.OFFICE_POOL_STARTUP_TIMEOUT)
+        self.jobs = 0
+        self.needs_restart = False
+
+    def _connect(self, timeout):
+        import uno
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local_context
+        )
+        url = f"uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext"
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.process.poll() is not None:
+                raise OfficeConversionError(f"Office instance {self.index} exited during startup")
+            try:
+                context = resolver.resolve(url)
+                return context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+            except Exception:
+                if time.monotonic() > deadline:
+                    raise OfficeConversionError(f"Office instance {self.index} did not accept connections within {timeout}s")
+                time.sleep(0.25)
+
+    def is_healthy(self):
+        if self.process is None or self.process.poll() is not None or self.desktop is None:
+            return False
+        try:
+            self.desktop.getComponents()
+            return True
+        except Exception as e:
+            logger.warning(f"Office instance {self.index} failed health check: {str(e)}")
+            return False
+
+    def convert(self, input_path, output_path, filter_name):
+        import uno
+        document = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(os.path.abspath(input_path)),
+            "_blank",
+            0,
+            _properties(Hidden=True, ReadOnly=True),
+        )
+        if document is None:
+            raise OfficeConversionError(f"Office could not open {input_path}")
+        try:
+            document.storeToURL(
+                uno.systemPathToFileUrl(os.path.abspath(output_path)),
+                _properties(FilterName=filter_name),
+            )
+        finally:
+            document.close(True)
+        self.jobs += 1
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.profile_dir:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+        self.process = None
+        self.profile_dir = None
+        self.desktop = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+
+class OfficeConverterPool:
+    """
+    Pool of warm headless LibreOffice instances. Each job is handed to an idle
+    instance; instances are health-checked before use, recycled after
+    max_jobs conversions and killed and restarted when a job hangs.
+
+    Each conversion runs on a thread of its own rather than a fixed-size
+    executor: a call stuck in a killed instance may never unwind, and its
+    thread is abandoned instead of taking a slot from the jobs after it.
+    Capacity is the number of instances.
+    """
+
+    def __init__(self, size, max_jobs, job_timeout):
+        self.max_jobs = max_jobs
+        self.job_timeout = job_timeout
+        # Pipe names are per process so prefork children never share an instance
+        self._instances = [OfficeInstance(i, f"office_pool_{os.getpid()}_{i}") for i in range(size)]
+        self._idle = queue.Queue()
+        for instance in self._instances:
+            self._idle.put(instance)
+
+    def warm_up(self):
+        for _ in range(len(self._instances)):
+            self._release(self._acquire())
+
+    def convert(self, input_path, output_path):
+        extension = os.path.splitext(input_path)[1].lower()
+        filter_name = PDF_EXPORT_FILTERS.get(extension)
+        if not filter_name:
+            raise ValueError(f"Unsupported office format: {extension}")
+
+        with timed_stage("office_acquire"):
+            instance = self._acquire()
+        try:
+            future = self._start(instance, input_path, output_path, filter_name)
+            try:
+                self._wait(future, self.job_timeout)
+            except concurrent.futures.TimeoutError:
+                logger.error(f"Office instance {instance.index} hung converting {input_path}, restarting it")
+                # Killing soffice breaks the UNO bridge so the blocked call unwinds
+                instance.stop()
+                raise OfficeConversionError(f"Conversion of {input_path} timed out after {self.job_timeout}s")
+            except TaskCancelled:
+                logger.info(f"Stopping office instance {instance.index} for a cancelled conversion of {input_path}")
+                instance.stop()
+                raise
+        except Exception:
+            instance.needs_restart = True
+            raise
+        finally:
+            self._release(instance)
+
+        logger.info(f"Office instance {instance.index} converted {input_path} ({instance.jobs} jobs)")
+        return output_path
+
+    @staticmethod
+    def _start(instance, input_path, output_path, filter_name):
+        future = concurrent.futures.Future()
+
+        def run():
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(instance.convert(input_path, output_path, filter_name))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name=f"office_{instance.index}", daemon=True).start()
+        return future
+
+    @staticmethod
+    def _wait(future, timeout, poll_interval=0.5):
+        """future.result(timeout) that gives up early when the calling task is cancelled."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise concurrent.futures.TimeoutError()
+            try:
+                return future.result(timeout=min(poll_interval, remaining))
+            except concurrent.futures.TimeoutError:
+                check_cancelled()
+
+    def _acquire(self):
+        try:
+            instance = self._idle.get(timeout=settings.OFFICE_POOL_ACQUIRE_TIMEOUT)
+        except queue.Empty:
+            raise OfficeConversionError("No office converter instance became available")
+        try:
+            if instance.needs_restart or instance.jobs >= self.max_jobs or not instance.is_healthy():
+                instance.restart()
+        except Exception:
+            instance.needs_restart = True
+            self._idle.put(instance)
+            raise
+        return instance
+
+    def _release(self, instance):
+        self._idle.put(instance)
+
+    def shutdown(self):
+        for instance in self._instances:
+            try:
+                instance.stop()
+            except Exception as e:
+                logger.error(f"Failed to stop office instance {instance.index}: {str(e)}")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_office_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OfficeConverterPool(
+                size=settings.OFFICE_POOL_SIZE,
+                max_jobs=settings.OFFICE_POOL_MAX_JOBS,
+                job_timeout=settings.OFFICE_CONVERT_TIMEOUT,
+            )
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+@worker_process_init.connect
+def prewarm_office_pool(**kwargs):
+    if settings.OFFICE_POOL_PREWARM:
+        try:
+            get_office_pool().warm_up()
+        except Exception as e:
+            logger.error(f"Failed to prewarm office pool: {str(e)}")
+
+
+@worker_process_shutdown.connect
+def shutdown_office_pool(**kwargs):
+    if _pool is not None:
+        _pool.shutdown()
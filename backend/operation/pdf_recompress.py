@@ -0,0 +1,113 @@
+import concurrent.futures
+import contextvars
+import io
+import logging
+import os
+import fitz
+from django.conf import settings
+from .cancellation import check_cancelled
+
+logger = logging.getLogger(__name__)
+
+# Images below this many pixels aren't worth a decode and re-encode
+MIN_IMAGE_PIXELS = 64 * 64
+
+
+def _placements(doc):
+    """{xref: (page number, highest effective DPI)} for every image XObject drawn on a page."""
+    placements = {}
+    for page in doc:
+        for info in page.get_image_info(xrefs=True):
+            xref = info.get("xref")
+            if not xref:
+                continue  # Inline images are part of the content stream
+            placed_width = fitz.Rect(info["bbox"]).width / 72
+            dpi = info["width"] / placed_width if placed_width > 0 else 0
+            number, seen_dpi = placements.get(xref, (page.number, 0))
+            placements[xref] = (number, max(seen_dpi, dpi))
+    return placements
+
+
+def _recompressible(doc, xref):
+    """
+    Whether an image can be re-encoded as a plain JPEG without changing how
+    it looks: no soft mask or colour-key mask, no Decode array, 8-bit grey
+    or RGB. Bilevel scans (CCITT, JBIG2) and CMYK are left as they are.
+    """
+    for key in ("SMask", "Mask", "Decode"):
+        if doc.xref_get_key(xref, key)[0] != "null":
+            return False
+    kind, bits = doc.xref_get_key(xref, "BitsPerComponent")
+    return kind != "int" or int(bits) > 1
+
+
+def recompress_image(data, components, scale, quality_factor):
+    """JPEG bytes of one encoded image, scaled by `scale` (if below 1) at quality_factor."""
+    from PIL import Image
+    check_cancelled()
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("L" if components == 1 else "RGB")
+        if scale < 1:
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            image = image.resize(size, Image.BICUBIC)
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=max(1, int(quality_factor * 100)), optimize=True)
+    return buffer.getvalue()
+
+
+def recompress_pdf_images(input_pdf_path, output_pdf_path, quality_factor, resolution=72):
+    """
+    Downsamples every image XObject above `resolution` DPI and re-encodes it
+    as JPEG at quality_factor, swapping each stream in place when the result
+    is smaller; text, fonts and vector content are copied untouched. Images
+    are decoded and encoded on PDF_RECOMPRESS_WORKERS threads (Pillow
+    releases the GIL for both) while this thread reads and writes the
+    document, which PyMuPDF only allows from one thread. Returns the output size.
+    """
+    replaced = 0
+    saved_bytes = 0
+    with fitz.open(input_pdf_path) as doc:
+        placements = _placements(doc)
+
+        def replace(xref, stored_bytes, future):
+            nonlocal replaced, saved_bytes
+            try:
+                data = future.result()
+            except OSError as e:
+                logger.warning(f"Keeping image {xref} as is, Pillow can't decode it: {str(e)}")
+                return
+            if len(data) < stored_bytes:
+                doc[placements[xref][0]].replace_image(xref, stream=data)
+                replaced += 1
+                saved_bytes += stored_bytes - len(data)
+
+        max_workers = settings.PDF_RECOMPRESS_WORKERS
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Bounded in-flight window, so only a few decoded images are held at once
+            pending = {}
+            for xref, (_, dpi) in placements.items():
+                check_cancelled()
+                if not _recompressible(doc, xref):
+                    continue
+                image = doc.extract_image(xref)
+                if not image or image["width"] * image["height"] < MIN_IMAGE_PIXELS or image["colorspace"] not in (1, 3):
+                    continue
+                scale = resolution / dpi if dpi > resolution else 1.0
+                stored_bytes = len(doc.xref_stream_raw(xref))
+                # Run in a copy of the task's context so workers see its cancellation token
+                future = executor.submit(
+                    contextvars.copy_context().run,
+                    recompress_image, image["image"], image["colorspace"], scale, quality_factor,
+                )
+                pending[future] = (xref, stored_bytes)
+                if len(pending) >= 2 * max_workers:
+                    done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        replace(*pending.pop(future), future)
+            for future in concurrent.futures.as_completed(list(pending)):
+                replace(*pending.pop(future), future)
+
+        doc.save(output_pdf_path, garbage=4, deflate=True)
+    logger.info(f"Recompressed {replaced} of {len(placements)} images at quality {quality_factor}, "
+                f"{resolution} dpi, saving {saved_bytes} bytes")
+    return os.path.getsize(output_pdf_path)
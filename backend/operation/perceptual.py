@@ -0,0 +1,154 @@
+import io
+import logging
+import math
+from django.conf import settings
+from .cancellation import check_cancelled
+
+logger = logging.getLogger(__name__)
+
+# SSIM stabilising constants for 8-bit planes, as in Wang et al. (2004)
+C1 = (0.01 * 255) ** 2
+C2 = (0.03 * 255) ** 2
+WINDOW = 8
+
+LOSSY_FORMATS = ("JPEG", "WEBP")
+MIN_QUALITY = 10
+MAX_QUALITY = 95
+
+
+def parse_quality_floor(value):
+    """The minimum SSIM a job asked for: True means PERCEPTUAL_MIN_SSIM, a number is used as is, falsy means no floor."""
+    if value in (None, False, "", 0):
+        return None
+    if value is True or str(value).strip().lower() in ("true", "yes", "on"):
+        return settings.PERCEPTUAL_MIN_SSIM
+    floor = float(value)
+    if not 0 < floor < 1:
+        raise ValueError(f"quality_floor must be an SSIM between 0 and 1, not {value}")
+    return floor
+
+
+def luma(image, size=None):
+    """
+    Luma plane of a PIL image as a float64 array: box-downsampled to `size`
+    (width, height), or so its longer side is at most PERCEPTUAL_MAX_SIDE.
+    """
+    import numpy as np
+    from PIL import Image
+    grey = image.convert("L")
+    if size is None:
+        scale = min(1.0, settings.PERCEPTUAL_MAX_SIDE / max(grey.size))
+        size = (max(WINDOW, round(grey.width * scale)), max(WINDOW, round(grey.height * scale)))
+    if grey.size != tuple(size):
+        grey = grey.resize(tuple(size), Image.Resampling.BOX)
+    return np.asarray(grey, dtype=np.float64)
+
+
+def _window_means(plane):
+    # Mean of every WINDOW x WINDOW block, from a summed-area table: O(pixels) whatever the window
+    import numpy as np
+    table = np.pad(plane, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    sums = table[WINDOW:, WINDOW:] - table[:-WINDOW, WINDOW:] - table[WINDOW:, :-WINDOW] + table[:-WINDOW, :-WINDOW]
+    return sums / (WINDOW * WINDOW)
+
+
+def ssim(reference, candidate):
+    """Mean structural similarity of two equally sized luma planes, over sliding 8x8 windows."""
+    import numpy as np
+    mean_r = _window_means(reference)
+    mean_c = _window_means(candidate)
+    var_r = _window_means(reference * reference) - mean_r * mean_r
+    var_c = _window_means(candidate * candidate) - mean_c * mean_c
+    covariance = _window_means(reference * candidate) - mean_r * mean_c
+    numerator = (2 * mean_r * mean_c + C1) * (2 * covariance + C2)
+    denominator = (mean_r * mean_r + mean_c * mean_c + C1) * (var_r + var_c + C2)
+    return float(np.mean(numerator / denominator))
+
+
+def psnr(reference, candidate):
+    import numpy as np
+    mse = float(np.mean((reference - candidate) ** 2))
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def meets_floor(reference, candidate, min_ssim):
+    """Whether `candidate` looks close enough to `reference`: SSIM at least min_ssim and PSNR at least PERCEPTUAL_MIN_PSNR."""
+    return ssim(reference, candidate) >= min_ssim and psnr(reference, candidate) >= settings.PERCEPTUAL_MIN_PSNR
+
+
+# Images
+
+def _encode(image, image_format, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def smallest_encode(image, image_format, min_ssim):
+    """
+    (quality, bytes) of the lowest-quality encode of `image` whose luma still
+    meets the floor against the image itself, by binary search over quality.
+    SSIM only rises with quality, so about seven encodes settle it.
+    """
+    from PIL import Image
+    if image_format == "JPEG" and image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    reference = luma(image)
+    size = (reference.shape[1], reference.shape[0])
+    low, high = MIN_QUALITY, MAX_QUALITY
+    best = None
+    while low <= high:
+        check_cancelled()
+        quality = (low + high) // 2
+        data = _encode(image, image_format, quality)
+        with Image.open(io.BytesIO(data)) as decoded:
+            candidate = luma(decoded, size)
+        if meets_floor(reference, candidate, min_ssim):
+            best = (quality, data)
+            high = quality - 1
+        else:
+            low = quality + 1
+    return best or (MAX_QUALITY, _encode(image, image_format, MAX_QUALITY))
+
+
+# PDFs
+
+class PdfReference:
+    """
+    Luma planes of a few pages of the original PDF (first, middle and last,
+    up to PERCEPTUAL_PDF_PAGES), rendered once so each compression pass can
+    be checked against them by rendering only the candidate's pages.
+    """
+
+    def __init__(self, pdf_path):
+        import fitz
+        with fitz.open(pdf_path) as doc:
+            count = doc.page_count
+            wanted = settings.PERCEPTUAL_PDF_PAGES
+            self.pages = sorted({round(i * (count - 1) / max(1, wanted - 1)) for i in range(min(wanted, count))})
+            self.planes = [self._render(doc[number]) for number in self.pages]
+
+    @staticmethod
+    def _render(page, size=None):
+        import fitz
+        from PIL import Image
+        longer = max(page.rect.width, page.rect.height)
+        zoom = settings.PERCEPTUAL_MAX_SIDE / longer if longer else 1
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+        image = Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+        return luma(image, size or image.size)
+
+    def similarity(self, candidate_path):
+        """Lowest (SSIM, PSNR) over the sampled pages of a candidate with the same pages."""
+        import fitz
+        scores = []
+        with fitz.open(candidate_path) as doc:
+            for number, reference in zip(self.pages, self.planes):
+                candidate = self._render(doc[number], (reference.shape[1], reference.shape[0]))
+                scores.append((ssim(reference, candidate), psnr(reference, candidate)))
+        return min(score[0] for score in scores), min(score[1] for score in scores)
+
+    def meets_floor(self, candidate_path, min_ssim):
+        score, peak = self.similarity(candidate_path)
+        logger.debug(f"Candidate {candidate_path}: SSIM {score:.4f}, PSNR {peak:.1f} dB")
+        return score >= min_ssim and peak >= settings.PERCEPTUAL_MIN_PSNR
@@ -0,0 +1,222 @@
+import concurrent.futures
+import contextvars
+import logging
+import os
+from django.conf import settings
+from .compression_planner import ENGINES, RACE_ENGINE
+from .instrumentation import timed_stage
+from .progress import ProgressReporter
+
+logger = logging.getLogger(__name__)
+
+# Reference to the uploaded files in a step's "inputs"
+INPUT = "input"
+
+# Operation -> (kind, output extension). "map" stages turn each input into one
+# output and run item-parallel; "merge" stages turn all inputs into a single
+# artifact. An extension of None keeps the input's (or the requested format's).
+STAGES = {
+    "images_to_pdf": ("merge", ".pdf"),
+    "compress_pdf": ("map", ".pdf"),
+    "word_to_pdf": ("map", ".pdf"),
+    "ppt_to_pdf": ("map", ".pdf"),
+    "excel_to_pdf": ("map", ".pdf"),
+    "pdf_to_word": ("map", ".docx"),
+    "pdf_to_excel": ("map", ".xlsx"),
+    "pdf_to_ppt": ("map", ".pptx"),
+    "convert_image_format": ("map", None),
+    "resize_image": ("map", None),
+}
+
+
+class PipelineError(ValueError):
+    pass
+
+
+def normalize_steps(steps):
+    """
+    Validates a chain produced by parse_intent and returns it with explicit
+    ids and inputs. Each step is {"operation", "params", "inputs"}; a step
+    without "inputs" consumes the previous step (the first one the uploads),
+    so a plain list reads as a linear chain while explicit inputs allow
+    independent branches.
+    """
+    if not isinstance(steps, list) or not steps:
+        raise PipelineError("A pipeline needs at least one step.")
+    if len(steps) > settings.PIPELINE_MAX_STEPS:
+        raise PipelineError(f"A pipeline can have at most {settings.PIPELINE_MAX_STEPS} steps.")
+
+    normalized = []
+    known = {INPUT}
+    for index, step in enumerate(steps):
+        if not isinstance(step, dict):
+            raise PipelineError(f"Step {index + 1} is not an object.")
+        operation = step.get("operation")
+        if operation not in STAGES:
+            raise PipelineError(f"Unsupported pipeline operation: {operation}")
+        params = step.get("params") or {}
+        if not isinstance(params, dict):
+            raise PipelineError(f"Step {index + 1} params must be an object.")
+        engine = params.get("engine")
+        if operation == "compress_pdf" and engine is not None and engine not in (*ENGINES, RACE_ENGINE):
+            raise PipelineError(f"Unknown compression engine: {engine}. Choose one of {', '.join((*ENGINES, RACE_ENGINE))}.")
+        step_id = str(step.get("id") or f"step{index + 1}")
+        if step_id in known:
+            raise PipelineError(f"Duplicate step id: {step_id}")
+        inputs = step.get("inputs") or [normalized[-1]["id"] if normalized else INPUT]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        for ref in inputs:
+            if ref not in known:
+                raise PipelineError(f"Step {step_id} reads '{ref}', which is not an earlier step.")
+        known.add(step_id)
+        normalized.append({"id": step_id, "operation": operation, "params": params, "inputs": list(inputs)})
+    return normalized
+
+
+def sink_steps(steps):
+    """Steps whose output nothing else consumes; these are the pipeline's results."""
+    consumed = {ref for step in steps for ref in step["inputs"]}
+    return [step for step in steps if step["id"] not in consumed]
+
+
+def output_extension(step, input_path):
+    _, extension = STAGES[step["operation"]]
+    if extension:
+        return extension
+    if step["operation"] == "convert_image_format":
+        return f".{step['params'].get('format', 'JPEG').lower()}"
+    return os.path.splitext(input_path)[1].lower()
+
+
+# Stage adapters over the existing conversion helpers in tasks.py
+
+def _compress(input_path, output_path, params):
+    from .tasks import compress_pdf_to_size, parse_size_to_bytes
+    target_bytes = parse_size_to_bytes(params.get("size", "1MB"))
+    if not target_bytes:
+        raise PipelineError(f"Invalid size for compress_pdf: {params.get('size')}")
+    from .perceptual import parse_quality_floor
+    try:
+        quality_floor = parse_quality_floor(params.get("quality_floor"))
+    except ValueError as e:
+        raise PipelineError(str(e))
+    return compress_pdf_to_size(input_path, output_path, target_bytes, engine=params.get("engine"), quality_floor=quality_floor)
+
+
+def _map_function(operation):
+    from . import tasks
+    return {
+        "compress_pdf": _compress,
+        "word_to_pdf": lambda src, dst, params: tasks.convert_word_to_pdf(src, dst),
+        "ppt_to_pdf": lambda src, dst, params: tasks.convert_office_to_pdf(src, dst),
+        "excel_to_pdf": lambda src, dst, params: tasks.convert_office_to_pdf(src, dst),
+        "pdf_to_word": lambda src, dst, params: tasks.convert_pdf_to_word(src, dst),
+        "pdf_to_excel": lambda src, dst, params: tasks.convert_pdf_to_excel(src, dst),
+        "pdf_to_ppt": lambda src, dst, params: tasks.convert_pdf_to_ppt(src, dst),
+        "convert_image_format": lambda src, dst, params: tasks.convert_image(src, dst, params.get("format", "JPEG")),
+        "resize_image": tasks.resize_image,
+    }[operation]
+
+
+def _submit(executor, fn, *args):
+    # Carry the task's stage timer into pool threads
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _run_step(step, input_paths, workspace, item_executor, progress):
+    operation = step["operation"]
+    kind, _ = STAGES[operation]
+    progress.start(step["id"], total=1 if kind == "merge" else len(input_paths))
+    with timed_stage(f"pipeline_{operation}"):
+        if kind == "merge":
+            from .tasks import build_pdf_from_images
+            output_path = workspace.path_for(f"{step['id']}{output_extension(step, input_paths[0])}")
+            build_pdf_from_images(input_paths, output_path, workspace.path_for(f"{step['id']}.html"))
+            outputs = [output_path]
+        else:
+            fn = _map_function(operation)
+            futures = [
+                _submit(
+                    item_executor, fn, path,
+                    workspace.path_for(f"{step['id']}_{i}{output_extension(step, path)}"),
+                    step["params"],
+                )
+                for i, path in enumerate(input_paths)
+            ]
+            for future in futures:
+                future.add_done_callback(lambda _: progress.advance(name=step["id"]))
+            outputs = [future.result() for future in futures]
+
+    for path in outputs:
+        if os.path.getsize(path) == 0:
+            raise ValueError(f"Step {step['id']} ({operation}) produced an empty file")
+    progress.finish(step["id"])
+    logger.info(f"Pipeline step {step['id']} ({operation}) produced {len(outputs)} file(s)")
+    return outputs
+
+
+def run_steps(steps, input_paths, workspace, progress=None):
+    """
+    Runs normalized steps inside `workspace` and returns {step id: [scratch
+    paths]} for the sink steps. Steps start as soon as everything they read
+    is ready, so independent branches run concurrently, and map steps process
+    their items in parallel. Intermediates live only in the scratch workspace
+    (tmpfs for small jobs) and are deleted once their last reader finishes.
+    Each step reports as its own progress stage, counting its items.
+
+    Every finished step is checkpointed in the workspace as "step_<id>". On a
+    retry, sinks whose checkpoint survived are not run again, and neither is
+    any step that only fed them.
+    """
+    progress = progress or ProgressReporter()
+    artifacts = {INPUT: list(input_paths)}
+    by_id = {step["id"]: step for step in steps}
+    needed = set()
+
+    def require(step_id):
+        if step_id == INPUT or step_id in needed or step_id in artifacts:
+            return
+        restored = workspace.restore(f"step_{step_id}")
+        if restored is not None:
+            artifacts[step_id] = restored
+            return
+        needed.add(step_id)
+        for ref in by_id[step_id]["inputs"]:
+            require(ref)
+
+    for step in sink_steps(steps):
+        require(step["id"])
+    pending = [step for step in steps if step["id"] in needed]
+    for step in steps:
+        if step["id"] not in needed:
+            progress.start(step["id"])
+            progress.finish(step["id"])
+    readers = {}
+    for step in pending:
+        for ref in step["inputs"]:
+            readers[ref] = readers.get(ref, 0) + 1
+    running = {}
+
+    max_workers = settings.PIPELINE_MAX_WORKERS
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(pending), 1)) as step_executor, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as item_executor:
+        while pending or running:
+            for step in [s for s in pending if all(ref in artifacts for ref in s["inputs"])]:
+                pending.remove(step)
+                inputs = [path for ref in step["inputs"] for path in artifacts[ref]]
+                running[_submit(step_executor, _run_step, step, inputs, workspace, item_executor, progress)] = step
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                artifacts[step["id"]] = future.result()
+                workspace.record(f"step_{step['id']}", artifacts[step["id"]])
+                for ref in step["inputs"]:
+                    readers[ref] -= 1
+                    if readers[ref] == 0 and ref != INPUT:
+                        for path in artifacts.pop(ref):
+                            if os.path.exists(path):
+                                os.remove(path)
+
+    return {step["id"]: artifacts[step["id"]] for step in sink_steps(steps)}
@@ -0,0 +1,112 @@
+import logging
+import threading
+import time
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Custom Celery state carrying a progress snapshot in its meta
+PROGRESS = "PROGRESS"
+
+
+class ProgressReporter:
+    """
+    Publishes a task's progress as Celery PROGRESS state: the running stage,
+    its item counters, overall percent complete and an ETA extrapolated from
+    the throughput observed so far. `plan` lists (stage, weight) pairs so
+    stages of very different cost add up to a sensible percentage; stages
+    outside the plan count with weight 1. Updates are throttled to one per
+    PROGRESS_MIN_INTERVAL seconds, except when a stage starts.
+
+    Without a task (helpers called outside Celery, eager runs) nothing is
+    published, so conversion helpers can always report unconditionally.
+    """
+
+    def __init__(self, task=None, plan=()):
+        self.task = task
+        self.weights = dict(plan)
+        self.stages = {}
+        self.stage_name = None
+        self.started = time.monotonic()
+        self._last_publish = 0.0
+        self._lock = threading.RLock()
+
+    def start(self, name, total=None):
+        with self._lock:
+            self.weights.setdefault(name, 1)
+            self.stages[name] = {"current": 0, "total": total, "done": False}
+            self.stage_name = name
+        self._publish(force=True)
+
+    def advance(self, count=1, name=None):
+        with self._lock:
+            self.stages[name or self.stage_name]["current"] += count
+        self._publish()
+
+    def update(self, current, total=None, name=None):
+        with self._lock:
+            stage = self.stages[name or self.stage_name]
+            stage["current"] = current
+            if total is not None:
+                stage["total"] = total
+        self._publish()
+
+    def finish(self, name=None):
+        with self._lock:
+            stage = self.stages[name or self.stage_name]
+            stage["done"] = True
+            stage["current"] = stage["total"] or stage["current"]
+        self._publish()
+
+    def fraction(self):
+        with self._lock:
+            total_weight = sum(self.weights.values())
+            if not total_weight:
+                return 0.0
+            done = 0.0
+            for name, weight in self.weights.items():
+                stage = self.stages.get(name)
+                if stage is None:
+                    continue
+                if stage["done"]:
+                    done += weight
+                elif stage["total"]:
+                    done += weight * min(1.0, stage["current"] / stage["total"])
+            return done / total_weight
+
+    def snapshot(self):
+        with self._lock:
+            fraction = self.fraction()
+            elapsed = time.monotonic() - self.started
+            stage = self.stages.get(self.stage_name, {})
+            eta = elapsed * (1 - fraction) / fraction if fraction > 0 else None
+            return {
+                "stage": self.stage_name,
+                "current": stage.get("current", 0),
+                "total": stage.get("total"),
+                "percent": round(fraction * 100, 1),
+                "elapsed_seconds": round(elapsed, 1),
+                "eta_seconds": round(eta, 1) if eta is not None else None,
+            }
+
+    def _publish(self, force=False):
+        task = self.task
+        if task is None or task.request.id is None or task.request.is_eager:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_publish < settings.PROGRESS_MIN_INTERVAL:
+                return
+            self._last_publish = now
+            meta = self.snapshot()
+        try:
+            task.update_state(state=PROGRESS, meta=meta)
+        except Exception as e:
+            logger.warning(f"Could not publish progress for {task.request.id}: {str(e)}")
+
+
+def task_progress(result):
+    """Progress snapshot for an AsyncResult, or None if it isn't reporting any."""
+    if result.state == PROGRESS and isinstance(result.info, dict):
+        return result.info
+    return None
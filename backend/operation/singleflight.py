@@ -0,0 +1,64 @@
+import hashlib
+import json
+import logging
+from celery.result import AsyncResult
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(value):
+    # "1MB" and " 1mb", or "PNG" and "png", ask for the same work
+    if isinstance(value, str):
+        return value.strip().lower()
+    if isinstance(value, dict):
+        return {str(key): _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def job_fingerprint(operation, content_hashes, params=None, owner=None):
+    """
+    Identity of a job: who asked for it, the operation, its normalized params
+    and the content of its inputs, in order. Only the same requester's
+    duplicates coalesce; a task, its outputs and its session are theirs alone.
+    """
+    payload = json.dumps(
+        {"owner": owner, "operation": operation, "params": _normalize(params or {}), "inputs": list(content_hashes)},
+        sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _key(fingerprint):
+    return f"inflight_{fingerprint}"
+
+
+def claim(fingerprint, task_id):
+    """
+    Registers `task_id` as the task doing the work for `fingerprint`, unless
+    another task already is. Returns the entry that owns the work,
+    {"task_id"}; when its task_id isn't ours the caller should
+    attach to that task rather than enqueue a new one. Failed owners are
+    taken over, so a retry after an error does real work again.
+    """
+    cache = caches["shared"]
+    entry = {"task_id": task_id}
+    if cache.add(_key(fingerprint), entry, timeout=settings.TASK_DEADLINE_SECONDS):
+        return entry
+    existing = cache.get(_key(fingerprint))
+    if existing is None or AsyncResult(existing["task_id"]).failed():
+        cache.set(_key(fingerprint), entry, timeout=settings.TASK_DEADLINE_SECONDS)
+        return entry
+    logger.info(f"Coalescing duplicate job into in-flight task {existing['task_id']}")
+    return existing
+
+
+def release(fingerprint, task_id):
+    """Forgets the in-flight job once its owner has collected the result."""
+    cache = caches["shared"]
+    existing = cache.get(_key(fingerprint))
+    if existing is not None and existing["task_id"] == task_id:
+        cache.delete(_key(fingerprint))
@@ -0,0 +1,463 @@
+import abc
+import functools
+import io
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import closing, contextmanager
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return  # Directories can't be opened for fsync on every platform
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def publish_file(source_path, final_path):
+    """
+    Durably and atomically place a file at final_path. The source is left in
+    place, hard-linked where possible (same filesystem), copied otherwise.
+    """
+    final_dir = os.path.dirname(os.path.abspath(final_path))
+    os.makedirs(final_dir, exist_ok=True)
+    staging_path = os.path.join(final_dir, f".{os.path.basename(final_path)}.{uuid.uuid4().hex}.part")
+    try:
+        try:
+            # Same filesystem: a hard link to the fsynced file is enough
+            with open(source_path, 'rb') as f:
+                os.fsync(f.fileno())
+            os.link(source_path, staging_path)
+        except OSError:
+            with open(source_path, 'rb') as src, open(staging_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+                dst.flush()
+                os.fsync(dst.fileno())
+        os.replace(staging_path, final_path)
+    except Exception:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+        raise
+    _fsync_dir(final_dir)
+    return final_path
+
+
+class Storage(abc.ABC):
+    """
+    Where uploads and results live, addressed by names relative to
+    MEDIA_ROOT ("temp/scan.pdf", "processed/compressed_<task>.pdf"), so the
+    same name works on every web and worker node. Subclasses provide
+    writer(), open(), read_range(), size(), modified(), exists(), delete()
+    and list(); upload() and download() move whole files between storage and
+    local disk.
+    """
+
+    @abc.abstractmethod
+    def writer(self, name):
+        """Context manager giving a writable file; the object appears, whole, only when it exits cleanly."""
+
+    @abc.abstractmethod
+    def open(self, name):
+        """A readable binary file-like over the whole object."""
+
+    @abc.abstractmethod
+    def read_range(self, name, start=0, end=None):
+        """Yields bytes start..end (inclusive, as in an HTTP Range) of the object, in chunks."""
+
+    @abc.abstractmethod
+    def size(self, name):
+        """Size of the object in bytes."""
+
+    @abc.abstractmethod
+    def modified(self, name):
+        """Last-modified time as a Unix timestamp."""
+
+    @abc.abstractmethod
+    def exists(self, name):
+        """Whether the object is stored."""
+
+    @abc.abstractmethod
+    def delete(self, name):
+        """Removes the object; a missing one is not an error."""
+
+    @abc.abstractmethod
+    def list(self, prefix):
+        """Yields (name, last-modified timestamp) for every object whose name starts with prefix."""
+
+    def upload(self, local_path, name):
+        with open(local_path, "rb") as src, self.writer(name) as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+    def download(self, name, local_path):
+        os.makedirs(os.path.dirname(os.path.abspath(local_path)), exist_ok=True)
+        staging_path = f"{local_path}.{uuid.uuid4().hex}.part"
+        try:
+            with open(staging_path, "wb") as dst:
+                for chunk in self.read_range(name):
+                    dst.write(chunk)
+            os.replace(staging_path, local_path)
+        except Exception:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+            raise
+
+
+class LocalStorage(Storage):
+    """Files under MEDIA_ROOT: the node's local copy of an object is the object itself."""
+
+    def path(self, name):
+        return os.path.join(settings.MEDIA_ROOT, name)
+
+    @contextmanager
+    def writer(self, name):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        staging_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex}.part")
+        try:
+            # Atomic but not fsynced: uploads can be sent again, results go through publish_file
+            with open(staging_path, "wb") as f:
+                yield f
+            os.replace(staging_path, path)
+        except BaseException:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+            raise
+
+    def open(self, name):
+        return open(self.path(name), "rb")
+
+    def read_range(self, name, start=0, end=None):
+        with open(self.path(name), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end + 1 - start
+            while remaining is None or remaining > 0:
+                chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                yield chunk
+                if remaining is not None:
+                    remaining -= len(chunk)
+
+    def size(self, name):
+        return os.path.getsize(self.path(name))
+
+    def modified(self, name):
+        return os.path.getmtime(self.path(name))
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def delete(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix):
+        for directory, _, filenames in os.walk(self.path(os.path.dirname(prefix))):
+            for filename in filenames:
+                if filename.startswith("."):
+                    continue  # A write still in progress
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, "/")
+                if not name.startswith(prefix):
+                    continue
+                try:
+                    yield name, os.path.getmtime(path)
+                except FileNotFoundError:
+                    pass  # Deleted since the walk listed it
+
+    def upload(self, local_path, name):
+        if os.path.abspath(local_path) != os.path.abspath(self.path(name)):
+            publish_file(local_path, self.path(name))
+
+    def download(self, name, local_path):
+        if os.path.abspath(local_path) != os.path.abspath(self.path(name)):
+            super().download(name, local_path)
+
+
+class MemoryStorage(Storage):
+    """Objects held in this process, shared by every instance; for tests and development."""
+
+    _objects = {}
+    _lock = threading.Lock()
+
+    @contextmanager
+    def writer(self, name):
+        buffer = io.BytesIO()
+        yield buffer
+        with self._lock:
+            self._objects[name] = (buffer.getvalue(), time.time())
+
+    def _get(self, name):
+        with self._lock:
+            try:
+                return self._objects[name]
+            except KeyError:
+                raise FileNotFoundError(name) from None
+
+    def open(self, name):
+        return io.BytesIO(self._get(name)[0])
+
+    def read_range(self, name, start=0, end=None):
+        data = self._get(name)[0]
+        stop = len(data) if end is None else min(end + 1, len(data))
+        for offset in range(start, stop, CHUNK_SIZE):
+            yield data[offset:min(offset + CHUNK_SIZE, stop)]
+
+    def size(self, name):
+        return len(self._get(name)[0])
+
+    def modified(self, name):
+        return self._get(name)[1]
+
+    def exists(self, name):
+        with self._lock:
+            return name in self._objects
+
+    def delete(self, name):
+        with self._lock:
+            self._objects.pop(name, None)
+
+    def list(self, prefix):
+        with self._lock:
+            listed = [(name, modified) for name, (_, modified) in self._objects.items() if name.startswith(prefix)]
+        return iter(listed)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._objects.clear()
+
+
+class _MultipartWriter:
+    """
+    Streams writes to S3 as a multipart upload of STORAGE_MULTIPART_CHUNK_SIZE
+    parts, so only one part is held in memory. Objects smaller than one part
+    are sent with a single PUT.
+    """
+
+    def __init__(self, client, bucket, key):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = settings.STORAGE_MULTIPART_CHUNK_SIZE
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def _upload_part(self, data):
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)["UploadId"]
+        number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=data,
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": number})
+
+    def complete(self):
+        if self.upload_id is None:
+            self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer))
+            return
+        if self.buffer:
+            self._upload_part(bytes(self.buffer))  # The last part may be under the minimum
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": self.parts},
+        )
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+class S3Storage(Storage):
+    """
+    Objects in AWS_STORAGE_BUCKET_NAME, under STORAGE_PREFIX. Any
+    S3-compatible service (MinIO, a local stand-in) works through
+    AWS_S3_ENDPOINT_URL. Writes are multipart uploads; reads are ranged GETs.
+    """
+
+    def __init__(self):
+        import boto3
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=settings.AWS_S3_ENDPOINT_URL or None,
+            region_name=settings.AWS_S3_REGION_NAME,
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        )
+        self.bucket = settings.AWS_STORAGE_BUCKET_NAME
+
+    def key(self, name):
+        return f"{settings.STORAGE_PREFIX}{name}"
+
+    @contextmanager
+    def writer(self, name):
+        upload = _MultipartWriter(self.client, self.bucket, self.key(name))
+        try:
+            yield upload
+        except BaseException:
+            upload.abort()
+            raise
+        upload.complete()
+
+    def _missing(self, error):
+        return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def _head(self, name):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except ClientError as e:
+            if self._missing(e):
+                raise FileNotFoundError(name) from e
+            raise
+
+    def open(self, name):
+        return self.client.get_object(Bucket=self.bucket, Key=self.key(name))["Body"]
+
+    def read_range(self, name, start=0, end=None):
+        if start == 0 and end is None:
+            body = self.open(name)  # No Range header: a ranged GET of an empty object is refused
+        else:
+            byte_range = f"bytes={start}-{'' if end is None else end}"
+            body = self.client.get_object(Bucket=self.bucket, Key=self.key(name), Range=byte_range)["Body"]
+        with closing(body):
+            yield from body.iter_chunks(CHUNK_SIZE)
+
+    def size(self, name):
+        return self._head(name)["ContentLength"]
+
+    def modified(self, name):
+        return self._head(name)["LastModified"].timestamp()
+
+    def exists(self, name):
+        try:
+            self._head(name)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def list(self, prefix):
+        pages = self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self.key(prefix))
+        for page in pages:
+            for item in page.get("Contents", []):
+                yield item["Key"][len(settings.STORAGE_PREFIX):], item["LastModified"].timestamp()
+
+
+BACKENDS = {"local": LocalStorage, "memory": MemoryStorage, "s3": S3Storage}
+
+
+def get_storage():
+    """The STORAGE_BACKEND in use."""
+    return _storage(settings.STORAGE_BACKEND)
+
+
+@functools.lru_cache(maxsize=None)
+def _storage(backend):
+    try:
+        return BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}. Choose one of {', '.join(BACKENDS)}.") from None
+
+
+# Tasks and views pass around local paths under MEDIA_ROOT, as they always
+# have; these map a path to its stored object and keep the two in step.
+
+def storage_name(path):
+    """The storage name for a path under MEDIA_ROOT, or None for a path outside it."""
+    relative = os.path.relpath(os.path.abspath(path), os.path.abspath(settings.MEDIA_ROOT))
+    if relative == os.curdir or relative.startswith(os.pardir + os.sep) or relative == os.pardir:
+        return None
+    return relative.replace(os.sep, "/")
+
+
+class _Tee:
+
+    def __init__(self, *files):
+        self.files = files
+
+    def write(self, data):
+        for f in self.files:
+            f.write(data)
+        return len(data)
+
+
+@contextmanager
+def spool(path):
+    """
+    Writable file for a new upload at `path`: stored, and kept on this node
+    as well (the cost model and the chat read it back), in the one pass.
+    """
+    storage = get_storage()
+    name = storage_name(path)
+    if name is None:
+        with open(path, "wb") as f:
+            yield f
+        return
+    if isinstance(storage, LocalStorage):
+        with storage.writer(name) as f:
+            yield f
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as local, storage.writer(name) as stored:
+        yield _Tee(local, stored)
+
+
+def localize(path):
+    """Makes sure a stored object is on this node at its local path, fetching it if need be."""
+    name = storage_name(path) if path else None
+    if name is not None and not os.path.exists(path):
+        logger.debug(f"Fetching {name} from storage")
+        get_storage().download(name, path)
+    return path
+
+
+def publish(source_path, final_path):
+    """Stores a finished file as the object for final_path (a path outside MEDIA_ROOT is just written there)."""
+    name = storage_name(final_path)
+    if name is None:
+        return publish_file(source_path, final_path)
+    get_storage().upload(source_path, name)
+    return final_path
+
+
+def discard(path):
+    """Removes the stored object for `path` and this node's copy of it."""
+    name = storage_name(path)
+    if name is not None:
+        get_storage().delete(name)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def stored_size(path):
+    name = storage_name(path)
+    return os.path.getsize(path) if name is None else get_storage().size(name)
+
+
+def stored_exists(path):
+    name = storage_name(path) if path else None
+    return os.path.exists(path) if name is None else get_storage().exists(name)
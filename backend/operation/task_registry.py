@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta, timezone
+from django.conf import settings
+from django.core.cache import caches
+from backend.celery import app
+from .cancellation import flag_cancelled
+
+# Operation name (as produced by parse_intent) -> registered Celery task name.
+# The web tier enqueues through this table so it never imports operation.tasks
+# and the conversion libraries behind it.
+TASKS = {
+    "convert_and_compress_images_to_pdf": "operation.tasks.convert_and_compress_images_to_pdf",
+    "convert_parallel_operations": "operation.tasks.convert_parallel_operations",
+    "images_to_pdf": "operation.tasks.images_to_pdf",
+    "compress_pdf": "operation.tasks.compress_pdf",
+    "word_to_pdf": "operation.tasks.word_to_pdf",
+    "pdf_to_word": "operation.tasks.pdf_to_word",
+    "ppt_to_pdf": "operation.tasks.ppt_to_pdf",
+    "excel_to_pdf": "operation.tasks.excel_to_pdf",
+    "pdf_to_excel": "operation.tasks.pdf_to_excel",
+    "pdf_to_ppt": "operation.tasks.pdf_to_ppt",
+    "convert_image_format": "operation.tasks.convert_image_format",
+    "resize_image": "operation.tasks.resize_image_task",
+    "pipeline": "operation.tasks.run_pipeline",
+}
+
+
+def enqueue(operation, *args, **options):
+    """
+    Sends the task for `operation` by name and returns its AsyncResult. Unless
+    the caller passes its own `expires`, the task gets a TASK_DEADLINE_SECONDS
+    deadline: Celery drops it if it hasn't started by then, retries keep the
+    same expiry, and the running task treats it as its cancellation deadline.
+    A `queue` of None keeps the default queue.
+    """
+    try:
+        task_name = TASKS[operation]
+    except KeyError:
+        raise ValueError(f"Unsupported operation: {operation}")
+    if options.get("queue") is None:
+        options.pop("queue", None)
+    options.setdefault("expires", datetime.now(timezone.utc) + timedelta(seconds=settings.TASK_DEADLINE_SECONDS))
+    return app.send_task(task_name, args=args, **options)
+
+
+def queue_depth(queues=None):
+    """Messages waiting on the broker across `queues` (the default and heavy-job queues)."""
+    queues = queues or [q for q in (app.conf.task_default_queue, settings.COST_HEAVY_QUEUE) if q]
+    depth = 0
+    with app.connection_for_read() as connection:
+        for queue in queues:
+            try:
+                depth += connection.default_channel.queue_declare(queue=queue, passive=True).message_count
+            except connection.channel_errors:
+                pass  # Not declared yet: nothing has been sent to it
+    return depth
+
+
+def cancel(task_id):
+    """Drops a queued task and asks a running one to stop at its next checkpoint."""
+    flag_cancelled(task_id)
+    app.control.revoke(task_id)
+
+
+def _owner_key(task_id):
+    return f"task_owner_{task_id}"
+
+
+def record_owner(task_id, owner):
+    """
+    Claims task_id for whoever is submitting it ("user:<pk>" or
+    "session:<key>"), so only they can cancel it, before anything runs under
+    it. Returns False if the id was already claimed. Kept for twice the
+    deadline: past that, the task is long gone.
+    """
+    return caches["shared"].add(_owner_key(task_id), {"owner": owner, "attached": False},
+                                timeout=settings.TASK_DEADLINE_SECONDS * 2)
+
+
+def attach(task_id):
+    """Notes that a coalesced duplicate is also waiting on task_id."""
+    cache = caches["shared"]
+    record = cache.get(_owner_key(task_id))
+    if record is not None:
+        record["attached"] = True
+        cache.set(_owner_key(task_id), record, timeout=settings.TASK_DEADLINE_SECONDS * 2)
+
+
+def is_owner(task_id, owner, alone=False):
+    """
+    Whether `owner` submitted task_id. With `alone`, also that no duplicate
+    attached to it, i.e. nobody else is waiting on the result.
+    """
+    record = caches["shared"].get(_owner_key(task_id))
+    return record is not None and record["owner"] == owner and not (alone and record["attached"])
@@ -1,30 +1,44 @@
 import os
-import pdfkit
+import contextvars
+import functools
 import subprocess
 from celery import shared_task
-from PIL import Image
-from PyPDF2 import PdfWriter, PdfReader
-import io
+from celery.exceptions import Retry
 from django.conf import settings
 import logging
 from urllib.parse import quote
-import multiprocessing
 import concurrent.futures
 import re
-from docx import Document
 import uuid
-from pdf2docx import Converter
-import comtypes.client
-import openpyxl
-from pptx import Presentation
-import fitz
-import pythoncom
+import json
+import shutil
 from pathlib import Path
+from .office_pool import get_office_pool
+from .integrity import verify_pdf_integrity, FULL
+from .workspace import task_workspace, discard_workspace
+from .compression_session import CompressionSession
+from .compression_planner import CompressionImpossible, ENGINES, MIN_QUALITY, RACE_ENGINE, analyse_pdf, plan_compression, lower_resolution
+from .compression_race import document_class, preferred_backend, race
+from .image_batch import map_images
+from .image_budget import allocate_budget, assemble_pdf, encode_to_budget, estimate_image
+from .instrumentation import timed_stage
+from .manifest import describe_output
+from .perceptual import LOSSY_FORMATS, PdfReference, parse_quality_floor, smallest_encode
+from .pipeline import PipelineError, normalize_steps, run_steps
+from .progress import ProgressReporter
+from .storage import discard, localize, stored_exists
+from .cancellation import check_cancelled, run_subprocess
 
 logger = logging.getLogger(__name__)
 
-wkhtmltopdf_path = r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe'
-config = pdfkit.configuration(wkhtmltopdf=wkhtmltopdf_path)
+# Conversion libraries (pdfkit, PIL, fitz, pdf2docx, openpyxl, python-pptx,
+# python-docx) are imported inside the functions that need them, so importing
+# this module stays cheap and workers only load what their tasks use.
+
+@functools.lru_cache(maxsize=None)
+def get_wkhtmltopdf_config():
+    import pdfkit
+    return pdfkit.configuration(wkhtmltopdf=settings.WKHTMLTOPDF_PATH)
 
 def parse_size_to_bytes(size_str):
     size_str = size_str.lower().replace(" ", "")
@@ -56,11 +70,14 @@ def cleanup_files(*paths):
             logger.error(f"Failed to delete {path}: {str(e)}")
 
 def resize_image(image_path, output_path, params):
+    from PIL import Image
+    check_cancelled()
     try:
         with Image.open(image_path) as img:
             original_width, original_height = img.size
             new_width, new_height = original_width, original_height
             quality = 95
+            target_bytes = None
 
             if params.get('size'):
                 target_bytes = parse_size_to_bytes(params['size'])
@@ -81,6 +98,16 @@ def resize_image(image_path, output_path, params):
                         new_width = int(new_height * aspect_ratio)
 
             img_resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+            min_ssim = parse_quality_floor(params.get('quality_floor'))
+            image_format = Image.registered_extensions().get(os.path.splitext(output_path)[1].lower(), img.format)
+            if min_ssim and image_format in LOSSY_FORMATS:
+                # The smallest encode that still looks like the image, unless even that misses the size target
+                floor_quality, data = smallest_encode(img_resized, image_format, min_ssim)
+                if not target_bytes or len(data) <= target_bytes:
+                    logger.info(f"Quality floor {min_ssim}: {image_path} encoded at quality {floor_quality}, {len(data)} bytes")
+                    with open(output_path, "wb") as f:
+                        f.write(data)
+                    return output_path
             img_resized.save(output_path, optimize=True, quality=quality)
             return output_path
     except Exception as e:
@@ -88,6 +115,21 @@ def resize_image(image_path, output_path, params):
         raise
 
 def convert_docx_to_pdf(input_path, output_path):
+    try:
+        logger.info(f"Converting DOCX to PDF: {input_path} -> {output_path}")
+        from .docx_render import render_docx_to_pdf
+        render_docx_to_pdf(input_path, output_path)
+        logger.info(f"Generated PDF at {output_path}, size: {os.path.getsize(output_path)} bytes")
+        return output_path
+    except Exception as e:
+        logger.error(f"Error converting {input_path} to PDF: {str(e)}", exc_info=True)
+        raise
+
+# Previous HTML + wkhtmltopdf path, kept as the baseline for benchmark_docx_to_pdf
+def convert_docx_to_pdf_wkhtmltopdf(input_path, output_path):
+    import pdfkit
+    from docx import Document
+    temp_html_path = None
     try:
         logger.info(f"Converting DOCX to PDF: {input_path} -> {output_path}")
         doc = Document(input_path)
@@ -106,7 +148,7 @@ def convert_docx_to_pdf(input_path, output_path):
         pdfkit.from_file(
             temp_html_path,
             output_path,
-            configuration=config,
+            configuration=get_wkhtmltopdf_config(),
             options={
                 "load-error-handling": "ignore",
                 "enable-local-file-access": None,
@@ -119,17 +161,19 @@ def convert_docx_to_pdf(input_path, output_path):
         cleanup_files(temp_html_path)
     except Exception as e:
         logger.error(f"Error converting {input_path} to PDF: {str(e)}", exc_info=True)
-        cleanup_files(temp_html_path)
+        if temp_html_path:
+            cleanup_files(temp_html_path)
         raise
 
 def convert_to_pdf(input_path, output_path):
     if input_path.lower().endswith('.docx'):
         convert_docx_to_pdf(input_path, output_path)
     else:
+        import pdfkit
         pdfkit.from_file(
             input_path,
             output_path,
-            configuration=config,
+            configuration=get_wkhtmltopdf_config(),
             options={
                 "load-error-handling": "ignore",
                 "enable-local-file-access": None,
@@ -139,52 +183,160 @@ def convert_to_pdf(input_path, output_path):
             }
         )
 
-def compress_with_ghostscript(input_pdf_path, output_pdf_path, target_size_bytes):
-    try:
-        initial_size = os.path.getsize(input_pdf_path)
-        quality_factor = 0.9
-
-        while True:
-            command = [
-                "C:\\Program Files\\gs\\gs10.05.0\\bin\\gswin64c",
-                "-sDEVICE=pdfwrite",
-                "-dCompatibilityLevel=1.4",
-                "-dPDFSETTINGS=/screen",
-                "-dColorImageDownsampleType=/Bicubic",
-                "-dColorImageResolution=72",
-                "-dGrayImageDownsampleType=/Bicubic",
-                "-dGrayImageResolution=72",
-                "-dMonoImageDownsampleType=/Subsample",
-                "-dMonoImageResolution=72",
-                "-dDownsampleColorImages=true",
-                "-dDownsampleGrayImages=true",
-                "-dDownsampleMonoImages=true",
-                "-dDetectDuplicateImages=true",
-                "-dAutoFilterColorImages=false",
-                "-dAutoFilterGrayImages=false",
-                "-dQFactor={}".format(quality_factor * 1.0),
-                "-dColorImageQuality={}".format(int(quality_factor * 100)),
-                "-dGrayImageQuality={}".format(int(quality_factor * 100)),
-                "-dNOPAUSE",
-                "-dQUIET",
-                "-dBATCH",
-                f"-sOutputFile={output_pdf_path}",
-                input_pdf_path,
-            ]
-            subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-            current_size = os.path.getsize(output_pdf_path)
-            logger.info(f"Compressed size: {current_size} bytes, Target: {target_size_bytes} bytes")
-
-            if current_size <= target_size_bytes or quality_factor <= 0.1:
+# Quality factor steps from 0.9 down to 0.1
+GHOSTSCRIPT_MAX_PASSES = 9
+
+def ghostscript_pass(input_pdf_path, output_pdf_path, quality_factor, resolution=72):
+    """One Ghostscript rewrite of input_pdf_path at quality_factor and resolution DPI; returns the output size."""
+    check_cancelled()
+    command = [
+        "C:\\Program Files\\gs\\gs10.05.0\\bin\\gswin64c",
+        "-sDEVICE=pdfwrite",
+        "-dCompatibilityLevel=1.4",
+        "-dPDFSETTINGS=/screen",
+        "-dColorImageDownsampleType=/Bicubic",
+        f"-dColorImageResolution={resolution}",
+        "-dGrayImageDownsampleType=/Bicubic",
+        f"-dGrayImageResolution={resolution}",
+        "-dMonoImageDownsampleType=/Subsample",
+        f"-dMonoImageResolution={resolution}",
+        "-dDownsampleColorImages=true",
+        "-dDownsampleGrayImages=true",
+        "-dDownsampleMonoImages=true",
+        "-dDetectDuplicateImages=true",
+        "-dAutoFilterColorImages=false",
+        "-dAutoFilterGrayImages=false",
+        "-dQFactor={}".format(quality_factor * 1.0),
+        "-dColorImageQuality={}".format(int(quality_factor * 100)),
+        "-dGrayImageQuality={}".format(int(quality_factor * 100)),
+        "-dNOPAUSE",
+        "-dQUIET",
+        "-dBATCH",
+        f"-sOutputFile={output_pdf_path}",
+        input_pdf_path,
+    ]
+    with timed_stage("ghostscript_pass"):
+        run_subprocess(command)
+    return os.path.getsize(output_pdf_path)
+
+def rewrite_pdf_lossless(input_pdf_path, output_pdf_path):
+    """Drops unused objects and deflates every stream; leaves images and fonts as they are."""
+    import fitz
+    with fitz.open(input_pdf_path) as doc:
+        doc.save(output_pdf_path, garbage=4, deflate=True, deflate_images=True, deflate_fonts=True, clean=True)
+    return os.path.getsize(output_pdf_path)
+
+def image_recompression_pass(input_pdf_path, output_pdf_path, quality_factor, resolution=72):
+    """One in-place re-encode of input_pdf_path's images at quality_factor and resolution DPI; returns the output size."""
+    from .pdf_recompress import recompress_pdf_images
+    check_cancelled()
+    with timed_stage("image_recompression_pass"):
+        return recompress_pdf_images(input_pdf_path, output_pdf_path, quality_factor, resolution)
+
+# Lossy pass for each compression engine, all (input, output, quality, resolution) -> size
+COMPRESSION_PASSES = {
+    "ghostscript": ghostscript_pass,
+    "images": image_recompression_pass,
+}
+
+def resolve_engine(engine=None):
+    engine = engine or settings.PDF_COMPRESSION_ENGINE
+    if engine not in ENGINES and engine != RACE_ENGINE:
+        raise ValueError(f"Unknown compression engine: {engine}")
+    return engine
+
+def compress_in_passes(input_pdf_path, output_pdf_path, target_size_bytes, plan, engine, progress=None, quality_floor=None):
+    """
+    Passes of `engine` from the planned quality down, then at lower
+    resolutions, until one fits. With a quality_floor (minimum SSIM) passes
+    go on past the target while the output still meets the floor against
+    the original, and the smallest output that did is kept.
+    """
+    progress = progress or ProgressReporter()
+    run_pass = COMPRESSION_PASSES[engine]
+    quality_factor, resolution = plan["quality"], plan["resolution"]
+    reference = PdfReference(input_pdf_path) if quality_floor else None
+    floor_path = f"{output_pdf_path}.floor"
+    accepted = False
+    progress.start("compress", total=GHOSTSCRIPT_MAX_PASSES)
+
+    for _ in range(GHOSTSCRIPT_MAX_PASSES):
+        current_size = run_pass(input_pdf_path, output_pdf_path, quality_factor, resolution)
+        progress.advance()
+        logger.info(f"Compressed size ({engine}) at quality {quality_factor}, {resolution} dpi: {current_size} bytes, Target: {target_size_bytes} bytes")
+
+        if reference is None:
+            if current_size <= target_size_bytes:
                 break
-
-            quality_factor -= 0.1
-
-        with open(output_pdf_path, 'a+') as f:
-            f.flush()
-            os.fsync(f.fileno())
-            
+        elif current_size <= target_size_bytes and reference.meets_floor(output_pdf_path, quality_floor):
+            shutil.copyfile(output_pdf_path, floor_path)
+            accepted = True
+        elif accepted or current_size <= target_size_bytes:
+            # Below the floor: fall back to the last pass above it, or take this one if the target forces it
+            break
+        if quality_factor > MIN_QUALITY:
+            quality_factor = round(max(MIN_QUALITY, quality_factor - 0.1), 2)
+        elif lower_resolution(resolution):
+            resolution = lower_resolution(resolution)
+        else:
+            break
+
+    if accepted:
+        os.replace(floor_path, output_pdf_path)
+    progress.finish("compress")
+    return output_pdf_path
+
+def race_compression(input_pdf_path, output_pdf_path, target_size_bytes, plan, analysis, progress=None, quality_floor=None):
+    """
+    Hedged compression: every lossy engine and a lossless stream rewrite race
+    on the document, and the first under the target is kept.
+    """
+    backends = {
+        engine: functools.partial(
+            compress_in_passes, input_pdf_path,
+            target_size_bytes=target_size_bytes, plan=plan, engine=engine, quality_floor=quality_floor,
+        )
+        for engine in ENGINES
+    }
+    backends["lossless"] = functools.partial(rewrite_pdf_lossless, input_pdf_path)
+    with timed_stage("compression_race"):
+        race(backends, output_pdf_path, target_size_bytes, document_class(analysis), progress)
+    return output_pdf_path
+
+def compress_with_ghostscript(input_pdf_path, output_pdf_path, target_size_bytes, progress=None, engine=None, quality_floor=None):
+    """
+    Compresses along the plan from plan_compression: a copy or one lossless
+    rewrite where image settings can't help, otherwise passes of `engine`
+    (PDF_COMPRESSION_ENGINE by default) from the planned quality down, then
+    at lower resolutions, or a race between all of them for "race". A
+    quality_floor (minimum SSIM) keeps the smallest pass output that still
+    meets it. Raises CompressionImpossible up front for unreachable targets.
+    """
+    progress = progress or ProgressReporter()
+    engine = resolve_engine(engine)
+    try:
+        analysis = analyse_pdf(input_pdf_path)
+        plan = plan_compression(input_pdf_path, target_size_bytes, analysis, engine)
+        # With a quality floor even a PDF under the target is made as small as still looks right
+        if plan["engine"] == "copy" and not quality_floor:
+            shutil.copyfile(input_pdf_path, output_pdf_path)
+            return output_pdf_path
+        if plan["engine"] == "lossless":
+            progress.start("compress", total=1)
+            current_size = rewrite_pdf_lossless(input_pdf_path, output_pdf_path)
+            progress.finish("compress")
+            logger.info(f"Lossless rewrite: {current_size} bytes, Target: {target_size_bytes} bytes")
+            if current_size > target_size_bytes:
+                raise CompressionImpossible(
+                    f"This PDF is mostly text and fonts and can't be compressed below about "
+                    f"{current_size // 1024} KB; the requested {target_size_bytes // 1024} KB isn't reachable."
+                )
+            return output_pdf_path
+
+        if engine == RACE_ENGINE:
+            race_compression(input_pdf_path, output_pdf_path, target_size_bytes, plan, analysis, progress, quality_floor)
+        else:
+            compress_in_passes(input_pdf_path, output_pdf_path, target_size_bytes, plan, engine, progress, quality_floor)
         if os.path.getsize(output_pdf_path) == 0:
             raise ValueError("Compressed PDF is empty")
             
@@ -196,77 +348,343 @@ def compress_with_ghostscript(input_pdf_path, output_pdf_path, target_size_bytes
         logger.error(f"Error in compress_with_ghostscript: {str(e)}")
         raise
 
-@shared_task(bind=True, max_retries=3)
-def convert_and_compress_images_to_pdf(self, image_paths, output_pdf_path, compressed_pdf_path, desired_size_str):
+def compress_pdf_in_session(session, output_pdf_path, target_size_bytes, progress=None, engine=None):
+    """
+    Compresses the session's original to target_size_bytes. A variant from
+    an earlier pass within COMPRESSION_SESSION_TOLERANCE of the target is
+    reused as is; otherwise passes are made from the original at the planned
+    resolution, at qualities interpolated from the measured size curve, each
+    one recorded for the next follow-up.
+    """
+    progress = progress or ProgressReporter()
+    engine = resolve_engine(engine)
+    if session.original_size <= target_size_bytes:
+        shutil.copyfile(session.original, output_pdf_path)
+        return output_pdf_path
+
+    best = session.best_variant(target_size_bytes)
+    if session.close_enough(best, target_size_bytes):
+        logger.info(f"Serving {target_size_bytes} byte target from session variant at quality {best['quality']}, {best['resolution']} dpi")
+        shutil.copyfile(session.point_path(best), output_pdf_path)
+        return output_pdf_path
+
+    analysis = analyse_pdf(session.original)
+    if engine == RACE_ENGINE:
+        # A session refines one engine's size curve pass by pass: use the one that usually wins the race
+        engine = preferred_backend(document_class(analysis), ENGINES)
+    plan = plan_compression(session.original, target_size_bytes, analysis, engine)
+    if plan["engine"] in ("copy", "lossless"):
+        return compress_with_ghostscript(session.original, output_pdf_path, target_size_bytes, progress, engine)
+    run_pass = COMPRESSION_PASSES[engine]
+
+    resolution = plan["resolution"]
+    progress.start("compress", total=GHOSTSCRIPT_MAX_PASSES)
+    for _ in range(GHOSTSCRIPT_MAX_PASSES):
+        quality_factor = session.next_quality(target_size_bytes, resolution, plan["quality"], engine)
+        if quality_factor is None:
+            # Nothing fits even at the lowest quality: trade resolution instead
+            if session.best_variant(target_size_bytes) is None and lower_resolution(resolution):
+                resolution = lower_resolution(resolution)
+                continue
+            break
+        current_size = run_pass(session.original, session.variant_path(quality_factor, resolution, engine), quality_factor, resolution)
+        session.record(quality_factor, resolution, current_size, engine)
+        progress.advance()
+        logger.info(f"Compressed size ({engine}) at quality {quality_factor}, {resolution} dpi: {current_size} bytes, Target: {target_size_bytes} bytes")
+        if current_size <= target_size_bytes and session.close_enough({"size": current_size}, target_size_bytes):
+            break
+    progress.finish("compress")
+
+    # Best quality that fits, or the smallest we could get if nothing does
+    chosen = session.best_variant(target_size_bytes) or session.smallest_variant()
+    if chosen is None:
+        raise ValueError(f"Compression ({engine}) produced no output")
+    shutil.copyfile(session.point_path(chosen), output_pdf_path)
+    return output_pdf_path
+
+def build_pdf_from_images(image_paths, output_path, html_path, progress=None):
+    import pdfkit
+    progress = progress or ProgressReporter()
+    progress.start("render")
+    html_content = "<html><body>"
+    for image_path in image_paths:
+        abs_path = os.path.abspath(image_path)
+        image_url = f"file:///{quote(abs_path.replace(os.sep, '/'))}"
+        html_content += f'<img src="{image_url}" style="max-width: 100%; page-break-after: always;"><br>'
+    html_content += "</body></html>"
+
+    with open(html_path, "w", encoding="utf-8") as html_file:
+        html_file.write(html_content)
+
+    pdfkit.from_file(
+        html_path,
+        output_path,
+        configuration=get_wkhtmltopdf_config(),
+        options={
+            "load-error-handling": "ignore",
+            "enable-local-file-access": None,
+            "quiet": "",
+            "--dpi": "300",
+            "--image-quality": "100",
+        }
+    )
+    progress.finish("render")
+    return output_path
+
+def convert_word_to_pdf(input_path, output_path):
+    if settings.WORD_TO_PDF_ENGINE == 'native':
+        return convert_docx_to_pdf(input_path, output_path)
+    return get_office_pool().convert(input_path, output_path)
+
+def convert_office_to_pdf(input_path, output_path):
+    return get_office_pool().convert(input_path, output_path)
+
+def convert_pdf_to_word(input_path, output_path, progress=None):
+    from pdf2docx import Converter
+    progress = progress or ProgressReporter()
+    cv = Converter(input_path)
+    try:
+        # Reuse the document pdf2docx already parsed instead of opening it again
+        if not verify_pdf_integrity(input_path, level=FULL, document=cv.fitz_doc):
+            raise ValueError(f"Input PDF {input_path} is invalid")
+        # Same steps as Converter.convert, with the page loop unrolled to report per page
+        conversion_settings = cv.default_settings
+        cv.load_pages().parse_document(**conversion_settings)
+        pages = [page for page in cv.pages if not page.skip_parsing]
+        progress.start("parse_pages", total=len(pages))
+        for page in pages:
+            check_cancelled()
+            try:
+                page.parse(**conversion_settings)
+            except Exception as e:
+                if not conversion_settings["ignore_page_error"]:
+                    raise
+                logger.error(f"Ignoring page {page.id + 1} of {input_path}: {str(e)}")
+            progress.advance()
+        progress.start("write_docx")
+        cv.make_docx(output_path, **conversion_settings)
+        progress.finish("write_docx")
+    finally:
+        cv.close()
+    return output_path
+
+# Pages per extracted-text checkpoint in pdf_to_excel / pdf_to_ppt
+PAGE_SHARD_SIZE = 50
+
+def open_verified_pdf(input_path):
+    import fitz
+    doc = fitz.open(input_path)
+    if not verify_pdf_integrity(input_path, level=FULL, document=doc):
+        doc.close()
+        raise ValueError(f"Input PDF {input_path} is invalid")
+    return doc
+
+def count_verified_pages(input_path):
+    with open_verified_pdf(input_path) as doc:
+        return doc.page_count
+
+def extract_page_texts(doc, start=0, end=None, progress=None):
+    progress = progress or ProgressReporter()
+    texts = []
+    for page_number in range(start, doc.page_count if end is None else end):
+        check_cancelled()
+        progress.advance()
+        texts.append(doc[page_number].get_text("text"))
+    return texts
+
+def extract_text_shard(input_path, start, end, shard_path, progress=None):
+    import fitz
+    with fitz.open(input_path) as doc:
+        texts = extract_page_texts(doc, start, end, progress)
+    with open(shard_path, "w", encoding="utf-8") as f:
+        json.dump(texts, f)
+    return shard_path
+
+def extract_text_checkpointed(workspace, input_path, progress):
+    """Extracts page text in PAGE_SHARD_SIZE shards, each one its own checkpoint."""
+    page_count = workspace.stage("verify_input", count_verified_pages, input_path)
+    progress.start("extract_pages", total=page_count)
+    texts = []
+    for start in range(0, page_count, PAGE_SHARD_SIZE):
+        end = min(start + PAGE_SHARD_SIZE, page_count)
+        name = f"pages_{start}_{end}"
+        shard_path = workspace.stage(name, extract_text_shard, input_path, start, end, workspace.path_for(f"{name}.json"), progress)
+        progress.update(end)
+        with open(shard_path, encoding="utf-8") as f:
+            texts.extend(json.load(f))
+    return texts
+
+def write_texts_to_excel(page_texts, output_path, progress=None):
+    import openpyxl
+    progress = progress or ProgressReporter()
+    progress.start("write_xlsx")
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Sheet1"
+
+    row = 1
+    for page_number, text in enumerate(page_texts):
+        if not text.strip():
+            logger.warning(f"Page {page_number} has no extractable text")
+            sheet.cell(row=row, column=1).value = "No text extracted"
+            row += 1
+            continue
+        lines = text.split('\n')
+        for line in lines:
+            sheet.cell(row=row, column=1).value = line
+            row += 1
+
+    if row == 1:
+        logger.warning(f"No text extracted for {output_path}")
+        sheet.cell(row=1, column=1).value = "No text extracted"
+
+    workbook.save(output_path)
+    progress.finish("write_xlsx")
+    return output_path
+
+def write_texts_to_ppt(page_texts, output_path, progress=None):
+    from pptx import Presentation
+    progress = progress or ProgressReporter()
+    progress.start("write_pptx")
+    prs = Presentation()
+
+    for page_number, text in enumerate(page_texts):
+        slide = prs.slides.add_slide(prs.slide_layouts[6])  # Blank slide
+        if not text.strip():
+            logger.warning(f"Page {page_number} has no extractable text")
+            text = "No text extracted"
+        tx_box = slide.shapes.add_textbox(left=0, top=0, width=prs.slide_width, height=prs.slide_height)
+        tf = tx_box.text_frame
+        tf.text = text
+
+    prs.save(output_path)
+    progress.finish("write_pptx")
+    return output_path
+
+def convert_pdf_to_excel(input_path, output_path, progress=None):
+    progress = progress or ProgressReporter()
+    with open_verified_pdf(input_path) as doc:
+        progress.start("extract_pages", total=doc.page_count)
+        texts = extract_page_texts(doc, progress=progress)
+    return write_texts_to_excel(texts, output_path, progress)
+
+def convert_pdf_to_ppt(input_path, output_path, progress=None):
+    progress = progress or ProgressReporter()
+    with open_verified_pdf(input_path) as doc:
+        progress.start("extract_pages", total=doc.page_count)
+        texts = extract_page_texts(doc, progress=progress)
+    return write_texts_to_ppt(texts, output_path, progress)
+
+def compress_pdf_to_size(input_path, output_path, target_size_bytes, progress=None, engine=None, quality_floor=None):
+    """Compresses down to target_size_bytes, or a plain copy if the PDF is already small enough."""
+    if os.path.getsize(input_path) <= target_size_bytes and not quality_floor:
+        shutil.copyfile(input_path, output_path)
+        return output_path
+    return compress_with_ghostscript(input_path, output_path, target_size_bytes, progress, engine, quality_floor)
+
+def verify_output(path):
+    if os.path.getsize(path) == 0:
+        raise ValueError(f"Output file {path} is empty")
+    if path.endswith('.pdf') and not verify_pdf_integrity(path):
+        raise ValueError(f"Generated PDF {path} fails integrity check")
+
+def publish_outputs(workspace, *pairs):
+    """
+    Publishes (scratch, final) pairs as the task's last checkpointed stage.
+    Returns the task's output manifest: an OutputFile per pair, in order,
+    described from the scratch copies while they are still on this node.
+    """
+    def publish():
+        manifest = []
+        for scratch, final in pairs:
+            manifest.append(describe_output(scratch, final))
+            workspace.publish(scratch, final)
+        return manifest
+    return workspace.stage("publish", publish)
+
+def retry_or_cleanup(task, exc, *input_paths):
+    """
+    Retries a failed task, keeping its inputs and scratch checkpoints so the
+    next attempt resumes after the last completed stage. When no retry will
+    follow (retries exhausted, cancelled, out of time) the inputs and the
+    workspace are removed and the error propagates.
+    """
     try:
-        temp_dir = os.path.join(settings.MEDIA_ROOT, "temp")
-        os.makedirs(temp_dir, exist_ok=True)
+        if isinstance(exc, CompressionImpossible):
+            raise exc  # Another attempt would reach the same verdict
+        task.retry(exc=exc, countdown=5)
+    except Retry:
+        raise
+    except BaseException:
+        cleanup_files(*input_paths)
+        discard_workspace(task.request.id)
+        raise
+
+def convert_image(input_path, output_path, format):
+    from PIL import Image
+    with Image.open(input_path) as img:
+        if format.upper() == 'JPEG':
+            img = img.convert('RGB')  # JPEG doesn't support RGBA
+        img.save(output_path, format.upper())
+    return output_path
 
+@shared_task(bind=True, max_retries=3)
+def convert_and_compress_images_to_pdf(self, image_paths, output_pdf_path, compressed_pdf_path, desired_size_str, session_id=None, engine=None):
+    try:
         desired_size_bytes = parse_size_to_bytes(desired_size_str)
         if not desired_size_bytes:
             raise ValueError("Invalid desired size format.")
 
-        resized_image_paths = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count() * 2) as executor:
-            futures = []
-            for i, image_path in enumerate(image_paths):
-                resized_path = os.path.join(temp_dir, f"resized_{i}_{os.path.basename(image_path)}")
-                futures.append(executor.submit(resize_image, image_path, resized_path, {'size': desired_size_str}))
-            resized_image_paths = [future.result() for future in concurrent.futures.as_completed(futures)]
-
-        html_content = "<html><body>"
-        for resized_path in resized_image_paths:
-            abs_path = os.path.abspath(resized_path)
-            image_url = f"file:///{quote(abs_path.replace(os.sep, '/'))}"
-            html_content += f'<img src="{image_url}" style="max-width: 100%; page-break-after: always;"><br>'
-        html_content += "</body></html>"
-
-        temp_html_path = os.path.join(temp_dir, f"temp_{self.request.id}.html")
-        with open(temp_html_path, "w", encoding="utf-8") as html_file:
-            html_file.write(html_content)
-
-        pdfkit.from_file(
-            temp_html_path,
-            output_pdf_path,
-            configuration=config,
-            options={
-                "load-error-handling": "ignore",
-                "enable-local-file-access": None,
-                "quiet": "",
-                "--dpi": "300",
-                "--image-quality": "100",
-            }
-        )
-
-        initial_size = os.path.getsize(output_pdf_path)
-        logger.info(f"Initial PDF size: {initial_size} bytes, Desired size: {desired_size_bytes} bytes")
-        
-        if initial_size > desired_size_bytes:
-            compress_with_ghostscript(output_pdf_path, compressed_pdf_path, desired_size_bytes)
-        else:
-            os.rename(output_pdf_path, compressed_pdf_path)
+        progress = ProgressReporter(self, [("probe", 1), ("encode", 3), ("render", 1), ("compress", 2)])
+        with task_workspace(self, image_paths) as workspace:
+            # Split the target across the images by their cost, then encode each once to its share
+            estimates = workspace.stage(
+                "probe", lambda: list(map_images(estimate_image, image_paths, progress=progress, name="probe")),
+            )
+            shares = allocate_budget(desired_size_bytes, estimates)
+
+            def encode(image_path, index, share):
+                return workspace.stage(
+                    f"encode_{index}", encode_to_budget, image_path, workspace.path_for(f"encoded_{index}.jpg"), share,
+                )
+            encoded_paths = list(map_images(encode, image_paths, range(len(image_paths)), shares, progress=progress, name="encode"))
+
+            progress.start("render", total=len(encoded_paths))
+            scratch_converted = workspace.stage(
+                "render", assemble_pdf, encoded_paths, workspace.path_for(output_pdf_path), progress,
+            )
+            progress.finish("render")
+            # Normally already under the target, so the compress stage below is a copy
+            logger.info(f"Budgeted PDF size: {os.path.getsize(scratch_converted)} bytes, Desired size: {desired_size_bytes} bytes")
+            if session_id:
+                # Seed a compression session so "now 300kb" follow-ups start from this render
+                scratch_compressed = workspace.stage(
+                    "compress", lambda: compress_pdf_in_session(
+                        CompressionSession.open_or_create(session_id, scratch_converted),
+                        workspace.path_for(compressed_pdf_path), desired_size_bytes, progress, engine,
+                    ),
+                )
+            else:
+                scratch_compressed = workspace.stage(
+                    "compress", compress_pdf_to_size,
+                    scratch_converted, workspace.path_for(compressed_pdf_path), desired_size_bytes, progress, engine,
+                )
 
-        for path in [output_pdf_path, compressed_pdf_path]:
-            if os.path.exists(path):
-                with open(path, 'rb+') as f:
-                    f.flush()
-                    os.fsync(f.fileno())
-                if os.path.getsize(path) == 0:
-                    raise ValueError(f"Output file {path} is empty")
-                if path.endswith('.pdf') and not verify_pdf_integrity(path):
-                    raise ValueError(f"Generated PDF {path} fails integrity check")
+            for path in [scratch_converted, scratch_compressed]:
+                verify_output(path)
+            manifest = publish_outputs(workspace, (scratch_converted, output_pdf_path), (scratch_compressed, compressed_pdf_path))
 
-        cleanup_files(temp_html_path, *resized_image_paths, *image_paths)
+        cleanup_files(*image_paths)
 
         return {
             "converted": output_pdf_path,
             "compressed": compressed_pdf_path,
-            "file_size": os.path.getsize(compressed_pdf_path)
+            "file_size": manifest[1]["size"],
+            "manifest": manifest,
         }
     except Exception as e:
         logger.error(f"Error in convert_and_compress_images_to_pdf: {str(e)}")
-        cleanup_files(*image_paths)
-        self.retry(exc=e, countdown=5)
+        retry_or_cleanup(self, e, *image_paths)
 
 @shared_task(bind=True, max_retries=3)
 def convert_parallel_operations(self, first_input_path, second_input_path, first_output_path, second_output_path, first_op, second_op, params=None):
@@ -279,7 +697,7 @@ def convert_parallel_operations(self, first_input_path, second_input_path, first
 
         # Validate input files
         for path in [first_input_path, second_input_path]:
-            if not os.path.exists(path):
+            if not stored_exists(path):
                 logger.error(f"Input file not found: {path}")
                 raise FileNotFoundError(f"Input file not found: {path}")
 
@@ -298,48 +716,48 @@ def convert_parallel_operations(self, first_input_path, second_input_path, first
         if second_op not in operation_mapping:
             raise ValueError(f"Unsupported second operation: {second_op}")
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-            # Submit tasks with appropriate arguments
-            if first_op == "resize_image" or first_op == "resize":
-                future1 = executor.submit(operation_mapping[first_op], first_input_path, first_output_path, params)
+        def run_operation(op, input_path, scratch_path):
+            if op == "resize_image" or op == "resize":
+                operation_mapping[op](input_path, scratch_path, params)
             else:
-                future1 = executor.submit(operation_mapping[first_op], first_input_path, first_output_path)
+                operation_mapping[op](input_path, scratch_path)
+            # convert_to_pdf returns nothing, so checkpoint the path it wrote
+            return scratch_path
 
-            if second_op == "resize_image" or second_op == "resize":
-                future2 = executor.submit(operation_mapping[second_op], second_input_path, second_output_path, params)
-            else:
-                future2 = executor.submit(operation_mapping[second_op], second_input_path, second_output_path)
-
-            # Wait for results
-            first_result = future1.result()
-            second_result = future2.result()
-
-        # Verify outputs
-        for output_path in [first_output_path, second_output_path]:
-            with open(output_path, 'rb+') as f:
-                f.flush()
-                os.fsync(f.fileno())
-            if os.path.getsize(output_path) == 0:
-                raise ValueError(f"Output file {output_path} is empty")
-            if output_path.endswith('.pdf') and not verify_pdf_integrity(output_path):
-                raise ValueError(f"Generated PDF {output_path} fails integrity check")
+        with task_workspace(self, [first_input_path, second_input_path]) as workspace:
+            scratch_first = workspace.path_for(first_output_path)
+            scratch_second = workspace.path_for(second_output_path)
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                future1 = executor.submit(contextvars.copy_context().run, workspace.stage, "first", run_operation, first_op, first_input_path, scratch_first)
+                future2 = executor.submit(contextvars.copy_context().run, workspace.stage, "second", run_operation, second_op, second_input_path, scratch_second)
+
+                # Wait for results
+                future1.result()
+                future2.result()
+
+            # Verify outputs
+            for output_path in [scratch_first, scratch_second]:
+                verify_output(output_path)
+
+            manifest = publish_outputs(workspace, (scratch_first, first_output_path), (scratch_second, second_output_path))
 
         # Clean up input files
         cleanup_files(first_input_path, second_input_path)
 
         # Return result
         return {
-            "first_output": first_result,
-            "second_output": second_result,
-            "first_size": os.path.getsize(first_result),
-            "second_size": os.path.getsize(second_result)
+            "first_output": first_output_path,
+            "second_output": second_output_path,
+            "first_size": manifest[0]["size"],
+            "second_size": manifest[1]["size"],
+            "manifest": manifest,
         }
     except Exception as e:
         logger.error(f"Error in convert_parallel_operations: {str(e)}")
         try:
-            self.retry(exc=e, countdown=5)
+            retry_or_cleanup(self, e, first_input_path, second_input_path)
         except self.MaxRetriesExceededError:
-            cleanup_files(first_input_path, second_input_path)  # Cleanup only after max retries
             return {
                 "first_output": None,
                 "second_output": None,
@@ -347,296 +765,275 @@ def convert_parallel_operations(self, first_input_path, second_input_path, first
                 "second_size": 0,
                 "error": str(e)
            }
-        
+
 @shared_task(bind=True, max_retries=3)
 def images_to_pdf(self, image_paths, output_path):
     try:
-        temp_dir = os.path.join(settings.MEDIA_ROOT, "temp")
-        os.makedirs(temp_dir, exist_ok=True)
-
-        html_content = "<html><body>"
-        for image_path in image_paths:
-            abs_path = os.path.abspath(image_path)
-            image_url = f"file:///{quote(abs_path.replace(os.sep, '/'))}"
-            html_content += f'<img src="{image_url}" style="max-width: 100%; page-break-after: always;"><br>'
-        html_content += "</body></html>"
+        with task_workspace(self, image_paths) as workspace:
+            scratch_output = workspace.stage(
+                "render", build_pdf_from_images,
+                image_paths, workspace.path_for(output_path), workspace.path_for("images.html"), ProgressReporter(self),
+            )
+            verify_output(scratch_output)
+            manifest = publish_outputs(workspace, (scratch_output, output_path))
 
-        temp_html_path = os.path.join(temp_dir, f"temp_{self.request.id}.html")
-        with open(temp_html_path, "w", encoding="utf-8") as html_file:
-            html_file.write(html_content)
-
-        pdfkit.from_file(
-            temp_html_path,
-            output_path,
-            configuration=config,
-            options={
-                "load-error-handling": "ignore",
-                "enable-local-file-access": None,
-                "quiet": "",
-                "--dpi": "300",
-                "--image-quality": "100",
-            }
-        )
-
-        if os.path.getsize(output_path) == 0:
-            raise ValueError(f"Output file {output_path} is empty")
-        if not verify_pdf_integrity(output_path):
-            raise ValueError(f"Generated PDF {output_path} fails integrity check")
-
-        cleanup_files(temp_html_path, *image_paths)
+        cleanup_files(*image_paths)
 
-        return {"output": output_path}
+        return {"output": output_path, "manifest": manifest}
     except Exception as e:
         logger.error(f"Error in images_to_pdf: {str(e)}")
-        cleanup_files(*image_paths)
-        self.retry(exc=e, countdown=5)
+        retry_or_cleanup(self, e, *image_paths)
 
 @shared_task(bind=True, max_retries=3)
-def compress_pdf(self, input_path, output_path, desired_size_str):
+def compress_pdf(self, input_path, output_path, desired_size_str, session_id=None, engine=None, quality_floor=None,
+                 last_output_path=None):
+    """
+    With a session_id, input_path seeds a new compression session, or may be
+    None to re-compress the original of an existing one. The session is only
+    looked up here, on the worker; should it have expired, a new one starts
+    from last_output_path, the previous result. A quality_floor (see
+    perceptual.parse_quality_floor) asks for the smallest output that still
+    meets that SSIM, within the size.
+    """
+    input_paths = [input_path] if input_path else []
     try:
         desired_size_bytes = parse_size_to_bytes(desired_size_str)
         if not desired_size_bytes:
             raise ValueError("Invalid desired size format.")
-
-        compress_with_ghostscript(input_path, output_path, desired_size_bytes)
-
-        if os.path.getsize(output_path) == 0:
-            raise ValueError(f"Output file {output_path} is empty")
-        if not verify_pdf_integrity(output_path):
-            raise ValueError(f"Generated PDF {output_path} fails integrity check")
-
-        cleanup_files(input_path)
-
-        return {"output": output_path}
+        min_ssim = parse_quality_floor(quality_floor)
+
+        with task_workspace(self, input_paths) as workspace:
+            def compress():
+                session = None
+                if session_id:
+                    if input_path is not None:
+                        session = CompressionSession.open_or_create(session_id, input_path)
+                    else:
+                        session = CompressionSession.open(session_id)
+                        if session is None and last_output_path and stored_exists(last_output_path):
+                            session = CompressionSession.open_or_create(session_id, localize(last_output_path))
+                    if session is None:
+                        raise ValueError("The previous PDF has expired; please upload it again.")
+                if session is not None and min_ssim is None:
+                    return compress_pdf_in_session(session, workspace.path_for(output_path), desired_size_bytes, ProgressReporter(self), engine)
+                # A floor search isn't a point on the session's size curve, but it still starts from the original
+                source = session.original if session is not None else input_path
+                return compress_with_ghostscript(
+                    source, workspace.path_for(output_path), desired_size_bytes, ProgressReporter(self), engine, min_ssim,
+                )
+            scratch_output = workspace.stage("compress", compress)
+            verify_output(scratch_output)
+            manifest = publish_outputs(workspace, (scratch_output, output_path))
+
+        cleanup_files(*input_paths)
+
+        return {"output": output_path, "manifest": manifest}
     except Exception as e:
         logger.error(f"Error in compress_pdf: {str(e)}")
-        cleanup_files(input_path)
-        self.retry(exc=e, countdown=5)
+        retry_or_cleanup(self, e, *input_paths)
 
 @shared_task(bind=True, max_retries=3)
 def word_to_pdf(self, input_path, output_path):
     try:
-        convert_docx_to_pdf(input_path, output_path)
-
-        if os.path.getsize(output_path) == 0:
-            raise ValueError(f"Output file {output_path} is empty")
-        if not verify_pdf_integrity(output_path):
-            raise ValueError(f"Generated PDF {output_path} fails integrity check")
+        with task_workspace(self, [input_path]) as workspace:
+            scratch_output = workspace.stage("convert", convert_word_to_pdf, input_path, workspace.path_for(output_path))
+            verify_output(scratch_output)
+            manifest = publish_outputs(workspace, (scratch_output, output_path))
 
         cleanup_files(input_path)
 
-        return {"output": output_path}
+        return {"output": output_path, "manifest": manifest}
     except Exception as e:
         logger.error(f"Error in word_to_pdf: {str(e)}")
-        cleanup_files(input_path)
-        self.retry(exc=e, countdown=5)
+        retry_or_cleanup(self, e, input_path)
 
 @shared_task(bind=True, max_retries=3)
 def pdf_to_word(self, input_path, output_path):
     try:
-        if not verify_pdf_integrity(input_path):
-            raise ValueError(f"Input PDF {input_path} is invalid")
-
-        cv = Converter(input_path)
-        cv.convert(output_path)
-        cv.close()
-
-        if os.path.getsize(output_path) == 0:
-            raise ValueError(f"Output file {output_path} is empty")
+        with task_workspace(self, [input_path]) as workspace:
+            scratch_output = workspace.stage(
+                "convert", convert_pdf_to_word,
+                input_path, workspace.path_for(output_path), ProgressReporter(self, [("parse_pages", 9), ("write_docx", 1)]),
+            )
+            verify_output(scratch_output)
+            manifest = publish_outputs(workspace, (scratch_output, output_path))
 
         cleanup_files(input_path)
 
-        return {"output": output_path}
+        return {"output": output_path, "manifest": manifest}
     except Exception as e:
         logger.error(f"Error in pdf_to_word: {str(e)}")
-        cleanup_files(input_path)
-        self.retry(exc=e, countdown=5)
+        retry_or_cleanup(self, e, input_path)
 
 @shared_task(bind=True, max_retries=3)
 def ppt_to_pdf(self, input_path, output_path):
     try:
-        pythoncom.CoInitializeEx(pythoncom.COINIT_APARTMENTTHREADED)
-        powerpoint = comtypes.client.CreateObject("PowerPoint.Application")
-        powerpoint.Visible = 1
-        presentation = powerpoint.Presentations.Open(os.path.abspath(input_path))
-        presentation.SaveAs(os.path.abspath(output_path), 32)  # 32 = ppSaveAsPDF
-        presentation.Close()
-        powerpoint.Quit()
-
-        if os.path.getsize(output_path) == 0:
-            raise ValueError(f"Output file {output_path} is empty")
-        if not verify_pdf_integrity(output_path):
-            raise ValueError(f"Generated PDF {output_path} fails integrity check")
+        with task_workspace(self, [input_path]) as workspace:
+            scratch_output = workspace.stage("convert", convert_office_to_pdf, input_path, workspace.path_for(output_path))
+            verify_output(scratch_output)
+            manifest = publish_outputs(workspace, (scratch_output, output_path))
 
         cleanup_files(input_path)
 
-        return {"output": output_path}
+        return {"output": output_path, "manifest": manifest}
     except Exception as e:
         logger.error(f"Error in ppt_to_pdf: {str(e)}")
-        cleanup_files(input_path)
-        self.retry(exc=e, countdown=5)
-    finally:
-        try:
-            pythoncom.CoUninitialize()
-        except:
-            logger.warning("CoUninitialize failed, possibly already uninitialized")
+        retry_or_cleanup(self, e, input_path)
 
 @shared_task(bind=True, max_retries=3)
 def excel_to_pdf(self, input_path, output_path):
     try:
-        pythoncom.CoInitializeEx(pythoncom.COINIT_APARTMENTTHREADED)
-        excel = comtypes.client.CreateObject("Excel.Application")
-        excel.Visible = False
-        workbook = excel.Workbooks.Open(os.path.abspath(input_path))
-        workbook.ExportAsFixedFormat(0, os.path.abspath(output_path))  # 0 = xlTypePDF
-        workbook.Close()
-        excel.Quit()
-
-        if os.path.getsize(output_path) == 0:
-            raise ValueError(f"Output file {output_path} is empty")
-        if not verify_pdf_integrity(output_path):
-            raise ValueError(f"Generated PDF {output_path} fails integrity check")
+        with task_workspace(self, [input_path]) as workspace:
+            scratch_output = workspace.stage("convert", convert_office_to_pdf, input_path, workspace.path_for(output_path))
+            verify_output(scratch_output)
+            manifest = publish_outputs(workspace, (scratch_output, output_path))
 
         cleanup_files(input_path)
 
-        return {"output": output_path}
+        return {"output": output_path, "manifest": manifest}
     except Exception as e:
         logger.error(f"Error in excel_to_pdf: {str(e)}")
-        cleanup_files(input_path)
-        self.retry(exc=e, countdown=5)
-    finally:
-        try:
-            pythoncom.CoUninitialize()
-        except:
-            logger.warning("CoUninitialize failed, possibly already uninitialized")
+        retry_or_cleanup(self, e, input_path)
 
 @shared_task(bind=True, max_retries=3)
 def pdf_to_excel(self, input_path, output_path):
     try:
-        if not verify_pdf_integrity(input_path):
-            raise ValueError(f"Input PDF {input_path} is invalid")
-
-        doc = fitz.open(input_path)
-        workbook = openpyxl.Workbook()
-        sheet = workbook.active
-        sheet.title = "Sheet1"
-
-        row = 1
-        for page in doc:
-            text = page.get_text("text")
-            if not text.strip():
-                logger.warning(f"Page {page.number} has no extractable text")
-                sheet.cell(row=row, column=1).value = "No text extracted"
-                row += 1
-                continue
-            lines = text.split('\n')
-            for line in lines:
-                sheet.cell(row=row, column=1).value = line
-                row += 1
-
-        if row == 1:
-            logger.warning(f"No text extracted from {input_path}")
-            sheet.cell(row=1, column=1).value = "No text extracted"
-
-        workbook.save(output_path)
-
-        if os.path.getsize(output_path) == 0:
-            raise ValueError(f"Output file {output_path} is empty")
+        progress = ProgressReporter(self, [("extract_pages", 4), ("write_xlsx", 1)])
+        with task_workspace(self, [input_path]) as workspace:
+            scratch_output = workspace.stage(
+                "write", lambda: write_texts_to_excel(
+                    extract_text_checkpointed(workspace, input_path, progress), workspace.path_for(output_path), progress,
+                ),
+            )
+            verify_output(scratch_output)
+            manifest = publish_outputs(workspace, (scratch_output, output_path))
 
         cleanup_files(input_path)
 
-        return {"output": output_path}
+        return {"output": output_path, "manifest": manifest}
     except Exception as e:
         logger.error(f"Error in pdf_to_excel: {str(e)}")
-        cleanup_files(input_path)
-        self.retry(exc=e, countdown=5)
+        retry_or_cleanup(self, e, input_path)
 
 @shared_task(bind=True, max_retries=3)
 def pdf_to_ppt(self, input_path, output_path):
     try:
-        if not verify_pdf_integrity(input_path):
-            raise ValueError(f"Input PDF {input_path} is invalid")
-
-        doc = fitz.open(input_path)
-        prs = Presentation()
-
-        for page in doc:
-            slide = prs.slides.add_slide(prs.slide_layouts[6])  # Blank slide
-            text = page.get_text("text")
-            if not text.strip():
-                logger.warning(f"Page {page.number} has no extractable text")
-                text = "No text extracted"
-            tx_box = slide.shapes.add_textbox(left=0, top=0, width=prs.slide_width, height=prs.slide_height)
-            tf = tx_box.text_frame
-            tf.text = text
-
-        prs.save(output_path)
-
-        if os.path.getsize(output_path) == 0:
-            raise ValueError(f"Output file {output_path} is empty")
+        progress = ProgressReporter(self, [("extract_pages", 4), ("write_pptx", 1)])
+        with task_workspace(self, [input_path]) as workspace:
+            scratch_output = workspace.stage(
+                "write", lambda: write_texts_to_ppt(
+                    extract_text_checkpointed(workspace, input_path, progress), workspace.path_for(output_path), progress,
+                ),
+            )
+            verify_output(scratch_output)
+            manifest = publish_outputs(workspace, (scratch_output, output_path))
 
         cleanup_files(input_path)
 
-        return {"output": output_path}
+        return {"output": output_path, "manifest": manifest}
     except Exception as e:
         logger.error(f"Error in pdf_to_ppt: {str(e)}")
-        cleanup_files(input_path)
-        self.retry(exc=e, countdown=5)
+        retry_or_cleanup(self, e, input_path)
+
+def as_batch(input_path, output_path):
+    """Input and output paths as equal-length lists, from a single pair or a batch of them."""
+    if isinstance(input_path, (list, tuple)):
+        if len(input_path) != len(output_path):
+            raise ValueError("Every image in a batch needs its own output path.")
+        return list(input_path), list(output_path)
+    return [input_path], [output_path]
+
+def process_image_batch(task, workspace, name, fn, input_paths, output_paths, *args):
+    """
+    Runs fn(input_path, scratch_output_path, *args) over a batch of images with
+    map_images, each image its own checkpointed stage, then publishes the
+    results in batch order. Returns their output manifest.
+    """
+    progress = ProgressReporter(task, [(name, 1)])
+
+    def process(input_path, index, output_path):
+        stage = f"{name}_{index}" if len(input_paths) > 1 else name
+        return workspace.stage(stage, fn, input_path, workspace.path_for(output_path), *args)
+
+    scratch_outputs = list(map_images(
+        process, input_paths, range(len(input_paths)), output_paths, progress=progress, name=name,
+    ))
+    for path in scratch_outputs:
+        verify_output(path)
+    return publish_outputs(workspace, *zip(scratch_outputs, output_paths))
 
 @shared_task(bind=True, max_retries=3)
 def convert_image_format(self, input_path, output_path, format):
+    """input_path and output_path may be lists, to convert a batch of images as one job."""
+    input_paths, output_paths = as_batch(input_path, output_path)
     try:
-        with Image.open(input_path) as img:
-            if format.upper() == 'JPEG':
-                img = img.convert('RGB')  # JPEG doesn't support RGBA
-            img.save(output_path, format.upper())
+        with task_workspace(self, input_paths) as workspace:
+            manifest = process_image_batch(self, workspace, "convert", convert_image, input_paths, output_paths, format)
 
-        if os.path.getsize(output_path) == 0:
-            raise ValueError(f"Output file {output_path} is empty")
-
-        cleanup_files(input_path)
+        cleanup_files(*input_paths)
 
-        return {"output": output_path}
+        if isinstance(input_path, (list, tuple)):
+            return {"outputs": output_paths, "manifest": manifest}
+        return {"output": output_path, "manifest": manifest}
     except Exception as e:
         logger.error(f"Error in convert_image_format: {str(e)}")
-        cleanup_files(input_path)
-        self.retry(exc=e, countdown=5)
+        retry_or_cleanup(self, e, *input_paths)
 
 @shared_task(bind=True, max_retries=3)
 def resize_image_task(self, input_path, output_path, params):
+    """input_path and output_path may be lists, to resize a batch of images as one job."""
+    input_paths, output_paths = as_batch(input_path, output_path)
     try:
-        resize_image(input_path, output_path, params)
-
-        if os.path.getsize(output_path) == 0:
-            raise ValueError(f"Output file {output_path} is empty")
+        with task_workspace(self, input_paths) as workspace:
+            manifest = process_image_batch(self, workspace, "resize", resize_image, input_paths, output_paths, params)
 
-        cleanup_files(input_path)
+        cleanup_files(*input_paths)
 
-        return {"output": output_path}
+        if isinstance(input_path, (list, tuple)):
+            return {"outputs": output_paths, "manifest": manifest}
+        return {"output": output_path, "manifest": manifest}
     except Exception as e:
         logger.error(f"Error in resize_image_task: {str(e)}")
-        cleanup_files(input_path)
-        self.retry(exc=e, countdown=5)
+        retry_or_cleanup(self, e, *input_paths)
+
+@shared_task(bind=True, max_retries=3)
+def run_pipeline(self, input_paths, steps, output_prefix):
+    try:
+        steps = normalize_steps(steps)
+        with task_workspace(self, input_paths) as workspace:
+            sinks = run_steps(steps, input_paths, workspace, ProgressReporter(self, [(step["id"], 1) for step in steps]))
+            scratch_outputs = [path for paths in sinks.values() for path in paths]
+
+            for path in scratch_outputs:
+                verify_output(path)
+
+            # Only the final artifacts leave the scratch workspace
+            pairs = []
+            step_outputs = {}
+            for step_id, paths in sinks.items():
+                for path in paths:
+                    suffix = f"_{len(pairs) + 1}" if len(scratch_outputs) > 1 else ""
+                    pairs.append((path, f"{output_prefix}{suffix}{os.path.splitext(path)[1]}"))
+                    step_outputs.setdefault(step_id, []).append(pairs[-1][1])
+            manifest = publish_outputs(workspace, *pairs)
+            outputs = [final for _, final in pairs]
+
+        cleanup_files(*input_paths)
+
+        return {"outputs": outputs, "step_outputs": step_outputs, "manifest": manifest}
+    except PipelineError as e:
+        logger.error(f"Invalid pipeline: {str(e)}")
+        cleanup_files(*input_paths)
+        discard_workspace(self.request.id)
+        raise
+    except Exception as e:
+        logger.error(f"Error in run_pipeline: {str(e)}")
+        retry_or_cleanup(self, e, *input_paths)
 
 def cleanup_files(*file_paths):
     for file_path in file_paths:
         try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logger.debug(f"Cleaned up file: {file_path}")
+            discard(file_path)
+            logger.debug(f"Cleaned up file: {file_path}")
         except Exception as e:
             logger.error(f"Failed to clean up file {file_path}: {str(e)}")
-
-def verify_pdf_integrity(pdf_path):
-    try:
-        with open(pdf_path, 'rb') as f:
-            header = f.read(10)
-            if not header.startswith(b'%PDF-'):
-                logger.error(f"Invalid PDF header in {pdf_path}: {header}")
-                return False
-            reader = PdfReader(pdf_path)
-            # Allow PDFs with zero pages for edge cases
-            return True
-    except Exception as e:
-        logger.error(f"PDF verification failed for {pdf_path}: {str(e)}")
-        return False
\ No newline at end of file
@@ -1,3 +1,969 @@
-from django.test import TestCase
+import io
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime, timezone
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from .admission import TokenBucket
+from .cancellation import CancellationToken, DeadlineExceeded, cancellation_scope, check_cancelled, run_subprocess
+from .compression_planner import CompressionImpossible, plan_compression
+from .compression_race import race, rank_backends, win_rates
+from .compression_session import CompressionSession, prune_expired
+from .cost_model import estimate_job, fit_model
+from .image_batch import decoded_bytes, map_images
+from .image_budget import PDF_BASE_OVERHEAD, PDF_PAGE_OVERHEAD, allocate_budget
+from .import_profile import profile_import
+from .integrity import FULL, verify_pdf_integrity
+from .llm import STUB_REPLY, StubClient, parse_latency
+from .loadtest import percentile
+from .manifest import describe_output, response_files
+from .office_pool import OfficeConversionError, OfficeConverterPool
+from .pdf_recompress import recompress_image
+from .perceptual import luma, meets_floor, parse_quality_floor, smallest_encode, ssim
+from .pipeline import PipelineError, normalize_steps, run_steps
+from .progress import ProgressReporter
+from .singleflight import claim, job_fingerprint, release
+from .storage import MemoryStorage, S3Storage, discard, get_storage, localize, spool
+from .task_registry import attach, is_owner, record_owner
+from .workspace import ScratchWorkspace, task_workspace
+from .zip_stream import ZIP_DEFLATED, ZIP_STORED, ZipStream, parse_range
 
-# Create your tests here.
+
+class ImportFootprintTests(SimpleTestCase):
+    """Guards the web tier against pulling conversion libraries in at import time."""
+
+    def test_views_do_not_import_conversion_libraries(self):
+        profile = profile_import("operation.views")
+        self.assertEqual(profile["heavy_modules"], [], f"operation.views imported {profile['heavy_modules']}")
+
+    def test_tasks_module_defers_conversion_libraries(self):
+        profile = profile_import("operation.tasks")
+        self.assertEqual(profile["heavy_modules"], [], f"operation.tasks imported {profile['heavy_modules']}")
+
+
+class FakeOfficeInstance:
+    """Stands in for a soffice process; a hung instance blocks until released."""
+
+    def __init__(self, index, pipe_name):
+        self.index = index
+        self.jobs = 0
+        self.needs_restart = False
+        self.healthy = True
+        self.hang = None
+        self.restarts = 0
+        self.stops = 0
+
+    def is_healthy(self):
+        return self.healthy
+
+    def convert(self, input_path, output_path, filter_name):
+        if self.hang is not None:
+            self.hang.wait()
+            raise RuntimeError("bridge disposed")
+        self.jobs += 1
+
+    def stop(self):
+        self.stops += 1
+
+    def restart(self):
+        self.restarts += 1
+        self.jobs = 0
+        self.needs_restart = False
+        self.healthy = True
+
+
+@override_settings(OFFICE_POOL_ACQUIRE_TIMEOUT=1)
+@mock.patch("operation.office_pool.OfficeInstance", FakeOfficeInstance)
+class OfficePoolTests(SimpleTestCase):
+
+    def hang(self, instance):
+        instance.hang = threading.Event()
+        self.addCleanup(instance.hang.set)
+
+    def test_hung_job_stops_and_replaces_instance(self):
+        pool = OfficeConverterPool(size=1, max_jobs=10, job_timeout=0.2)
+        instance = pool._instances[0]
+        self.hang(instance)
+        with self.assertRaises(OfficeConversionError):
+            pool.convert("a.docx", "a.pdf")
+        self.assertEqual(instance.stops, 1)
+        self.assertTrue(instance.needs_restart)
+
+        # The abandoned call never unwinds, yet the only slot serves the next job
+        instance.hang = None
+        pool.convert("b.docx", "b.pdf")
+        self.assertEqual((instance.restarts, instance.jobs), (1, 1))
+
+    def test_unhealthy_instance_is_restarted_on_acquire(self):
+        pool = OfficeConverterPool(size=1, max_jobs=10, job_timeout=5)
+        instance = pool._instances[0]
+        pool.convert("a.docx", "a.pdf")
+        instance.healthy = False
+        pool.convert("b.docx", "b.pdf")
+        self.assertEqual((instance.restarts, instance.jobs), (1, 1))
+
+    def test_instance_is_recycled_after_max_jobs(self):
+        pool = OfficeConverterPool(size=1, max_jobs=2, job_timeout=5)
+        instance = pool._instances[0]
+        for name in ("a", "b"):
+            pool.convert(f"{name}.docx", f"{name}.pdf")
+        self.assertEqual(instance.restarts, 0)
+        pool.convert("c.docx", "c.pdf")
+        self.assertEqual((instance.restarts, instance.jobs), (1, 1))
+
+
+class DocxRenderTests(SimpleTestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir, ignore_errors=True)
+
+    def _render(self, build):
+        import fitz
+        from docx import Document
+        from .docx_render import DocxPdfRenderer
+        document = Document()
+        build(document)
+        docx_path = os.path.join(self.work_dir, "input.docx")
+        document.save(docx_path)
+        pdf_path = DocxPdfRenderer(docx_path, os.path.join(self.work_dir, "output.pdf")).render()
+        with fitz.open(pdf_path) as doc:
+            return [page.get_text() for page in doc], [len(page.get_images()) for page in doc]
+
+    def test_paragraphs_table_and_image(self):
+        from docx.shared import Inches
+        from PIL import Image
+        image = io.BytesIO()
+        Image.new("RGB", (60, 40), (200, 60, 40)).save(image, "PNG")
+
+        def build(document):
+            document.add_heading("Quarterly report", level=1)
+            document.add_paragraph("Revenue grew in every region.")
+            table = document.add_table(rows=2, cols=2)
+            for row, values in zip(table.rows, (("Region", "Total"), ("North", "42"))):
+                for cell, value in zip(row.cells, values):
+                    cell.text = value
+            image.seek(0)
+            document.add_picture(image, width=Inches(1))
+
+        texts, images = self._render(build)
+        self.assertEqual(len(texts), 1)
+        for expected in ("Quarterly report", "Revenue grew in every region.", "Region", "North", "42"):
+            self.assertIn(expected, texts[0])
+        self.assertEqual(images, [1])
+
+    def test_document_larger_than_one_chunk_flows_across_pages(self):
+        from .docx_render import CHUNK_HTML_CHARS
+        lines = [f"Paragraph {i} of the long document." for i in range(CHUNK_HTML_CHARS // 20)]
+
+        def build(document):
+            for line in lines:
+                document.add_paragraph(line)
+
+        texts, _ = self._render(build)
+        self.assertGreater(len(texts), 1)
+        text = "".join(texts)
+        self.assertEqual([line for line in lines if line not in text], [])
+
+
+class ProgressReporterTests(SimpleTestCase):
+
+    def test_percent_weights_stages_and_counts_items(self):
+        progress = ProgressReporter(plan=[("resize", 1), ("compress", 3)])
+        progress.start("resize", total=4)
+        progress.advance(2)
+        self.assertEqual(progress.snapshot()["percent"], 12.5)
+        progress.finish()
+        progress.start("compress", total=3)
+        progress.advance()
+        snapshot = progress.snapshot()
+        self.assertEqual(snapshot["percent"], 50.0)
+        self.assertEqual((snapshot["stage"], snapshot["current"], snapshot["total"]), ("compress", 1, 3))
+        self.assertIsNotNone(snapshot["eta_seconds"])
+
+    def test_no_eta_before_any_progress(self):
+        progress = ProgressReporter()
+        progress.start("render")
+        self.assertIsNone(progress.snapshot()["eta_seconds"])
+
+
+class CancellationTests(SimpleTestCase):
+
+    def test_check_raises_once_deadline_passes(self):
+        CancellationToken(deadline=time.time() + 60).check()
+        with self.assertRaises(DeadlineExceeded):
+            CancellationToken(deadline=time.time() - 1).check()
+
+    def test_subprocess_is_killed_at_deadline(self):
+        started = time.monotonic()
+        with cancellation_scope(CancellationToken(deadline=time.time() + 0.5)):
+            with self.assertRaises(DeadlineExceeded):
+                run_subprocess([sys.executable, "-c", "import time; time.sleep(30)"])
+        self.assertLess(time.monotonic() - started, 5)
+
+
+class ScratchWorkspaceTests(SimpleTestCase):
+
+    def setUp(self):
+        self.tmpfs_dir = tempfile.mkdtemp()
+        self.scratch_dir = tempfile.mkdtemp()
+        for path in (self.tmpfs_dir, self.scratch_dir):
+            self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        scratch_settings = override_settings(
+            SCRATCH_TMPFS_DIR=self.tmpfs_dir, SCRATCH_DIR=self.scratch_dir,
+            SCRATCH_TMPFS_BUDGET=3000, SCRATCH_FOOTPRINT_FACTOR=3,
+        )
+        scratch_settings.enable()
+        self.addCleanup(scratch_settings.disable)
+
+    def _free(self, free):
+        return mock.patch("operation.workspace.shutil.disk_usage", return_value=mock.Mock(free=free))
+
+    def test_small_job_is_placed_on_tmpfs(self):
+        with self._free(10 ** 9):
+            workspace = ScratchWorkspace("small", expected_bytes=1000)
+        self.assertTrue(workspace.on_tmpfs)
+        self.assertEqual(os.path.dirname(workspace.path), self.tmpfs_dir)
+
+    def test_job_over_budget_or_free_space_goes_to_disk(self):
+        with self._free(10 ** 9):
+            over_budget = ScratchWorkspace("large", expected_bytes=1001)
+        with self._free(2999):
+            tmpfs_full = ScratchWorkspace("full", expected_bytes=1000)
+        for workspace in (over_budget, tmpfs_full):
+            self.assertFalse(workspace.on_tmpfs)
+            self.assertEqual(os.path.dirname(workspace.path), self.scratch_dir)
+
+    def test_failure_keeps_workspace_only_while_retries_remain(self):
+        task = mock.Mock(max_retries=1)
+        task.request.id = "flaky"
+        for retries, kept in ((0, True), (1, False)):
+            task.request.retries = retries
+            with self._free(10 ** 9), self.assertRaises(RuntimeError):
+                with task_workspace(task) as workspace:
+                    raise RuntimeError("boom")
+            self.assertTrue(workspace.on_tmpfs)
+            self.assertEqual(os.path.isdir(workspace.path), kept)
+
+
+class CheckpointTests(SimpleTestCase):
+
+    def setUp(self):
+        self.scratch_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.scratch_dir, ignore_errors=True)
+
+    def test_retry_resumes_after_completed_stage(self):
+        calls = []
+
+        def write(name):
+            calls.append(name)
+            path = workspace.path_for(name)
+            with open(path, "w") as f:
+                f.write(name)
+            return path
+
+        with override_settings(SCRATCH_TMPFS_DIR=None, SCRATCH_DIR=self.scratch_dir):
+            workspace = ScratchWorkspace("retry")
+            first = workspace.stage("first", write, "a.txt")
+            # A later attempt of the same task finds the recorded stage
+            workspace = ScratchWorkspace("retry")
+            self.assertEqual(workspace.stage("first", write, "a.txt"), first)
+            self.assertEqual(calls, ["a.txt"])
+
+            os.remove(first)
+            workspace = ScratchWorkspace("retry")
+            workspace.stage("first", write, "a.txt")
+            self.assertEqual(calls, ["a.txt", "a.txt"])
+
+
+class LoadTestTests(SimpleTestCase):
+
+    def test_percentile_uses_nearest_rank(self):
+        values = list(range(1, 11))
+        self.assertEqual([percentile(values, pct) for pct in (0, 7, 10, 50, 90, 99, 100)], [1, 1, 1, 5, 9, 10, 10])
+        self.assertEqual(percentile(list(range(1, 101)), 7), 7)
+        self.assertEqual(percentile([3.5], 99), 3.5)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_latency_specs(self):
+        self.assertEqual(parse_latency("fixed:200")(), 0.2)
+        uniform = parse_latency("uniform:100,400")
+        self.assertTrue(all(0.1 <= uniform() <= 0.4 for _ in range(200)))
+        random.seed(7)
+        lognormal = parse_latency("lognormal:300,0.5")
+        self.assertAlmostEqual(statistics.median(lognormal() for _ in range(2001)), 0.3, delta=0.03)
+        with self.assertRaises(ValueError):
+            parse_latency("normal:300")
+
+    def test_stub_client_answers_intents_and_streams_reply(self):
+        client = StubClient("fixed:0", "fixed:0")
+        prompt = 'The user provided the following message: "compress this to 2MB"\nUploaded files: a.pdf (Type: application/pdf, Size: 1 KB)'
+        intent = json.loads(client.generate_content(prompt).text)
+        self.assertEqual((intent["operation"], intent["params"]), ("compress_pdf", {"size": "2mb"}))
+        chunks = client.start_chat().send_message("hello", stream=True)
+        self.assertEqual(" ".join(chunk.text for chunk in chunks), STUB_REPLY)
+
+
+class PipelineTests(SimpleTestCase):
+
+    def setUp(self):
+        self.scratch_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.scratch_dir, ignore_errors=True)
+        scratch_settings = override_settings(SCRATCH_TMPFS_DIR=None, SCRATCH_DIR=self.scratch_dir)
+        scratch_settings.enable()
+        self.addCleanup(scratch_settings.disable)
+        self.upload = os.path.join(self.scratch_dir, "upload.docx")
+        with open(self.upload, "w") as f:
+            f.write("in")
+        self.calls = []
+        self.failing = set()
+        patcher = mock.patch("operation.pipeline._map_function", side_effect=self._fake_stage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _fake_stage(self, operation):
+        def run(src, dst, params):
+            self.calls.append(params["tag"])
+            if params["tag"] in self.failing:
+                self.failing.discard(params["tag"])
+                raise RuntimeError("worker lost")
+            with open(src) as f:
+                content = f.read()
+            with open(dst, "w") as f:
+                f.write(f"{content}>{params['tag']}")
+            return dst
+        return run
+
+    def _run(self, steps):
+        return run_steps(normalize_steps(steps), [self.upload], ScratchWorkspace("pipeline"))
+
+    @staticmethod
+    def _read(paths):
+        contents = []
+        for path in paths:
+            with open(path) as f:
+                contents.append(f.read())
+        return contents
+
+    def test_linear_chain_drops_intermediates(self):
+        sinks = self._run([
+            {"operation": "word_to_pdf", "params": {"tag": "pdf"}},
+            {"operation": "compress_pdf", "params": {"tag": "small"}},
+        ])
+        self.assertEqual(list(sinks), ["step2"])
+        self.assertEqual(self._read(sinks["step2"]), ["in>pdf>small"])
+        self.assertEqual([name for name in os.listdir(ScratchWorkspace("pipeline").path) if name.startswith("step1")], [])
+        self.assertTrue(os.path.exists(self.upload))
+
+    def test_branches_share_an_input_until_its_last_reader(self):
+        sinks = self._run([
+            {"id": "pdf", "operation": "word_to_pdf", "params": {"tag": "pdf"}},
+            {"id": "small", "operation": "compress_pdf", "params": {"tag": "small"}, "inputs": ["pdf"]},
+            {"id": "slides", "operation": "pdf_to_ppt", "params": {"tag": "slides"}, "inputs": ["pdf"]},
+            {"id": "direct", "operation": "word_to_pdf", "params": {"tag": "direct"}, "inputs": ["input"]},
+        ])
+        self.assertEqual(sorted(self.calls), ["direct", "pdf", "slides", "small"])
+        self.assertEqual(
+            self._read(sinks["small"] + sinks["slides"] + sinks["direct"]),
+            ["in>pdf>small", "in>pdf>slides", "in>direct"],
+        )
+        self.assertFalse(os.path.exists(ScratchWorkspace("pipeline").path_for("pdf_0.pdf")))
+        # Uploads are the task's to clean up, never the pipeline's
+        self.assertTrue(os.path.exists(self.upload))
+
+    def test_retry_resumes_after_checkpointed_step(self):
+        steps = [
+            {"operation": "word_to_pdf", "params": {"tag": "pdf"}},
+            {"operation": "compress_pdf", "params": {"tag": "small"}},
+        ]
+        self.failing.add("small")
+        with self.assertRaises(RuntimeError):
+            self._run(steps)
+        self.assertIsNotNone(ScratchWorkspace("pipeline").restore("step_step1"))
+
+        sinks = self._run(steps)
+        self.assertEqual(self.calls, ["pdf", "small", "small"])
+        self.assertEqual(self._read(sinks["step2"]), ["in>pdf>small"])
+
+    def test_unknown_compression_engine_is_rejected(self):
+        normalize_steps([{"operation": "compress_pdf", "params": {"engine": "images"}}])
+        with self.assertRaises(PipelineError):
+            normalize_steps([{"operation": "compress_pdf", "params": {"engine": "zopfli"}}])
+
+
+@override_settings(CACHES={"shared": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class TokenBucketTests(SimpleTestCase):
+
+    def test_cost_is_taken_and_refilled(self):
+        bucket = TokenBucket(capacity=10, rate=1000)
+        self.assertEqual(bucket.take("client", 8), (True, 0.0))
+        admitted, wait = TokenBucket(capacity=10, rate=0.001).take("client", 8)
+        self.assertFalse(admitted)
+        self.assertGreater(wait, 0)
+
+    def test_clients_have_separate_buckets(self):
+        bucket = TokenBucket(capacity=5, rate=0.001)
+        self.assertTrue(bucket.take("a", 5)[0])
+        self.assertFalse(bucket.take("a", 5)[0])
+        self.assertTrue(bucket.take("b", 5)[0])
+
+
+class BenchmarkComparisonTests(SimpleTestCase):
+
+    def test_failed_and_missing_cases_are_regressions(self):
+        from .benchmarks import compare_reports
+        case = {"wall_s": 1.0, "cpu_s": 1.0, "peak_rss_bytes": 100, "output_bytes": 100}
+        baseline = {"results": {"steady": case, "broken": case, "dropped": case, "still_broken": {"error": "OSError: x"}}}
+        current = {"results": {
+            "steady": dict(case, wall_s=1.05),
+            "broken": {"error": "RuntimeError: boom"},
+            "still_broken": {"error": "OSError: x"},
+        }}
+        rows = compare_reports(baseline, current)
+        regressed = {(name, metric, after) for name, metric, _, after, _, regressed in rows if regressed}
+        self.assertEqual(regressed, {
+            ("broken", "error", "RuntimeError: boom"),
+            ("dropped", "error", "missing from current report"),
+            ("still_broken", "error", "OSError: x"),
+        })
+        self.assertEqual(len([row for row in rows if row[0] == "steady"]), 4)
+
+
+class CostModelTests(SimpleTestCase):
+
+    def test_fit_recovers_linear_cost(self):
+        results = {
+            f"pdf_to_word/{pages}p": {"cpu_s": 0.5 + 0.2 * pages, "peak_rss_bytes": 1e8 + 1e6 * pages, "work_units": pages}
+            for pages in (1, 10, 100)
+        }
+        results["pdf_to_excel/1p"] = {"error": "RuntimeError: boom"}
+        fitted = fit_model([{"results": results}])
+        self.assertEqual(list(fitted), ["pdf_to_word"])
+        intercept, slope = fitted["pdf_to_word"]["cpu_s"]
+        self.assertAlmostEqual(intercept, 0.5)
+        self.assertAlmostEqual(slope, 0.2)
+
+    @mock.patch("operation.cost_model._predict", return_value=(120.0, 0))
+    def test_heavy_queue_is_opt_in(self, _):
+        with override_settings(COST_HEAVY_QUEUE=None):
+            self.assertIsNone(estimate_job("compress_pdf", [])["queue"])
+        with override_settings(COST_HEAVY_QUEUE="heavy", COST_HEAVY_CPU_SECONDS=30):
+            self.assertEqual(estimate_job("compress_pdf", [])["queue"], "heavy")
+
+
+class IntegrityTests(SimpleTestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir, ignore_errors=True)
+
+    def _pdf(self, name, tamper):
+        import fitz
+        with fitz.open() as doc:
+            doc.new_page()
+            data = tamper(doc.tobytes())
+        path = os.path.join(self.work_dir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_full_level_accepts_pdfs_mupdf_repairs(self):
+        import fitz
+        padded = self._pdf("padded.pdf", lambda data: data + b"\0" * 4096)
+        shifted = self._pdf("shifted.pdf", lambda data: re.sub(
+            rb"startxref\s+(\d+)", lambda m: b"startxref\n%d" % (int(m.group(1)) + 3), data))
+        for path in (padded, shifted):
+            self.assertTrue(verify_pdf_integrity(path, level=FULL))
+            with fitz.open(path) as doc:
+                self.assertTrue(verify_pdf_integrity(path, level=FULL, document=doc))
+        # Our own outputs still get the byte-level check
+        self.assertFalse(verify_pdf_integrity(padded))
+
+
+@override_settings(CACHES={"shared": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class SingleflightTests(SimpleTestCase):
+
+    def test_fingerprint_ignores_param_spelling(self):
+        self.assertEqual(
+            job_fingerprint("compress_pdf", ["abc"], {"size": "1MB"}),
+            job_fingerprint("compress_pdf", ["abc"], {"size": " 1mb"}),
+        )
+        self.assertNotEqual(
+            job_fingerprint("compress_pdf", ["abc"], {"size": "1MB"}),
+            job_fingerprint("compress_pdf", ["abd"], {"size": "1MB"}),
+        )
+
+    def test_fingerprint_is_per_requester(self):
+        self.assertNotEqual(
+            job_fingerprint("compress_pdf", ["abc"], {"size": "1MB"}, owner="user:1"),
+            job_fingerprint("compress_pdf", ["abc"], {"size": "1MB"}, owner="user:2"),
+        )
+
+    @mock.patch("operation.singleflight.AsyncResult")
+    def test_duplicate_attaches_until_released(self, async_result):
+        async_result.return_value.failed.return_value = False
+        fingerprint = job_fingerprint("pdf_to_word", ["abc"], owner="user:1")
+        self.assertEqual(claim(fingerprint, "first")["task_id"], "first")
+        self.assertEqual(claim(fingerprint, "second")["task_id"], "first")
+        release(fingerprint, "first")
+        self.assertEqual(claim(fingerprint, "third")["task_id"], "third")
+        # A failed owner is taken over rather than attached to
+        async_result.return_value.failed.return_value = True
+        self.assertEqual(claim(fingerprint, "fourth")["task_id"], "fourth")
+        release(fingerprint, "fourth")
+
+
+@override_settings(CACHES={"shared": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class TaskOwnershipTests(SimpleTestCase):
+
+    def test_only_the_submitter_owns_a_task(self):
+        record_owner("task", "user:1")
+        self.assertTrue(is_owner("task", "user:1", alone=True))
+        self.assertFalse(is_owner("task", "user:2"))
+        self.assertFalse(is_owner("unknown", "user:1"))
+        # Once a duplicate waits on it too, a disconnect shouldn't cancel it
+        attach("task")
+        self.assertTrue(is_owner("task", "user:1"))
+        self.assertFalse(is_owner("task", "user:1", alone=True))
+
+
+class CompressionSessionTests(SimpleTestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.addCleanup(MemoryStorage.clear)
+        storage_settings = override_settings(
+            STORAGE_BACKEND="memory", MEDIA_ROOT=self.media_root,
+            COMPRESSION_SESSION_DIR=os.path.join(self.media_root, "compression_sessions"),
+        )
+        storage_settings.enable()
+        self.addCleanup(storage_settings.disable)
+        original = os.path.join(self.media_root, "upload.pdf")
+        with open(original, "wb") as f:
+            f.write(b"%PDF" + b"0" * 1_000_000)
+        self.session = CompressionSession.open_or_create("doc", original)
+
+    def compress(self, target):
+        """Runs the session search against a synthetic size curve; returns (passes, chosen point)."""
+        passes = 0
+        while True:
+            quality = self.session.next_quality(target, 72)
+            if quality is None or passes == 9:
+                break
+            size = int(1_000_000 * (0.08 + 0.5 * quality ** 2))
+            with open(self.session.variant_path(quality, 72), "wb") as f:
+                f.write(b"%PDF")
+            self.session.record(quality, 72, size)
+            passes += 1
+            if size <= target and self.session.close_enough({"size": size}, target):
+                break
+        return passes, self.session.best_variant(target)
+
+    @override_settings(COMPRESSION_SESSION_TOLERANCE=0.15, COMPRESSION_SESSION_MIN_STEP=0.02)
+    def test_follow_up_targets_reuse_the_curve(self):
+        first_passes, first = self.compress(300_000)
+        self.assertLessEqual(first["size"], 300_000)
+        follow_up_passes, follow_up = self.compress(200_000)
+        self.assertLessEqual(follow_up["size"], 200_000)
+        self.assertLess(follow_up_passes, first_passes)
+        # A target between two measured points close to one of them needs no pass at all
+        self.assertTrue(self.session.close_enough(self.session.best_variant(first["size"] + 1000), first["size"] + 1000))
+
+    def test_follow_up_runs_on_a_worker_without_the_files(self):
+        with open(self.session.variant_path(0.5, 72), "wb") as f:
+            f.write(b"%PDF-variant")
+        self.session.record(0.5, 72, 300_000)
+        shutil.rmtree(self.session.path)
+        session = CompressionSession.open("doc")
+        self.assertEqual(session.points, self.session.points)
+        self.assertEqual(os.path.getsize(session.original), 1_000_004)
+        with open(session.point_path(session.best_variant(300_000)), "rb") as f:
+            self.assertEqual(f.read(), b"%PDF-variant")
+
+    def test_expired_sessions_are_removed_from_storage(self):
+        with override_settings(COMPRESSION_SESSION_TTL=-1):
+            prune_expired()
+        self.assertIsNone(CompressionSession.open("doc"))
+        self.assertFalse(os.path.exists(self.session.path))
+
+
+class CompressionPlannerTests(SimpleTestCase):
+
+    def analysis(self, **overrides):
+        # Ten pages, each a 300 dpi colour scan stored in about 1.9 MB
+        scan = {"pixels": 8.7e6, "dpi": 300, "components": 3, "bytes": 1_950_000}
+        analysis = {
+            "file_size": 20_000_000, "pages": 10, "image_count": 10, "image_pixels": 87e6,
+            "image_bytes": 19_500_000, "max_image_dpi": 300, "font_bytes": 0,
+            "uncompressed_bytes": 0, "images": [scan] * 10, "scale": 1,
+        }
+        analysis.update(overrides)
+        return analysis
+
+    def test_scans_start_at_a_fitting_resolution(self):
+        loose = plan_compression("scan.pdf", 5_000_000, self.analysis())
+        tight = plan_compression("scan.pdf", 1_000_000, self.analysis())
+        self.assertEqual(loose["engine"], "ghostscript")
+        self.assertLess(tight["resolution"], loose["resolution"])
+
+    def test_text_documents_are_rewritten_losslessly(self):
+        text = self.analysis(file_size=2_000_000, image_count=0, image_pixels=0, image_bytes=0,
+                             max_image_dpi=0, font_bytes=300_000, uncompressed_bytes=1_000_000, images=[])
+        self.assertEqual(plan_compression("text.pdf", 1_500_000, text)["engine"], "lossless")
+        with self.assertRaises(CompressionImpossible):
+            plan_compression("text.pdf", 500_000, text)
+
+    def test_unreachable_targets_fail_before_any_pass(self):
+        with self.assertRaises(CompressionImpossible):
+            plan_compression("scan.pdf", 100_000, self.analysis())
+        self.assertEqual(plan_compression("scan.pdf", 30_000_000, self.analysis())["engine"], "copy")
+
+
+class ImageRecompressionTests(SimpleTestCase):
+
+    def test_images_are_downsampled_to_jpeg(self):
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.new("RGB", (400, 300), (200, 60, 40)).save(buffer, "PNG")
+        with Image.open(io.BytesIO(recompress_image(buffer.getvalue(), 3, 0.5, 0.6))) as image:
+            self.assertEqual(image.format, "JPEG")
+            self.assertEqual(image.size, (200, 150))
+            self.assertEqual(image.mode, "RGB")
+
+
+@override_settings(
+    CACHES={"shared": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    COMPRESSION_RACE_CPU_BUDGET=3, COMPRESSION_RACE_MIN_RUNS=5, COMPRESSION_RACE_MIN_WIN_RATE=0.1, COMPRESSION_RACE_EXPLORE=0,
+)
+class CompressionRaceTests(SimpleTestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir, ignore_errors=True)
+
+    def backend(self, size, seconds):
+        def compress(output_path):
+            started = time.monotonic()
+            while time.monotonic() - started < seconds:
+                check_cancelled()
+                time.sleep(0.01)
+            with open(output_path, "wb") as f:
+                f.write(b"0" * size)
+        return compress
+
+    def test_first_fitting_result_wins_and_losers_drop_out(self):
+        output = os.path.join(self.work_dir, "out.pdf")
+        started = time.monotonic()
+        for _ in range(5):
+            winner = race({"slow": self.backend(500, 5), "fast": self.backend(800, 0.05), "big": self.backend(5000, 0)},
+                          output, 1000, "scanned")
+            self.assertEqual(winner, "fast")
+        # The slow backend was cancelled every time rather than waited for
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(os.path.getsize(output), 800)
+        self.assertEqual(os.listdir(self.work_dir), ["out.pdf"])
+        self.assertEqual(rank_backends("scanned", ["slow", "fast", "big"]), ["fast"])
+
+    @override_settings(COMPRESSION_RACE_CPU_BUDGET=1)
+    def test_only_backends_that_ran_are_counted(self):
+        output = os.path.join(self.work_dir, "out.pdf")
+        for _ in range(3):
+            self.assertEqual(race({"fast": self.backend(800, 0.05), "queued": self.backend(500, 0)}, output, 1000, "text"), "fast")
+        # With one slot, "queued" waited behind the winner every time and never ran
+        self.assertEqual(win_rates("text", ["fast", "queued"]), {"fast": (3, 3), "queued": (0, 0)})
+
+
+class ImageBudgetTests(SimpleTestCase):
+
+    def test_budget_is_split_by_cost_and_capped_at_full_quality(self):
+        estimates = [
+            {"pixels": 12e6, "reference_bytes": 3_000_000, "max_bytes": 6_000_000},
+            {"pixels": 4e6, "reference_bytes": 1_000_000, "max_bytes": 2_000_000},
+            {"pixels": 1e6, "reference_bytes": 100_000, "max_bytes": 120_000},
+        ]
+        target = 5_000_000
+        shares = allocate_budget(target, estimates)
+        self.assertLessEqual(sum(shares), target - PDF_BASE_OVERHEAD - 3 * PDF_PAGE_OVERHEAD)
+        self.assertAlmostEqual(shares[0] / shares[1], 3, places=2)
+        # The flat image can't use its proportional share, so the others get the rest
+        self.assertEqual(shares[2], 120_000)
+
+    def test_too_many_images_for_the_target_fail_fast(self):
+        estimates = [{"pixels": 1e6, "reference_bytes": 200_000, "max_bytes": 400_000}] * 50
+        with self.assertRaises(CompressionImpossible):
+            allocate_budget(100_000, estimates)
+
+
+class PerceptualTests(SimpleTestCase):
+
+    def setUp(self):
+        from PIL import Image, ImageDraw
+        self.image = Image.linear_gradient("L").convert("RGB").resize((320, 240))
+        draw = ImageDraw.Draw(self.image)
+        for x in range(0, 320, 16):
+            draw.line((x, 0, 320 - x, 240), fill=(200, 40, 40), width=2)
+
+    def test_ssim_is_one_for_identical_planes_and_drops_with_noise(self):
+        import numpy as np
+        plane = luma(self.image)
+        noisy = np.clip(plane + np.random.default_rng(0).normal(0, 25, plane.shape), 0, 255)
+        self.assertAlmostEqual(ssim(plane, plane), 1.0, places=6)
+        self.assertLess(ssim(plane, noisy), 0.9)
+
+    def test_smallest_encode_meets_the_floor(self):
+        from PIL import Image
+        quality, data = smallest_encode(self.image, "JPEG", 0.97)
+        reference = luma(self.image)
+        with Image.open(io.BytesIO(data)) as decoded:
+            self.assertTrue(meets_floor(reference, luma(decoded, (reference.shape[1], reference.shape[0])), 0.97))
+        self.assertLess(quality, 95)
+
+    @override_settings(PERCEPTUAL_MIN_SSIM=0.97)
+    def test_quality_floor_param(self):
+        self.assertIsNone(parse_quality_floor(None))
+        self.assertEqual(parse_quality_floor("true"), 0.97)
+        self.assertEqual(parse_quality_floor("0.95"), 0.95)
+        with self.assertRaises(ValueError):
+            parse_quality_floor(1.5)
+
+
+class ImageBatchTests(SimpleTestCase):
+
+    def setUp(self):
+        from PIL import Image
+        self.work_dir = tempfile.mkdtemp()
+        self.paths = []
+        for i in range(6):
+            path = os.path.join(self.work_dir, f"{i}.png")
+            Image.new("RGB", (100, 100)).save(path)
+            self.paths.append(path)
+        self.running = 0
+        self.peak = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def process(self, path, delay):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        time.sleep(delay)
+        self.running -= 1
+        return os.path.basename(path)
+
+    @override_settings(IMAGE_BATCH_WORKERS=4, IMAGE_BATCH_MEMORY_BUDGET=10**9)
+    def test_results_come_back_in_submission_order(self):
+        # Later images finish first
+        delays = [0.05 * (6 - i) for i in range(6)]
+        self.assertEqual(list(map_images(self.process, self.paths, delays)), [f"{i}.png" for i in range(6)])
+
+    def test_decoded_images_in_flight_stay_within_the_budget(self):
+        with override_settings(IMAGE_BATCH_WORKERS=4, IMAGE_BATCH_MEMORY_BUDGET=2 * decoded_bytes(self.paths[0])):
+            list(map_images(self.process, self.paths, [0.05] * 6))
+        self.assertEqual(self.peak, 2)
+
+
+@override_settings(
+    CACHES={"shared": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    STORAGE_BACKEND="memory",
+)
+class ZipStreamTests(SimpleTestCase):
+
+    def setUp(self):
+        self.members = []
+        for name, data in (("report.pdf", os.urandom(200_000)), ("scan.bmp", b"BM" + b"\x00" * 300_000)):
+            with get_storage().writer(f"processed/{name}") as f:
+                f.write(data)
+            self.members.append((name, f"processed/{name}"))
+
+    def tearDown(self):
+        MemoryStorage.clear()
+
+    def test_archive_is_valid_and_only_deflates_uncompressed_formats(self):
+        archive = ZipStream(self.members)
+        data = b"".join(archive.iter_bytes())
+        self.assertEqual(len(data), archive.size)
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual([info.compress_type for info in zf.infolist()], [ZIP_STORED, ZIP_DEFLATED])
+
+    def test_any_range_matches_the_full_archive(self):
+        archive = ZipStream(self.members)
+        data = b"".join(archive.iter_bytes())
+        for start, end in ((0, 9), (100, 250_000), (200_050, archive.size - 1)):
+            self.assertEqual(b"".join(ZipStream(self.members).iter_bytes(start, end)), data[start:end + 1])
+        self.assertEqual(parse_range("bytes=-10", archive.size), (archive.size - 10, archive.size - 1))
+        with self.assertRaises(ValueError):
+            parse_range(f"bytes={archive.size}-", archive.size)
+
+
+class StorageTests(SimpleTestCase):
+    """The same contract for every backend that runs without a network."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        MemoryStorage.clear()
+
+    def test_backends_write_whole_objects_and_read_ranges(self):
+        for backend in ("local", "memory"):
+            with self.subTest(backend=backend), override_settings(STORAGE_BACKEND=backend, MEDIA_ROOT=self.media_root):
+                storage = get_storage()
+                data = os.urandom(3 * 1024 * 1024 + 17)
+                with self.assertRaises(RuntimeError):
+                    with storage.writer("processed/failed.bin") as f:
+                        f.write(data)
+                        raise RuntimeError("interrupted")
+                self.assertFalse(storage.exists("processed/failed.bin"))
+
+                with storage.writer("processed/out.bin") as f:
+                    f.write(data)
+                self.assertEqual(storage.size("processed/out.bin"), len(data))
+                self.assertEqual(b"".join(storage.read_range("processed/out.bin")), data)
+                self.assertEqual(b"".join(storage.read_range("processed/out.bin", 1000, 2_000_000)), data[1000:2_000_001])
+                storage.delete("processed/out.bin")
+                self.assertFalse(storage.exists("processed/out.bin"))
+
+    def test_uploads_reach_workers_through_storage(self):
+        with override_settings(STORAGE_BACKEND="memory", MEDIA_ROOT=self.media_root):
+            path = os.path.join(self.media_root, "temp", "scan.pdf")
+            with spool(path) as f:
+                f.write(b"%PDF-1.7")
+            os.remove(path)  # A worker on another node has no local copy
+            with open(localize(path), "rb") as f:
+                self.assertEqual(f.read(), b"%PDF-1.7")
+            discard(path)
+            self.assertFalse(os.path.exists(path))
+            self.assertFalse(get_storage().exists("temp/scan.pdf"))
+
+
+class FakeS3Client:
+    """The slice of the boto3 S3 client S3Storage calls, over a dict of keys."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.calls = []
+
+    def put_object(self, Bucket, Key, Body):
+        self.calls.append("put_object")
+        self.objects[Key] = (bytes(Body), datetime.now(timezone.utc))
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = f"upload{len(self.uploads) + 1}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.calls.append(f"upload_part {len(Body)}")
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": f"etag{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.calls.append("complete_multipart_upload")
+        numbers = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+        self.objects[Key] = (b"".join(parts[n] for n in numbers), datetime.now(timezone.utc))
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append("abort_multipart_upload")
+        del self.uploads[UploadId]
+
+    def get_object(self, Bucket, Key, Range=None):
+        data = self.objects[Key][0]
+        if Range:
+            start, _, end = Range[len("bytes="):].partition("-")
+            data = data[int(start):int(end) + 1 if end else None]
+        body = mock.Mock()
+        body.iter_chunks.side_effect = lambda size: (data[i:i + size] for i in range(0, len(data), size))
+        return {"Body": body}
+
+    def get_paginator(self, operation):
+        paginator = mock.Mock()
+        # One key per page, so listing has to follow the pages
+        paginator.paginate.side_effect = lambda Bucket, Prefix: (
+            {"Contents": [{"Key": key, "LastModified": modified}]}
+            for key, (_, modified) in sorted(self.objects.items()) if key.startswith(Prefix)
+        )
+        return paginator
+
+
+@override_settings(STORAGE_PREFIX="media/", STORAGE_MULTIPART_CHUNK_SIZE=4)
+class S3StorageTests(SimpleTestCase):
+
+    def setUp(self):
+        self.client = FakeS3Client()
+        self.storage = S3Storage.__new__(S3Storage)
+        self.storage.client = self.client
+        self.storage.bucket = "bucket"
+
+    def test_large_writes_are_multipart_uploads(self):
+        with self.storage.writer("processed/out.bin") as f:
+            f.write(b"abcdef")
+            f.write(b"ghij")
+        self.assertEqual(self.client.calls, ["upload_part 4", "upload_part 4", "upload_part 2", "complete_multipart_upload"])
+        self.assertEqual(self.client.objects["media/processed/out.bin"][0], b"abcdefghij")
+
+        with self.storage.writer("processed/small.bin") as f:
+            f.write(b"abc")
+        self.assertEqual(self.client.calls[-1], "put_object")
+
+    def test_failed_write_aborts_the_upload(self):
+        with self.assertRaises(RuntimeError):
+            with self.storage.writer("processed/out.bin") as f:
+                f.write(b"abcdefgh")
+                raise RuntimeError("interrupted")
+        self.assertEqual(self.client.calls[-1], "abort_multipart_upload")
+        self.assertEqual((self.client.objects, self.client.uploads), ({}, {}))
+
+    def test_read_range_and_list(self):
+        with self.storage.writer("sessions/a/manifest.json") as f:
+            f.write(b"0123456789")
+        with self.storage.writer("sessions/b/manifest.json") as f:
+            f.write(b"")
+        with self.storage.writer("temp/other.pdf") as f:
+            f.write(b"%PDF")
+        self.assertEqual(b"".join(self.storage.read_range("sessions/a/manifest.json")), b"0123456789")
+        self.assertEqual(b"".join(self.storage.read_range("sessions/a/manifest.json", 2, 5)), b"2345")
+        self.assertEqual(b"".join(self.storage.read_range("sessions/a/manifest.json", 7)), b"789")
+        self.assertEqual(b"".join(self.storage.read_range("sessions/b/manifest.json")), b"")
+        self.assertEqual(
+            [name for name, _ in self.storage.list("sessions/")],
+            ["sessions/a/manifest.json", "sessions/b/manifest.json"],
+        )
+
+
+class OutputManifestTests(SimpleTestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_outputs_are_described_from_the_scratch_copy(self):
+        from PIL import Image
+        scratch = os.path.join(self.work_dir, "scratch.png")
+        Image.new("RGB", (20, 10)).save(scratch)
+        with override_settings(MEDIA_ROOT=self.work_dir):
+            output = describe_output(scratch, os.path.join(self.work_dir, "processed", "resized_1.png"))
+        self.assertEqual(output["name"], "resized_1.png")
+        self.assertEqual(output["key"], "processed/resized_1.png")
+        self.assertEqual(output["size"], os.path.getsize(scratch))
+        self.assertEqual((output["type"], output["pages"], output["previewable"]), ("image/png", 1, True))
+        self.assertEqual(len(output["sha256"]), 64)
+
+        files = response_files([output])
+        self.assertEqual(files[0]["url"], "/api/download/resized_1.png")
+        self.assertEqual(files[0]["size"], output["size"])
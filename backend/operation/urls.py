@@ -10,8 +10,10 @@ urlpatterns = [
     path('check-auth/', views.check_auth, name="check-auth"),
     path("logout/", views.user_logout, name="logout"),
     path('task-status/<str:task_id>/', views.task_status, name="task-status"),
+    path('cancel-task/<str:task_id>/', views.cancel_task, name="cancel-task"),
     path('chat-history/', views.get_chat_history, name="chat-history"),
     path('chat/<str:chat_id>/', views.get_chat, name="get_chat"),
+    path('chat/<str:chat_id>/download/', views.download_chat_zip, name="download-chat-zip"),
     path('save-chat/', views.save_chat, name="save-chat"),
     path('rename-chat/', views.rename_chat, name="rename-chat"),
     path('delete-chat/<str:chat_id>/', views.delete_chat, name="delete-chat"),
@@ -1,5 +1,5 @@
-import google.generativeai as genai
 from django.conf import settings
+from .llm import get_llm_client
 import json
 import logging
 import re
@@ -8,12 +8,12 @@ logger = logging.getLogger(__name__)
 
 def parse_intent(user_message, file_metadata, conversation_history):
     """
-    Use Gemini AI to parse the user's intent and map it to a document operation or conversation.
+    Use the configured LLM (Gemini by default) to parse the user's intent and map it to a document operation or conversation.
     If Gemini fails to classify as document_operation, use a regex fallback to detect operation patterns.
     Returns a dict with intent, operation, params, and description.
     """
     try:
-        model = genai.GenerativeModel('gemini-2.0-flash-lite')
+        model = get_llm_client()
         
         # Prepare context
         file_context = "\n".join([f"File: {meta['name']} (Type: {meta['type']}, Size: {meta['size']} bytes)" for meta in file_metadata])
@@ -42,10 +42,12 @@ Supported operations:
 - pdf_to_ppt: Convert PDF to PowerPoint (PPTX).
 - convert_image_format: Convert image to another format (e.g., JPG to PNG).
 - resize_image: Resize image to a size (e.g., "1MB"), resolution (e.g., "800x600"), or aspect ratio (e.g., "4:3").
+- pipeline: Chain several of the operations above on the same files in one job (e.g., "convert this Word file to PDF and compress it to 1MB"). params has "steps", a list of {{"operation": str, "params": dict}}; each step works on the previous step's output.
 
 Instructions:
 - Match the user's message and file types to the appropriate operation.
 - Extract parameters like size, format, or resolution from the message.
+- Use "pipeline" only when the request chains operations that no single operation above covers.
 - If the message references a previous operation (e.g., "re-compress the last PDF"), set "use_last_compressed": true.
 - Return a JSON string with no extra text or markdown (e.g., avoid ```json).
 - If no files are uploaded or the intent is unclear, default to "conversation".
@@ -86,6 +88,15 @@ Output: {{
     "description": "convert a Word document to PDF"
 }}
 
+User: "Convert my Word doc to PDF and compress it to 1MB"
+Files: application/vnd.openxmlformats-officedocument.wordprocessingml.document
+Output: {{
+    "intent": "document_operation",
+    "operation": "pipeline",
+    "params": {{"steps": [{{"operation": "word_to_pdf", "params": {{}}}}, {{"operation": "compress_pdf", "params": {{"size": "1MB"}}}}]}},
+    "description": "convert a Word document to PDF and compress it to 1MB"
+}}
+
 User: "Re-compress the last PDF to 300kb"
 Files: none
 Output: {{
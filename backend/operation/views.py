@@ -1,52 +1,56 @@
 import os
 import json
 import base64
+import hashlib
 import time
 from threading import Thread
 import uuid
 import mimetypes
 from urllib.parse import unquote
 import logging
-import requests
-from io import BytesIO
 from celery.result import AsyncResult
-from django.http import JsonResponse, FileResponse, StreamingHttpResponse, HttpResponseRedirect
+from celery.exceptions import TimeoutError as TaskWaitTimeout
+from django.http import JsonResponse, FileResponse, StreamingHttpResponse, HttpResponseRedirect, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from asgiref.sync import sync_to_async
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.conf import settings
-from django.core.cache import cache
+from django.core.cache import cache, caches
 from dotenv import load_dotenv
-import google.generativeai as genai
-from .tasks import (
-    convert_and_compress_images_to_pdf,
-    convert_parallel_operations,
-    images_to_pdf,
-    compress_pdf,
-    word_to_pdf,
-    pdf_to_word,
-    ppt_to_pdf,
-    excel_to_pdf,
-    pdf_to_excel,
-    pdf_to_ppt,
-    convert_image_format,
-    resize_image_task,
-)
+from .task_registry import enqueue, cancel, record_owner, attach, is_owner
+from .singleflight import job_fingerprint, claim, release
+from .compression_planner import CompressionImpossible, ENGINES, RACE_ENGINE
+from .perceptual import parse_quality_floor
+from .cancellation import TaskCancelled
 from .utils import parse_intent
+from .llm import get_llm_client
+from .instrumentation import instrumented, timed_stage, current_timer, render_metrics
+from .pipeline import normalize_steps, PipelineError
+from .progress import task_progress
+from .admission import admission_controlled
+from .cost_model import estimate_job, rejection_reason
+from .manifest import response_files
+from .storage import discard, get_storage, spool, storage_name, stored_exists
+from .zip_stream import ZipStream, parse_range
 from .models import ChatSession, Message, File
 from django.contrib.auth.decorators import login_required
 from allauth.socialaccount.models import SocialAccount  # Add this import
 
 # Load environment variables
 load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-2.0-flash-lite')
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+def _requester(request):
+    """Who is asking: the user when logged in, otherwise the browser session."""
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    if request.session.session_key is None:
+        request.session.save()
+    return f"session:{request.session.session_key}"
+
 def api_overview(request):
     return JsonResponse({"message": "Django Backend is Connected!"})
 
@@ -284,9 +288,7 @@ def delete_chat(request, chat_id):
             chat = ChatSession.objects.get(id=chat_id, user=request.user)
             for message in chat.messages.all():
                 for file in message.files.all():
-                    file_path = os.path.join(settings.PROCESSED_DIR, file.name)
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
+                    discard(os.path.join(settings.PROCESSED_DIR, file.name))
             chat.delete()
             return JsonResponse({"message": "Chat deleted successfully"}, status=200)
         except ChatSession.DoesNotExist:
@@ -296,6 +298,8 @@ def delete_chat(request, chat_id):
             return JsonResponse({"error": str(e)}, status=500)
 
 @csrf_exempt
+@admission_controlled
+@instrumented
 def send_message(request):
     if request.method == "POST":
         try:
@@ -314,54 +318,78 @@ def send_message(request):
             print(f"🔹 User Message: {user_message}")
             print(f"🔹 Received {len(files)} files")
 
+            # A client may pick the id up front so it can poll task_status/stream_response
+            # for progress while this request is still waiting on the worker. The id
+            # names the chat, the task and its outputs, so it has to be new.
+            task_id = str(uuid.uuid4())
+            requested_id = request.POST.get("task_id") or request.headers.get("X-Task-Id")
+            if requested_id:
+                try:
+                    task_id = str(uuid.UUID(requested_id))
+                except ValueError:
+                    return JsonResponse({"error": "task_id must be a UUID."}, status=400)
+                if ChatSession.objects.filter(id=task_id).exists() or AsyncResult(task_id).state != "PENDING":
+                    return JsonResponse({"error": "task_id is already in use."}, status=409)
+            if not record_owner(task_id, _requester(request)):
+                return JsonResponse({"error": "task_id is already in use."}, status=409)
+
             # Initialize conversation history
             conversation_history = request.session.get("conversation_history", [])
             if len(conversation_history) > 10:
                 conversation_history = conversation_history[-10:]
 
-            # Save uploaded files
+            # Hash uploaded files before saving any, so a duplicate of a job still in
+            # flight is spotted without writing over the inputs that job is reading
             saved_file_paths = []
             file_metadata = []
-            for file in files:
-                file_path = os.path.join(settings.TEMP_DIR, file.name)
-                logger.debug(f"Saving file to: {file_path}")
-                print(f"🔹 Saving file to {file_path}")
-
-                with open(file_path, "wb+") as destination:
+            content_hashes = []
+            with timed_stage("upload_hash"):
+                for file in files:
+                    digest = hashlib.sha256()
                     for chunk in file.chunks():
-                        destination.write(chunk)
-                saved_file_paths.append(file_path)
-                file_metadata.append({
-                    "name": file.name,
-                    "type": file.content_type,
-                    "size": file.size
-                })
+                        digest.update(chunk)
+                    saved_file_paths.append(os.path.join(settings.TEMP_DIR, file.name))
+                    content_hashes.append(digest.hexdigest())
+                    file_metadata.append({
+                        "name": file.name,
+                        "type": file.content_type,
+                        "size": file.size
+                    })
 
-            # Create or get chat session
-            task_id = str(uuid.uuid4())
+            def save_uploads():
+                with timed_stage("upload_spool"):
+                    for file, file_path in zip(files, saved_file_paths):
+                        logger.debug(f"Saving file to: {file_path}")
+                        with spool(file_path) as destination:
+                            for chunk in file.chunks():
+                                destination.write(chunk)
+
+            # Create chat session
             if request.user.is_authenticated:
-                chat_session, created = ChatSession.objects.get_or_create(
-                    id=task_id,
-                    user=request.user,
-                    defaults={"title": user_message[:50] or "Untitled Chat"}
-                )
+                with timed_stage("db_insert"):
+                    chat_session = ChatSession.objects.create(
+                        id=task_id,
+                        user=request.user,
+                        title=user_message[:50] or "Untitled Chat",
+                    )
 
-                # Save user message and files
-                user_msg = Message.objects.create(
-                    chat_session=chat_session,
-                    text=user_message,
-                    sender="user",
-                )
-                for file in file_metadata:
-                    File.objects.create(
-                        message=user_msg,
-                        name=file["name"],
-                        type=file["type"],
-                        size=file["size"],
+                    # Save user message and files
+                    user_msg = Message.objects.create(
+                        chat_session=chat_session,
+                        text=user_message,
+                        sender="user",
                     )
+                    for file in file_metadata:
+                        File.objects.create(
+                            message=user_msg,
+                            name=file["name"],
+                            type=file["type"],
+                            size=file["size"],
+                        )
 
             # Use AI to parse intent
-            intent_data = parse_intent(user_message, file_metadata, conversation_history)
+            with timed_stage("parse_intent"):
+                intent_data = parse_intent(user_message, file_metadata, conversation_history)
             logger.debug(f"Intent data: {intent_data}")
 
             # Handle document operation if intent is detected
@@ -384,118 +412,204 @@ def send_message(request):
                 supported_operations = [
                     "convert_and_compress_images_to_pdf", "convert_parallel_operations", "images_to_pdf",
                     "compress_pdf", "word_to_pdf", "pdf_to_word", "ppt_to_pdf", "excel_to_pdf",
-                    "pdf_to_excel", "pdf_to_ppt", "convert_image_format", "resize_image"
+                    "pdf_to_excel", "pdf_to_ppt", "convert_image_format", "resize_image", "pipeline"
                 ]
                 if operation not in supported_operations:
                     logger.error(f"Invalid operation requested: {operation}")
                     return JsonResponse({"error": f"Unsupported operation: {operation}"}, status=400)
-
-                if operation == "convert_and_compress_images_to_pdf":
-                    desired_size = params.get("size", "1MB")
-                    output_pdf_path = os.path.join(processed_dir, f"converted_{task_id}.pdf")
-                    compressed_pdf_path = os.path.join(processed_dir, f"compressed_{task_id}.pdf")
-                    task = convert_and_compress_images_to_pdf.delay(file_paths, output_pdf_path, compressed_pdf_path, desired_size)
-                    request.session['last_compressed_pdf'] = compressed_pdf_path
-                    output_paths = [output_pdf_path, compressed_pdf_path]
-
-                elif operation == "convert_parallel_operations":
-                    if len(file_paths) != 2:
-                        return JsonResponse({"error": "Please upload exactly 2 files for parallel operations."}, status=400)
-                    first_op = params.get("first_op", "convert_to_pdf")
-                    second_op = params.get("second_op", "resize")
-                    first_output = os.path.join(processed_dir, f"{task_id}_first_output.pdf" if first_op == "convert_to_pdf" 
-                                          else f"{task_id}_first_output_resized.{os.path.splitext(file_paths[0])[1][1:]}")
-                    second_output = os.path.join(processed_dir, f"{task_id}_second_output.pdf" if second_op == "convert_to_pdf" 
-                                           else f"{task_id}_second_output_resized.{os.path.splitext(file_paths[1])[1][1:]}")
-                    task = convert_parallel_operations.delay(
-                        file_paths[0], file_paths[1],
-                        first_output, second_output,
-                        first_op, second_op, params
-                    )
-                    output_paths = [first_output, second_output]
-
-                elif operation == "images_to_pdf":
-                    if not file_paths:
-                        return JsonResponse({"error": "Please upload at least one image file."}, status=400)
-                    output_path = os.path.join(processed_dir, f"images_to_pdf_{task_id}.pdf")
-                    task = images_to_pdf.delay(file_paths, output_path)
-                    output_paths = [output_path]
-
-                elif operation == "compress_pdf":
-                    desired_size = params.get("size", "1MB")
-                    if params.get("use_last_compressed", False):
-                        last_compressed = request.session.get('last_compressed_pdf')
-                        if not last_compressed or not os.path.exists(last_compressed):
-                            return JsonResponse({"error": "No previous compressed PDF found."}, status=400)
-                        input_path = last_compressed
+                # Only validated names become metric labels, never raw model output
+                current_timer().operation = operation
+
+                # Compression engine, for the operations that compress
+                engine = params.get("engine")
+                if engine is not None and engine not in (*ENGINES, RACE_ENGINE):
+                    return JsonResponse({"error": f"Unknown compression engine: {engine}. Choose one of {', '.join((*ENGINES, RACE_ENGINE))}."}, status=400)
+                quality_floor = params.get("quality_floor")
+                try:
+                    parse_quality_floor(quality_floor)
+                except ValueError:
+                    return JsonResponse({"error": f"Invalid quality_floor: {quality_floor}. Use true, or an SSIM between 0 and 1."}, status=400)
+
+                # A job identical to one this requester still has in flight (double
+                # submit, client retry) attaches to that task instead of redoing the work
+                fingerprint = None
+                coalesced = False
+                if content_hashes and not params.get("use_last_compressed"):
+                    fingerprint = job_fingerprint(operation, content_hashes, params, owner=_requester(request))
+                    owner = claim(fingerprint, task_id)
+                    coalesced = owner["task_id"] != task_id
+                    if coalesced:
+                        task_id = owner["task_id"]
+                        attach(task_id)
+
+                def submit(operation, *args, **options):
+                    if coalesced:
+                        return AsyncResult(task_id)
+                    return enqueue(operation, *args, queue=estimate["queue"], **options)
+
+                try:
+                    if coalesced:
+                        # The task already has these same bytes as its inputs; nothing is saved
+                        estimate = caches["shared"].get(f"task_estimate_{task_id}")
                     else:
+                        save_uploads()
+                        # Price the job from file headers before it takes a worker slot
+                        with timed_stage("cost_estimate"):
+                            estimate = estimate_job(operation, file_paths, params)
+                        rejection = rejection_reason(estimate)
+                        if rejection:
+                            logger.warning(f"Rejecting {operation}: {rejection}")
+                            for path in file_paths:
+                                discard(path)
+                            return JsonResponse({"error": rejection, "estimate": estimate}, status=413)
+                        caches["shared"].set(f"task_estimate_{task_id}", estimate, timeout=settings.TASK_DEADLINE_SECONDS)
+
+                    if operation == "convert_and_compress_images_to_pdf":
+                        desired_size = params.get("size", "1MB")
+                        output_pdf_path = os.path.join(processed_dir, f"converted_{task_id}.pdf")
+                        compressed_pdf_path = os.path.join(processed_dir, f"compressed_{task_id}.pdf")
+                        # The compression session is named after the task, so coalesced duplicates share it
+                        task = submit("convert_and_compress_images_to_pdf", file_paths, output_pdf_path, compressed_pdf_path, desired_size, task_id, engine,
+                                      task_id=task_id)
+                        request.session['last_compressed_pdf'] = compressed_pdf_path
+                        request.session['compression_session'] = task_id
+                        output_paths = [output_pdf_path, compressed_pdf_path]
+
+                    elif operation == "convert_parallel_operations":
+                        if len(file_paths) != 2:
+                            return JsonResponse({"error": "Please upload exactly 2 files for parallel operations."}, status=400)
+                        first_op = params.get("first_op", "convert_to_pdf")
+                        second_op = params.get("second_op", "resize")
+                        first_output = os.path.join(processed_dir, f"{task_id}_first_output.pdf" if first_op == "convert_to_pdf" 
+                                              else f"{task_id}_first_output_resized.{os.path.splitext(file_paths[0])[1][1:]}")
+                        second_output = os.path.join(processed_dir, f"{task_id}_second_output.pdf" if second_op == "convert_to_pdf" 
+                                               else f"{task_id}_second_output_resized.{os.path.splitext(file_paths[1])[1][1:]}")
+                        task = submit(
+                            "convert_parallel_operations",
+                            file_paths[0], file_paths[1],
+                            first_output, second_output,
+                            first_op, second_op, params,
+                            task_id=task_id
+                        )
+                        output_paths = [first_output, second_output]
+
+                    elif operation == "images_to_pdf":
+                        if not file_paths:
+                            return JsonResponse({"error": "Please upload at least one image file."}, status=400)
+                        output_path = os.path.join(processed_dir, f"images_to_pdf_{task_id}.pdf")
+                        task = submit("images_to_pdf", file_paths, output_path, task_id=task_id)
+                        output_paths = [output_path]
+
+                    elif operation == "compress_pdf":
+                        desired_size = params.get("size", "1MB")
+                        session_id = task_id
+                        last_compressed = None
+                        if params.get("use_last_compressed", False):
+                            # Follow-ups re-compress the session's original rather than the last output.
+                            # The worker opens the session; the last output is its fallback.
+                            last_compressed = request.session.get('last_compressed_pdf')
+                            if request.session.get('compression_session'):
+                                session_id = request.session['compression_session']
+                            elif not last_compressed or not stored_exists(last_compressed):
+                                return JsonResponse({"error": "No previous compressed PDF found."}, status=400)
+                            input_path = None
+                        else:
+                            if len(file_paths) != 1 or not file_paths[0].lower().endswith('.pdf'):
+                                return JsonResponse({"error": "Please upload exactly one PDF file."}, status=400)
+                            input_path = file_paths[0]
+                        output_path = os.path.join(processed_dir, f"compressed_{task_id}.pdf")
+                        task = submit("compress_pdf", input_path, output_path, desired_size, session_id, engine, quality_floor, last_compressed, task_id=task_id)
+                        request.session['last_compressed_pdf'] = output_path
+                        request.session['compression_session'] = session_id
+                        output_paths = [output_path]
+
+                    elif operation == "word_to_pdf":
+                        if len(file_paths) != 1 or not file_paths[0].lower().endswith('.docx'):
+                            return JsonResponse({"error": "Please upload exactly one DOCX file."}, status=400)
+                        output_path = os.path.join(processed_dir, f"word_to_pdf_{task_id}.pdf")
+                        task = submit("word_to_pdf", file_paths[0], output_path, task_id=task_id)
+                        output_paths = [output_path]
+
+                    elif operation == "pdf_to_word":
                         if len(file_paths) != 1 or not file_paths[0].lower().endswith('.pdf'):
                             return JsonResponse({"error": "Please upload exactly one PDF file."}, status=400)
-                        input_path = file_paths[0]
-                    output_path = os.path.join(processed_dir, f"compressed_{task_id}.pdf")
-                    task = compress_pdf.delay(input_path, output_path, desired_size)
-                    request.session['last_compressed_pdf'] = output_path
-                    output_paths = [output_path]
-
-                elif operation == "word_to_pdf":
-                    if len(file_paths) != 1 or not file_paths[0].lower().endswith('.docx'):
-                        return JsonResponse({"error": "Please upload exactly one DOCX file."}, status=400)
-                    output_path = os.path.join(processed_dir, f"word_to_pdf_{task_id}.pdf")
-                    task = word_to_pdf.delay(file_paths[0], output_path)
-                    output_paths = [output_path]
-
-                elif operation == "pdf_to_word":
-                    if len(file_paths) != 1 or not file_paths[0].lower().endswith('.pdf'):
-                        return JsonResponse({"error": "Please upload exactly one PDF file."}, status=400)
-                    output_path = os.path.join(processed_dir, f"pdf_to_word_{task_id}.docx")
-                    task = pdf_to_word.delay(file_paths[0], output_path)
-                    output_paths = [output_path]
-
-                elif operation == "ppt_to_pdf":
-                    if len(file_paths) != 1 or not file_paths[0].lower().endswith(('.ppt', '.pptx')):
-                        return JsonResponse({"error": "Please upload exactly one PPT or PPTX file."}, status=400)
-                    output_path = os.path.join(processed_dir, f"ppt_to_pdf_{task_id}.pdf")
-                    task = ppt_to_pdf.delay(file_paths[0], output_path)
-                    output_paths = [output_path]
-
-                elif operation == "excel_to_pdf":
-                    if len(file_paths) != 1 or not file_paths[0].lower().endswith(('.xls', '.xlsx')):
-                        return JsonResponse({"error": "Please upload exactly one XLS or XLSX file."}, status=400)
-                    output_path = os.path.join(processed_dir, f"excel_to_pdf_{task_id}.pdf")
-                    task = excel_to_pdf.delay(file_paths[0], output_path)
-                    output_paths = [output_path]
-
-                elif operation == "pdf_to_excel":
-                    if len(file_paths) != 1 or not file_paths[0].lower().endswith('.pdf'):
-                        return JsonResponse({"error": "Please upload exactly one PDF file."}, status=400)
-                    output_path = os.path.join(processed_dir, f"pdf_to_excel_{task_id}.xlsx")
-                    task = pdf_to_excel.delay(file_paths[0], output_path)
-                    output_paths = [output_path]
-
-                elif operation == "pdf_to_ppt":
-                    if len(file_paths) != 1 or not file_paths[0].lower().endswith('.pdf'):
-                        return JsonResponse({"error": "Please upload exactly one PDF file."}, status=400)
-                    output_path = os.path.join(processed_dir, f"pdf_to_ppt_{task_id}.pptx")
-                    task = pdf_to_ppt.delay(file_paths[0], output_path)
-                    output_paths = [output_path]
-
-                elif operation == "convert_image_format":
-                    if len(file_paths) != 1 or not file_paths[0].lower().endswith(('.png', '.jpeg', '.jpg', '.bmp', '.gif')):
-                        return JsonResponse({"error": "Please upload exactly one image file (PNG, JPEG, JPG, BMP, or GIF)."}, status=400)
-                    format = params.get("format", "JPEG").upper()
-                    if format not in ['PNG', 'JPEG', 'JPG', 'BMP', 'GIF']:
-                        return JsonResponse({"error": f"Unsupported image format: {format}"}, status=400)
-                    output_extension = format.lower()
-                    output_path = os.path.join(processed_dir, f"img_to_{output_extension}_{task_id}.{output_extension}")
-                    task = convert_image_format.delay(file_paths[0], output_path, format)
-                    output_paths = [output_path]
-
-                elif operation == "resize_image":
-                    if len(file_paths) != 1 or not file_paths[0].lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.gif')):
-                        return JsonResponse({"error": "Please upload exactly one image file (JPG, JPEG, PNG, BMP, or GIF)."}, status=400)
-                    output_path = os.path.join(processed_dir, f"resized_image_{task_id}.{os.path.splitext(file_paths[0])[1][1:]}")
-                    task = resize_image_task.delay(file_paths[0], output_path, params)
-                    output_paths = [output_path]
+                        output_path = os.path.join(processed_dir, f"pdf_to_word_{task_id}.docx")
+                        task = submit("pdf_to_word", file_paths[0], output_path, task_id=task_id)
+                        output_paths = [output_path]
+
+                    elif operation == "ppt_to_pdf":
+                        if len(file_paths) != 1 or not file_paths[0].lower().endswith(('.ppt', '.pptx')):
+                            return JsonResponse({"error": "Please upload exactly one PPT or PPTX file."}, status=400)
+                        output_path = os.path.join(processed_dir, f"ppt_to_pdf_{task_id}.pdf")
+                        task = submit("ppt_to_pdf", file_paths[0], output_path, task_id=task_id)
+                        output_paths = [output_path]
+
+                    elif operation == "excel_to_pdf":
+                        if len(file_paths) != 1 or not file_paths[0].lower().endswith(('.xls', '.xlsx')):
+                            return JsonResponse({"error": "Please upload exactly one XLS or XLSX file."}, status=400)
+                        output_path = os.path.join(processed_dir, f"excel_to_pdf_{task_id}.pdf")
+                        task = submit("excel_to_pdf", file_paths[0], output_path, task_id=task_id)
+                        output_paths = [output_path]
+
+                    elif operation == "pdf_to_excel":
+                        if len(file_paths) != 1 or not file_paths[0].lower().endswith('.pdf'):
+                            return JsonResponse({"error": "Please upload exactly one PDF file."}, status=400)
+                        output_path = os.path.join(processed_dir, f"pdf_to_excel_{task_id}.xlsx")
+                        task = submit("pdf_to_excel", file_paths[0], output_path, task_id=task_id)
+                        output_paths = [output_path]
+
+                    elif operation == "pdf_to_ppt":
+                        if len(file_paths) != 1 or not file_paths[0].lower().endswith('.pdf'):
+                            return JsonResponse({"error": "Please upload exactly one PDF file."}, status=400)
+                        output_path = os.path.join(processed_dir, f"pdf_to_ppt_{task_id}.pptx")
+                        task = submit("pdf_to_ppt", file_paths[0], output_path, task_id=task_id)
+                        output_paths = [output_path]
+
+                    elif operation == "convert_image_format":
+                        if not file_paths or not all(path.lower().endswith(('.png', '.jpeg', '.jpg', '.bmp', '.gif')) for path in file_paths):
+                            return JsonResponse({"error": "Please upload one or more image files (PNG, JPEG, JPG, BMP, or GIF)."}, status=400)
+                        format = params.get("format", "JPEG").upper()
+                        if format not in ['PNG', 'JPEG', 'JPG', 'BMP', 'GIF']:
+                            return JsonResponse({"error": f"Unsupported image format: {format}"}, status=400)
+                        output_extension = format.lower()
+                        if len(file_paths) == 1:
+                            output_path = os.path.join(processed_dir, f"img_to_{output_extension}_{task_id}.{output_extension}")
+                            task = submit("convert_image_format", file_paths[0], output_path, format, task_id=task_id)
+                            output_paths = [output_path]
+                        else:
+                            # A batch is one job; outputs are numbered in upload order
+                            output_paths = [
+                                os.path.join(processed_dir, f"img_to_{output_extension}_{task_id}_{i}.{output_extension}")
+                                for i in range(1, len(file_paths) + 1)
+                            ]
+                            task = submit("convert_image_format", file_paths, output_paths, format, task_id=task_id)
+
+                    elif operation == "resize_image":
+                        if not file_paths or not all(path.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.gif')) for path in file_paths):
+                            return JsonResponse({"error": "Please upload one or more image files (JPG, JPEG, PNG, BMP, or GIF)."}, status=400)
+                        if len(file_paths) == 1:
+                            output_path = os.path.join(processed_dir, f"resized_image_{task_id}.{os.path.splitext(file_paths[0])[1][1:]}")
+                            task = submit("resize_image", file_paths[0], output_path, params, task_id=task_id)
+                            output_paths = [output_path]
+                        else:
+                            output_paths = [
+                                os.path.join(processed_dir, f"resized_image_{task_id}_{i}.{os.path.splitext(path)[1][1:]}")
+                                for i, path in enumerate(file_paths, start=1)
+                            ]
+                            task = submit("resize_image", file_paths, output_paths, params, task_id=task_id)
+
+                    elif operation == "pipeline":
+                        if not file_paths:
+                            return JsonResponse({"error": "Please upload at least one file."}, status=400)
+                        try:
+                            steps = normalize_steps(params.get("steps"))
+                        except PipelineError as e:
+                            return JsonResponse({"error": str(e)}, status=400)
+                        task = submit("pipeline", file_paths, steps, os.path.join(processed_dir, f"pipeline_{task_id}"), task_id=task_id)
+                finally:
+                    if fingerprint and not coalesced and task is None:
+                        # Nothing was enqueued under the claim; duplicates mustn't wait on it
+                        release(fingerprint, task_id)
 
                 # Store operation context for suggestions
                 request.session['last_operation'] = {
@@ -520,82 +634,67 @@ def send_message(request):
                 request.session.modified = True
 
                 # Wait for task completion and generate natural response
-                task_result = task.get(timeout=300)  # Increased timeout for robustness
-                files_info = []
-
-                # Handle task result based on operation
-                if operation == "convert_and_compress_images_to_pdf" and "converted" in task_result and "compressed" in task_result:
-                    files_info = [
-                        {
-                            "name": os.path.basename(task_result["converted"]),
-                            "url": f"/api/download/{os.path.basename(task_result['converted'])}",
-                            "size": os.path.getsize(task_result["converted"]),
-                            "type": "application/pdf",
-                            "previewable": True
-                        },
-                        {
-                            "name": os.path.basename(task_result["compressed"]),
-                            "url": f"/api/download/{os.path.basename(task_result['compressed'])}",
-                            "size": os.path.getsize(task_result["compressed"]),
-                            "type": "application/pdf",
-                            "previewable": True
-                        }
-                    ]
-                elif operation == "convert_parallel_operations" and "first_output" in task_result and "second_output" in task_result:
-                    files_info = [
-                        {
-                            "name": os.path.basename(task_result["first_output"]),
-                            "url": f"/api/download/{os.path.basename(task_result['first_output'])}",
-                            "size": os.path.getsize(task_result["first_output"]),
-                            "type": mimetypes.guess_type(task_result["first_output"])[0] or "application/octet-stream",
-                            "previewable": task_result["first_output"].lower().endswith(('.pdf', '.jpg', '.jpeg', '.png'))
-                        },
-                        {
-                            "name": os.path.basename(task_result["second_output"]),
-                            "url": f"/api/download/{os.path.basename(task_result['second_output'])}",
-                            "size": os.path.getsize(task_result["second_output"]),
-                            "type": mimetypes.guess_type(task_result["second_output"])[0] or "application/octet-stream",
-                            "previewable": task_result["second_output"].lower().endswith(('.pdf', '.jpg', '.jpeg', '.png'))
-                        }
-                    ]
-                elif "output" in task_result:  # Handles all single-output operations
-                    file_ext = os.path.splitext(task_result["output"])[1].lower()
-                    previewable = file_ext in ['.pdf', '.jpg', '.jpeg', '.png']
-                    files_info = [{
-                        "name": os.path.basename(task_result["output"]),
-                        "url": f"/api/download/{os.path.basename(task_result['output'])}",
-                        "size": os.path.getsize(task_result["output"]),
-                        "type": mimetypes.guess_type(task_result["output"])[0] or "application/octet-stream",
-                        "previewable": previewable
-                    }]
+                try:
+                    with timed_stage("task_wait"):
+                        task_result = task.get(timeout=settings.TASK_DEADLINE_SECONDS)
+                except TaskCancelled as e:
+                    return JsonResponse({"task_id": task_id, "error": str(e), "cancelled": True}, status=409)
+                except CompressionImpossible as e:
+                    return JsonResponse({"task_id": task_id, "error": str(e)}, status=422)
+                except TaskWaitTimeout:
+                    # Nobody will collect the result any more; stop the worker too
+                    if not coalesced:
+                        cancel(task.id)
+                    return JsonResponse({"task_id": task_id, "error": "The operation took too long and was cancelled."}, status=504)
+                finally:
+                    if fingerprint and not coalesced:
+                        release(fingerprint, task_id)
+                current_timer().merge_worker_stages(task.id)
+                # Described by the worker; nothing here needs to see the files
+                files_info = response_files(task_result.get("manifest"))
+                if "outputs" in task_result:
+                    request.session['last_operation']['output_paths'] = task_result["outputs"]
+                    # With branches the last output may come from another step, so
+                    # take the compressed PDF from the compress_pdf sink itself
+                    compressed = [
+                        path for step in steps if step["operation"] == "compress_pdf"
+                        for path in task_result.get("step_outputs", {}).get(step["id"], [])
+                    ] if operation == "pipeline" else []
+                    if compressed:
+                        request.session['last_compressed_pdf'] = compressed[-1]
+                        # Follow-ups start a new session from this output
+                        request.session.pop('compression_session', None)
+                    request.session.modified = True
 
                 # Generate natural response
-                chat = model.start_chat(history=conversation_history)
+                chat = get_llm_client().start_chat(history=conversation_history)
                 response_prompt = f"""
 The user requested to {intent_data['description']}. The task has completed successfully. 
 The output files are: {json.dumps(files_info, indent=2)}.
 Generate a natural, friendly response that informs the user of the successful operation, mentions the output files with their sizes and download links, and suggests a next step (e.g., compressing further, converting to another format, or editing the file).
 Do not include any markdown or code blocks.
 """
-                response = chat.send_message(response_prompt)
+                with timed_stage("natural_response"):
+                    response = chat.send_message(response_prompt)
                 natural_response = response.text.strip()
                 logger.debug(f"Natural response: {natural_response}")
 
                 # Save assistant response if authenticated
                 if request.user.is_authenticated:
-                    assistant_msg = Message.objects.create(
-                        chat_session=chat_session,
-                        text=natural_response,
-                        sender="assistant",
-                    )
-                    for file_info in files_info:
-                        File.objects.create(
-                            message=assistant_msg,
-                            name=file_info["name"],
-                            url=file_info["url"],
-                            type=file_info["type"],
-                            size=file_info["size"],
+                    with timed_stage("db_insert_response"):
+                        assistant_msg = Message.objects.create(
+                            chat_session=chat_session,
+                            text=natural_response,
+                            sender="assistant",
                         )
+                        for file_info in files_info:
+                            File.objects.create(
+                                message=assistant_msg,
+                                name=file_info["name"],
+                                url=file_info["url"],
+                                type=file_info["type"],
+                                size=file_info["size"],
+                            )
 
                 # Update conversation history
                 conversation_history.append({
@@ -623,12 +722,14 @@ Do not include any markdown or code blocks.
                     "message": natural_response,
                     "files": files_info,
                     "type": "document_response",
-                    "operation": operation
+                    "operation": operation,
+                    "estimate": estimate
                 })
 
             # Handle natural conversation
             else:
                 logger.warning(f"No document operation detected, falling back to conversation: {intent_data}")
+                save_uploads()
                 # Add user message and files to history
                 if user_message:
                     conversation_history.append({
@@ -672,7 +773,7 @@ Do not include any markdown or code blocks.
                         })
 
                 # Start chat with history
-                chat = model.start_chat(history=gemini_history)
+                chat = get_llm_client().start_chat(history=gemini_history)
 
                 # Prepare current message
                 current_message = []
@@ -725,6 +826,8 @@ Do not include any markdown or code blocks.
                                 suggestion_prompt = "The user resized an image. Suggest converting to another format or resizing again."
                             elif operation == "convert_parallel_operations":
                                 suggestion_prompt = "The user performed parallel operations on files. Suggest additional operations like compression or conversion."
+                            elif operation == "pipeline":
+                                suggestion_prompt = "The user ran a chain of document operations. Suggest a further step like compression or converting to another format."
                             suggestion_prompt += " Provide a natural response and include a suggestion for the next task."
 
                         response = chat.send_message(
@@ -805,10 +908,32 @@ def send_message_async(request):
 
 @csrf_exempt
 def stream_response(request, task_id):
+    client = _requester(request)
+
     def stream():
+        last_progress = None
+        deadline = time.monotonic() + settings.TASK_DEADLINE_SECONDS  # send_message waits this long for the worker
         while True:
             data = cache.get(f"stream_{task_id}")
             if not data:
+                # A document operation may still be running in a worker: relay its
+                # progress until send_message stores the final response
+                result = AsyncResult(task_id)
+                progress = task_progress(result)
+                try:
+                    if progress and progress != last_progress:
+                        yield f"data: {json.dumps({'progress': progress})}\n\n"
+                        last_progress = progress
+                except GeneratorExit:
+                    # The client that submitted the job went away while it was running;
+                    # other viewers, or a duplicate attached to it, leave it alone
+                    if not result.ready() and is_owner(task_id, client, alone=True):
+                        logger.info(f"Client disconnected from task {task_id}, cancelling it")
+                        cancel(task_id)
+                    raise
+                if (last_progress is not None or result.state != "PENDING") and time.monotonic() < deadline:
+                    time.sleep(0.25)
+                    continue
                 yield f"data: {json.dumps({'error': 'Task not found'})}\n\n"
                 break
             if data.get("error"):
@@ -829,54 +954,32 @@ def task_status(request, task_id):
         if task.ready():
             if task.successful():
                 result = task.result
-                files = []
-                if "converted" in result and "compressed" in result:
-                    files = [
-                        {
-                            "name": os.path.basename(result["converted"]),
-                            "url": f"/api/download/{os.path.basename(result['converted'])}",
-                            "size": os.path.getsize(result["converted"]),
-                            "type": "application/pdf"
-                        },
-                        {
-                            "name": os.path.basename(result["compressed"]),
-                            "url": f"/api/download/{os.path.basename(result['compressed'])}",
-                            "size": os.path.getsize(result["compressed"]),
-                            "type": "application/pdf"
-                        },
-                    ]
-                elif "first_output" in result and "second_output" in result:
-                    files = [
-                        {
-                            "name": os.path.basename(result["first_output"]),
-                            "url": f"/api/download/{os.path.basename(result['first_output'])}",
-                            "size": os.path.getsize(result["first_output"]),
-                            "type": mimetypes.guess_type(result["first_output"])[0] or "application/octet-stream"
-                        },
-                        {
-                            "name": os.path.basename(result["second_output"]),
-                            "url": f"/api/download/{os.path.basename(result['second_output'])}",
-                            "size": os.path.getsize(result["second_output"]),
-                            "type": mimetypes.guess_type(result["second_output"])[0] or "application/octet-stream"
-                        },
-                    ]
-                elif "output" in result:
-                    files = [
-                        {
-                            "name": os.path.basename(result["output"]),
-                            "url": f"/api/download/{os.path.basename(result['output'])}",
-                            "size": os.path.getsize(result["output"]),
-                            "type": mimetypes.guess_type(result["output"])[0] or "application/octet-stream"
-                        }
-                    ]
+                files = response_files(result.get("manifest"))
                 return JsonResponse({"status": "SUCCESS", "files": files})
             else:
                 return JsonResponse({"status": "FAILURE", "error": str(task.result)})
-        return JsonResponse({"status": "PENDING"})
+        progress = task_progress(task)
+        estimate = caches["shared"].get(f"task_estimate_{task_id}")
+        if progress:
+            return JsonResponse({"status": "PROGRESS", "progress": progress, "estimate": estimate})
+        return JsonResponse({"status": "PENDING", "estimate": estimate})
     except Exception as e:
         logger.error(f"Error in task_status: {str(e)}", exc_info=True)
         return JsonResponse({"error": str(e)}, status=500)
 
+@csrf_exempt
+def cancel_task(request, task_id):
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request"}, status=400)
+    try:
+        if not is_owner(task_id, _requester(request)):
+            return JsonResponse({"error": "Task not found or not authorized"}, status=404)
+        cancel(task_id)
+        return JsonResponse({"task_id": task_id, "status": "CANCELLING"})
+    except Exception as e:
+        logger.error(f"Error in cancel_task: {str(e)}", exc_info=True)
+        return JsonResponse({"error": str(e)}, status=500)
+
 @csrf_exempt
 def download_file(request, file_path):
     try:
@@ -885,11 +988,13 @@ def download_file(request, file_path):
 
         logger.info(f"Download request for: {safe_file_path}")
 
-        if not os.path.exists(full_path):
+        storage = get_storage()
+        name = storage_name(full_path)
+        if not storage.exists(name):
             logger.error(f"File not found: {full_path}")
             return JsonResponse({"error": "File not found"}, status=404)
 
-        file_size = os.path.getsize(full_path)
+        file_size = storage.size(name)
         if file_size == 0:
             logger.error(f"File is empty: {full_path}")
             return JsonResponse({"error": "File is empty"}, status=500)
@@ -898,19 +1003,90 @@ def download_file(request, file_path):
         if not content_type:
             content_type = 'application/pdf' if full_path.lower().endswith('.pdf') else 'image/jpeg'
 
-        logger.info(f"Serving file: {safe_file_path}, Size: {file_size} bytes, Content-Type: {content_type}")
+        try:
+            byte_range = parse_range(request.headers.get("Range"), file_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{file_size}"
+            return response
 
-        file = open(full_path, 'rb')
-        response = FileResponse(
-            file,
-            as_attachment=True,
-            filename=safe_file_path,
-            content_type=content_type
-        )
-        response['Content-Length'] = file_size
+        logger.info(f"Serving file: {safe_file_path}, Size: {file_size} bytes, Content-Type: {content_type}, Range: {byte_range}")
+
+        if byte_range:
+            # Resuming: only the rest of the file is read from storage
+            start, end = byte_range
+            response = StreamingHttpResponse(storage.read_range(name, start, end), status=206, content_type=content_type)
+            response['Content-Range'] = f"bytes {start}-{end}/{file_size}"
+            response['Content-Length'] = end - start + 1
+        else:
+            response = FileResponse(
+                storage.open(name),
+                as_attachment=True,
+                filename=safe_file_path,
+                content_type=content_type
+            )
+            response['Content-Length'] = file_size
+        response['Accept-Ranges'] = "bytes"
         response['Content-Disposition'] = f'attachment; filename="{safe_file_path}"'
         return response
 
     except Exception as e:
         logger.error(f"Error downloading file {safe_file_path}: {str(e)}", exc_info=True)
-        return JsonResponse({"error": f"Download failed: {str(e)}"}, status=500)
\ No newline at end of file
+        return JsonResponse({"error": f"Download failed: {str(e)}"}, status=500)
+
+@login_required
+def download_chat_zip(request, chat_id):
+    """
+    All the output files of a chat as one ZIP, or only those named by
+    `file` query parameters. The archive is streamed straight from
+    storage and answers Range requests, so downloads can resume.
+    """
+    try:
+        chat = ChatSession.objects.get(id=chat_id, user=request.user)
+    except (ChatSession.DoesNotExist, ValueError):
+        return JsonResponse({"error": "Chat not found or not authorized"}, status=404)
+
+    wanted = set(request.GET.getlist("file"))
+    storage = get_storage()
+    members = []
+    names = set()
+    for file in File.objects.filter(message__chat_session=chat, url__startswith="/api/download/").order_by("created_at"):
+        name = unquote(os.path.basename(file.url.rstrip("/")))
+        stored = storage_name(os.path.join(settings.PROCESSED_DIR, name))
+        if name in names or (wanted and name not in wanted) or not storage.exists(stored):
+            continue
+        names.add(name)
+        members.append((name, stored))
+    if not members:
+        return JsonResponse({"error": "No output files to download"}, status=404)
+
+    try:
+        archive = ZipStream(members)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=413)
+
+    # A resumed download only gets a range of the archive it started on
+    byte_range = None
+    if request.headers.get("If-Range", archive.etag) == archive.etag:
+        try:
+            byte_range = parse_range(request.headers.get("Range"), archive.size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{archive.size}"
+            return response
+
+    start, end = byte_range or (0, archive.size - 1)
+    response = StreamingHttpResponse(archive.iter_bytes(start, end), content_type="application/zip",
+                                     status=206 if byte_range else 200)
+    if byte_range:
+        response['Content-Range'] = f"bytes {start}-{end}/{archive.size}"
+    response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = "bytes"
+    response['ETag'] = archive.etag
+    response['Content-Disposition'] = f'attachment; filename="chat_{chat.id}.zip"'
+    logger.info(f"Streaming {len(members)} files of chat {chat.id} as a ZIP, bytes {start}-{end} of {archive.size}")
+    return response
+
+def metrics(request):
+    payload, content_type = render_metrics()
+    return HttpResponse(payload, content_type=content_type)
@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from django.conf import settings
+from .cancellation import TaskCancelled
+from .storage import localize, publish
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = "checkpoints.json"
+
+
+class ScratchWorkspace:
+    """
+    Isolated scratch directory for one task invocation. Jobs whose expected
+    footprint fits SCRATCH_TMPFS_BUDGET are placed on RAM-backed tmpfs,
+    everything else under SCRATCH_DIR. The directory name is derived from the
+    task id, so a retry of the same task finds the same workspace together with
+    the checkpoints its earlier attempts recorded (see stage()).
+    """
+
+    def __init__(self, task_id, expected_bytes=0):
+        self.task_id = str(task_id or uuid.uuid4())
+        self.expected_bytes = expected_bytes
+        root = self._existing_root(self.task_id) or self._choose_root(expected_bytes)
+        self.path = os.path.join(root, f"task_{self.task_id}")
+        self.on_tmpfs = root == settings.SCRATCH_TMPFS_DIR
+        os.makedirs(self.path, exist_ok=True)
+        self._checkpoint_lock = threading.Lock()
+        self._checkpoints = self._load_checkpoints()
+        logger.debug(f"Scratch workspace for {self.task_id} at {self.path} (tmpfs: {self.on_tmpfs})")
+
+    @staticmethod
+    def _roots():
+        return [root for root in (settings.SCRATCH_TMPFS_DIR, settings.SCRATCH_DIR) if root]
+
+    @classmethod
+    def _existing_root(cls, task_id):
+        for root in cls._roots():
+            if os.path.isdir(os.path.join(root, f"task_{task_id}")):
+                return root
+        return None
+
+    @staticmethod
+    def _choose_root(expected_bytes):
+        tmpfs_dir = settings.SCRATCH_TMPFS_DIR
+        if tmpfs_dir and os.path.isdir(tmpfs_dir):
+            # Intermediates (resized copies, uncompressed PDFs) take a few times the input size
+            footprint = expected_bytes * settings.SCRATCH_FOOTPRINT_FACTOR
+            try:
+                free = shutil.disk_usage(tmpfs_dir).free
+            except OSError:
+                free = 0
+            if footprint <= settings.SCRATCH_TMPFS_BUDGET and footprint < free:
+                return tmpfs_dir
+        os.makedirs(settings.SCRATCH_DIR, exist_ok=True)
+        return settings.SCRATCH_DIR
+
+    def path_for(self, name):
+        return os.path.join(self.path, os.path.basename(name))
+
+    def publish(self, scratch_path, final_path):
+        """
+        Durably and atomically store a finished artifact as final_path. The
+        scratch copy is left in place so the checkpoints that point at it
+        stay valid until the workspace is removed.
+        """
+        return publish(scratch_path, final_path)
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    # Checkpoints
+
+    def _load_checkpoints(self):
+        try:
+            with open(os.path.join(self.path, CHECKPOINT_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable checkpoints in {self.path}: {str(e)}")
+            return {}
+
+    def restore(self, name):
+        """Result recorded for stage `name`, or None if it never completed or its files are gone."""
+        with self._checkpoint_lock:
+            result = self._checkpoints.get(name)
+        if result is None or not all(os.path.exists(p) for p in _paths_in(result)):
+            return None
+        return result
+
+    def record(self, name, result):
+        with self._checkpoint_lock:
+            self._checkpoints[name] = result
+            manifest = os.path.join(self.path, CHECKPOINT_FILE)
+            with open(f"{manifest}.tmp", "w", encoding="utf-8") as f:
+                json.dump(self._checkpoints, f)
+            os.replace(f"{manifest}.tmp", manifest)
+
+    def stage(self, name, fn, *args, **kwargs):
+        """
+        Runs fn(*args, **kwargs) as the checkpointed stage `name`. Its result
+        must be JSON-serializable and not None, typically the path(s) it wrote.
+        When an earlier attempt of the task already completed the stage and
+        every absolute path in its result still exists, that result is
+        returned without running fn again.
+        """
+        result = self.restore(name)
+        if result is not None:
+            logger.info(f"Task {self.task_id} resuming after completed stage {name}")
+            return result
+        result = fn(*args, **kwargs)
+        self.record(name, result)
+        return result
+
+
+def _paths_in(result):
+    if isinstance(result, str):
+        return [result] if os.path.isabs(result) else []
+    if isinstance(result, dict):
+        result = list(result.values())
+    if isinstance(result, (list, tuple)):
+        return [path for item in result for path in _paths_in(item)]
+    return []
+
+
+def discard_workspace(task_id):
+    """Removes a task's workspace wherever it lives, once no retry will need it."""
+    for root in ScratchWorkspace._roots():
+        shutil.rmtree(os.path.join(root, f"task_{task_id}"), ignore_errors=True)
+
+
+@contextmanager
+def task_workspace(task, input_paths=()):
+    """
+    Workspace for a bound Celery task. It is torn down when the body succeeds,
+    is cancelled or fails on the final attempt; on a retryable failure it is
+    kept so the next attempt can reuse its contents.
+    """
+    # Inputs uploaded through another node are fetched from storage first
+    for path in input_paths:
+        localize(path)
+    expected_bytes = sum(os.path.getsize(p) for p in input_paths if p and os.path.exists(p))
+    workspace = ScratchWorkspace(task.request.id, expected_bytes)
+    try:
+        yield workspace
+    except TaskCancelled:
+        workspace.cleanup()
+        raise
+    except Exception:
+        if task.request.retries >= task.max_retries:
+            workspace.cleanup()
+        raise
+    workspace.cleanup()
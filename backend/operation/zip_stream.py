@@ -0,0 +1,210 @@
+import hashlib
+import logging
+import re
+import struct
+import time
+import zlib
+from contextlib import closing
+from django.core.cache import caches
+from .storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# Formats that are compressed already; deflating them again costs CPU and saves nothing
+STORED_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png", ".gif", ".webp", ".docx", ".xlsx", ".pptx", ".zip")
+
+# Without ZIP64 records, offsets and sizes are 32-bit and entries are counted in 16 bits
+MAX_ARCHIVE_BYTES = 0xFFFFFFFF
+MAX_ENTRIES = 0xFFFF
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+DEFLATE_LEVEL = 6
+VERSION = 20  # 2.0: deflate
+UTF8_NAMES = 0x800
+
+LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+END_RECORD = struct.Struct("<4s4H2LH")
+
+
+def _dos_time(mtime):
+    year, month, day, hour, minute, second = time.localtime(max(mtime, 315532800))[:6]  # ZIP dates start in 1980
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+def _deflated(f):
+    """Yields the raw deflate stream of an open file, chunk by chunk; the same file always gives the same bytes."""
+    compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _measure(storage, name, size, modified, method):
+    """(CRC-32, compressed size) of a stored file, read once in chunks and cached against its size and mtime."""
+    key = "zip_entry_" + hashlib.sha1(f"{name}|{size}|{modified}|{method}".encode()).hexdigest()
+    try:
+        cached = caches["shared"].get(key)
+    except Exception as e:
+        logger.warning(f"Could not read cached ZIP entry sizes: {str(e)}")
+        cached = None
+    if cached is not None:
+        return tuple(cached)
+
+    crc = 0
+    compressed_size = size
+    if method == ZIP_DEFLATED:
+        compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed_size = 0
+    for chunk in storage.read_range(name):
+        crc = zlib.crc32(chunk, crc)
+        if method == ZIP_DEFLATED:
+            compressed_size += len(compressor.compress(chunk))
+    if method == ZIP_DEFLATED:
+        compressed_size += len(compressor.flush())
+    try:
+        caches["shared"].set(key, (crc, compressed_size), timeout=None)
+    except Exception as e:
+        logger.warning(f"Could not cache ZIP entry sizes: {str(e)}")
+    return crc, compressed_size
+
+
+class ZipEntry:
+
+    def __init__(self, name, stored_name, storage):
+        self.name = name
+        self.encoded_name = name.encode("utf-8")
+        self.stored_name = stored_name
+        self.storage = storage
+        self.size = storage.size(stored_name)
+        self.mtime = storage.modified(stored_name)
+        self.method = ZIP_STORED if name.lower().endswith(STORED_EXTENSIONS) else ZIP_DEFLATED
+        self.crc, self.compressed_size = _measure(storage, stored_name, self.size, self.mtime, self.method)
+        self.offset = 0
+
+    def local_header(self):
+        mod_time, mod_date = _dos_time(self.mtime)
+        return LOCAL_HEADER.pack(
+            b"PK\x03\x04", VERSION, 0, UTF8_NAMES, self.method, mod_time, mod_date,
+            self.crc, self.compressed_size, self.size, len(self.encoded_name), 0,
+        ) + self.encoded_name
+
+    def central_header(self):
+        mod_time, mod_date = _dos_time(self.mtime)
+        return CENTRAL_HEADER.pack(
+            b"PK\x01\x02", VERSION, 3, VERSION, 0, UTF8_NAMES, self.method, mod_time, mod_date,
+            self.crc, self.compressed_size, self.size, len(self.encoded_name), 0, 0, 0, 0,
+            0o100644 << 16, self.offset,
+        ) + self.encoded_name
+
+    def data(self, skip=0):
+        """The entry's stored or deflated bytes, from `skip` bytes in."""
+        if self.method == ZIP_STORED:
+            yield from self.storage.read_range(self.stored_name, skip)
+            return
+        with closing(self.storage.open(self.stored_name)) as f:
+            # Deflated data can't be entered midway: regenerate it and drop what was already sent
+            for data in _deflated(f):
+                if skip >= len(data):
+                    skip -= len(data)
+                    continue
+                yield data[skip:]
+                skip = 0
+
+
+class ZipStream:
+    """
+    A ZIP archive of `members` ([(name in archive, storage name)]) that is
+    never written anywhere: its layout, and so its exact length, is worked
+    out up front from each file's size and CRC, and any byte range of it can
+    then be produced straight from storage in CHUNK_SIZE pieces. The same files
+    always give the same bytes, so an interrupted download can resume from
+    where it stopped. Files in STORED_EXTENSIONS are stored as they are,
+    everything else deflated.
+
+    Raises ValueError for archives that would need ZIP64.
+    """
+
+    def __init__(self, members):
+        if len(members) > MAX_ENTRIES:
+            raise ValueError(f"A ZIP download can hold at most {MAX_ENTRIES} files.")
+        storage = get_storage()
+        self.entries = [ZipEntry(name, stored_name, storage) for name, stored_name in members]
+        # (length, produce(skip)) for every piece of the archive, in order
+        self.segments = []
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            header = entry.local_header()
+            self.segments.append((len(header), _bytes_from(header)))
+            self.segments.append((entry.compressed_size, entry.data))
+            offset += len(header) + entry.compressed_size
+        directory = b"".join(entry.central_header() for entry in self.entries)
+        end = END_RECORD.pack(b"PK\x05\x06", 0, 0, len(self.entries), len(self.entries), len(directory), offset, 0)
+        self.segments.append((len(directory) + len(end), _bytes_from(directory + end)))
+        self.size = offset + len(directory) + len(end)
+        if offset > MAX_ARCHIVE_BYTES or any(entry.size > MAX_ARCHIVE_BYTES for entry in self.entries):
+            raise ValueError("This download would be over 4 GiB; please choose fewer files.")
+
+    @property
+    def etag(self):
+        """Changes whenever any member's name, content or position does."""
+        digest = hashlib.sha1()
+        for entry in self.entries:
+            digest.update(f"{entry.name}|{entry.size}|{entry.crc}|{entry.offset}\n".encode("utf-8"))
+        return f'"{digest.hexdigest()}"'
+
+    def iter_bytes(self, start=0, end=None):
+        """Yields bytes start..end (inclusive, as in an HTTP Range) of the archive."""
+        end = self.size - 1 if end is None else min(end, self.size - 1)
+        position = 0
+        for length, produce in self.segments:
+            if position + length <= start:
+                position += length
+                continue
+            if position > end:
+                break
+            skip = max(0, start - position)
+            remaining = min(length, end + 1 - position) - skip
+            chunks = produce(skip)
+            try:
+                for data in chunks:
+                    if len(data) >= remaining:
+                        yield data[:remaining]
+                        break
+                    yield data
+                    remaining -= len(data)
+            finally:
+                chunks.close()  # Closes the member's file when the range ends inside it
+            position += length
+
+
+def _bytes_from(data):
+    def produce(skip=0):
+        yield data[skip:]
+    return produce
+
+
+def parse_range(header, size):
+    """
+    (start, end) of a single-range "bytes=..." Range header, None when there
+    is no usable one (the whole body is sent), or raises ValueError when the
+    range lies outside the `size` bytes available.
+    """
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header or "")
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last `last` bytes
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Range {header} is outside the {size} bytes available")
+    return start, end